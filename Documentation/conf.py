@@ -20,10 +20,17 @@ html_theme = 'sphinx_rtd_theme'
 extensions += ['sphinx_rtd_theme']
 
 man_pages = [
+    ('manpages/scag-bench-startup', 'scag-bench-startup', 'Benchmark cold start of Gramine Scaffolding images', _man_pages_author, 1),
     ('manpages/scag-build', 'scag-build', 'Build Gramine Scaffolding application', _man_pages_author, 1),
     ('manpages/scag-client', 'scag-client', 'HTTPS client with attestation verifier', _man_pages_author, 1),
+    ('manpages/scag-daemon', 'scag-daemon', 'Gramine Scaffolding build daemon', _man_pages_author, 1),
     ('manpages/scag-detect', 'scag-detect', 'Scaffolding autodetector', _man_pages_author, 1),
+    ('manpages/scag-gc', 'scag-gc', 'Remove unused Gramine Scaffolding images', _man_pages_author, 1),
+    ('manpages/scag-inspect', 'scag-inspect', 'Inspect saved Gramine Scaffolding images', _man_pages_author, 1),
+    ('manpages/scag-profile', 'scag-profile', 'Profile Gramine Scaffolding application', _man_pages_author, 1),
+    ('manpages/scag-resign', 'scag-resign', 'Re-sign Gramine Scaffolding images', _man_pages_author, 1),
     ('manpages/scag-quickstart', 'scag-quickstart', 'Build Gramine Scaffolding application', _man_pages_author, 1),
+    ('manpages/scag-run', 'scag-run', 'Run replicas of Gramine Scaffolding application', _man_pages_author, 1),
     ('manpages/scag-setup', 'scag-setup', 'Build Gramine Scaffolding application', _man_pages_author, 1),
 ]
 
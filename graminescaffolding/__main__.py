@@ -2,23 +2,38 @@
 # Copyright (C) 2023 Intel Corporation
 #                    Wojtek Porczyk <woju@invisiblethingslab.com>
 #                    Mariusz Zaborski <oshogbo@invisiblethingslab.com>
-# pylint: disable=too-many-arguments
+# pylint: disable=too-many-arguments,too-many-positional-arguments
 
 import functools
+import json
 import os
 import pathlib
+import signal
 import subprocess
 import sys
+import tarfile
 import textwrap
 import tomli
 
 import click
+import docker
+import jinja2
 
 #from .frameworks.common.builder import GramineBuilder
 from . import (
+    bench as _bench,
+    buildcache as _buildcache,
     builder as _builder,
+    buildregistry as _buildregistry,
     client as _client,
+    daemon as _daemon,
+    profiling as _profiling,
+    prune as _prune,
+    replicas as _replicas,
+    sigstruct as _sigstruct,
+    tarindex,
     utils,
+    watch as _watch,
 )
 from .utils import (
     GramineExtendedSetupHelp,
@@ -183,12 +198,90 @@ def setup(ctx, framework, project_dir, bootstrap, passthrough_env, args):
         ' additional decorators.')
 @click.option('--and-run', is_flag=True,
     help='Automatically run the application after build')
+@click.option('--measure-only', is_flag=True,
+    help='Only compute the measurement and print MRENCLAVE and other'
+        ' SIGSTRUCT fields as JSON, without building the final image.')
+@click.option('--check-reproducible', is_flag=True,
+    help='Build twice from scratch and compare SHA-256 of rootfs tarball and'
+        ' MRENCLAVE; print them as JSON and exit with 1 if they differ.')
+@click.option('--watch', is_flag=True,
+    help='After build, watch the project directory and rebuild on changes.'
+        ' With --and-run, the application is restarted after each rebuild.')
+@click.option('--debounce', type=float, default=0.5, show_default=True,
+    metavar='SECONDS',
+    help='With --watch, wait until there are no changes for this long before'
+        ' rebuilding.')
+@click.option('--daemon', 'use_daemon', is_flag=True,
+    help='Run the build in build daemon (see "scag daemon").')
+@click.option('--daemon-socket', type=click.Path(dir_okay=False),
+    envvar='SCAG_DAEMON_SOCKET',
+    help='Socket of the build daemon (implies --daemon).')
+@click.option('--metrics', 'metrics_file', type=click.File('w'),
+    help='Write metrics of docker builds (duration and cache use of each'
+        ' Dockerfile instruction) as JSON to this file.')
+@click.option('--cache-from', type=click.Path(file_okay=False),
+    help='Restore images and caches from this directory before build.')
+@click.option('--cache-to', type=click.Path(file_okay=False),
+    help='Store images and caches to this directory after build.')
 @click.pass_context
-def build(ctx, project_dir, conf, print_only_image, and_run):
+def build(ctx, project_dir, conf, print_only_image, and_run, measure_only,
+        check_reproducible, watch, debounce, use_daemon, daemon_socket,
+        metrics_file, cache_from, cache_to):
     """
     Build Gramine application using Scaffolding framework.
     """
-    docker_id, docker_run_cmd = build_step(ctx, project_dir, conf)
+    # pylint: disable=too-many-locals
+    if watch:
+        check_incompatible_options(ctx, '--watch', {
+            '--daemon': use_daemon,
+            '--daemon-socket': daemon_socket,
+            '--measure-only': measure_only,
+            '--check-reproducible': check_reproducible,
+            '--cache-from': cache_from,
+            '--cache-to': cache_to,
+            '--metrics': metrics_file,
+            '--print-only-image': print_only_image,
+        })
+        return watch_step(ctx, project_dir, conf, and_run, debounce)
+
+    plain_build = not (use_daemon or daemon_socket or measure_only
+        or check_reproducible)
+    if (cache_from or cache_to) and not plain_build:
+        ctx.fail('--cache-from and --cache-to can be used only with plain'
+            ' build')
+
+    if check_reproducible:
+        if use_daemon or daemon_socket or measure_only or and_run:
+            ctx.fail('--check-reproducible can\'t be used with --daemon,'
+                ' --measure-only or --and-run')
+        return check_reproducible_step(ctx, project_dir, conf, metrics_file)
+
+    if use_daemon or daemon_socket:
+        result = daemon_step(ctx, daemon_socket, {
+            'command': 'measure' if measure_only else 'build',
+            'project_dir': os.path.abspath(project_dir),
+            'conf': conf,
+        })
+        write_metrics(metrics_file, result['metrics'])
+        if measure_only:
+            print(json.dumps(result['sigstruct'], indent=4))
+            return 0
+        # the command is not taken from the daemon, only the image ID
+        docker_id = result['image']
+        docker_run_cmd = load_builder(ctx, project_dir,
+            conf).get_docker_run_cmd(docker_id)
+
+    elif measure_only:
+        builder = load_builder(ctx, project_dir, conf)
+        sig = builder.measure()
+        write_metrics(metrics_file, builder.build_metrics)
+        print(json.dumps(_sigstruct.parse_sigstruct(sig), indent=4))
+        return 0
+
+    else:
+        docker_id, docker_run_cmd = build_step(ctx, project_dir, conf,
+            metrics_file, cache_from, cache_to)
+
     if docker_id:
         if print_only_image:
             print(docker_id)
@@ -200,9 +293,18 @@ def build(ctx, project_dir, conf, print_only_image, and_run):
 
     return 0
 
-def build_step(ctx, project_dir, conf):
+def check_incompatible_options(ctx, option, others):
     """
-    Real steps for build Gramine application using Scaffolding framework.
+    Fail if any of other options (mapping of option name to its value) was
+    given together with *option*.
+    """
+    used = [name for name, value in others.items() if value]
+    if used:
+        ctx.fail(f'{option} can\'t be used with {", ".join(used)}')
+
+def load_builder(ctx, project_dir, conf):
+    """
+    Load scaffolding configuration and create builder for the framework.
     """
     project_dir = pathlib.Path(project_dir)
     confpath = project_dir / conf
@@ -213,12 +315,452 @@ def build_step(ctx, project_dir, conf):
         data = tomli.load(file)
 
     buildertype = gramine_load_framework(data['application']['framework'])
-    builder = buildertype(project_dir, data)
+    return buildertype(project_dir, data)
 
+def check_reproducible_step(ctx, project_dir, conf, metrics_file=None):
+    """
+    Build twice and compare the results, exit with 1 if they differ.
+    """
+    builder = load_builder(ctx, project_dir, conf)
+    report = builder.check_reproducible()
+    write_metrics(metrics_file, builder.build_metrics)
+    print(json.dumps(report, indent=4))
+    if not report['reproducible']:
+        ctx.exit(1)
+    return 0
+
+def build_step(ctx, project_dir, conf, metrics_file=None, cache_from=None,
+        cache_to=None):
+    """
+    Real steps for build Gramine application using Scaffolding framework.
+    """
+    builder = load_builder(ctx, project_dir, conf)
+    if cache_from is not None or cache_to is not None:
+        # hashes of trusted files are kept in the build cache, so that they
+        # don't need to be computed again when signing
+        builder.trusted_files_cache = (builder.scag_dir
+            / 'trusted-files-cache.json')
+    if cache_from is not None:
+        if not _buildcache.import_cache(builder, cache_from):
+            click.echo(f'No build cache in {cache_from}, building from scratch',
+                err=True)
     docker_id = builder.build()
+    write_metrics(metrics_file, builder.build_metrics)
+    if cache_to is not None:
+        _buildcache.export_cache(builder, cache_to)
 
     return docker_id, builder.get_docker_run_cmd(docker_id)
 
+def write_metrics(metrics_file, metrics):
+    if metrics_file is not None:
+        json.dump(metrics, metrics_file, indent=4)
+        metrics_file.write('\n')
+
+def daemon_step(ctx, socket_path, message):
+    """
+    Send request to build daemon, copying its log to stderr.
+    """
+    if socket_path is None:
+        socket_path = _daemon.get_default_socket_path()
+
+    def log(response):
+        if 'log' in response:
+            click.echo(response['log'], err=True, nl=False)
+        elif response.get('status') == 'queued':
+            click.echo('Waiting for build daemon...', err=True)
+
+    result = None
+    try:
+        result = _daemon.send_request(socket_path, message, log=log)
+    except OSError as err:
+        ctx.fail(f'cannot connect to build daemon at {socket_path}: {err}')
+    except RuntimeError as err:
+        ctx.fail(f'build failed: {err}')
+    return result
+
+def watch_step(ctx, project_dir, conf, and_run, debounce):
+    """
+    Build, then watch the project and rebuild on changes. Changes of the
+    configuration or templates rerun all steps, while other changes rebuild
+    only the application image on top of cached rootfs and base images, and
+    sign it again using cached hashes of trusted files.
+    """
+    # pylint: disable=too-many-locals
+    project_dir = pathlib.Path(project_dir)
+    builder = load_builder(ctx, project_dir, conf)
+    config_paths = [project_dir / conf]
+    templates = builder.config['application'].get('templates')
+    if templates is not None:
+        config_paths.append(project_dir / templates)
+
+    proc = None
+    shared_images = None
+    change = _watch.Change.CONFIG
+
+    with _watch.ProjectWatcher(project_dir,
+            builder.scag_dir / 'Dockerfile.dockerignore',
+            config_paths=config_paths,
+            exclude=[builder.scag_dir]) as watcher:
+        while True:
+            try:
+                if _watch.Change.CONFIG in change or shared_images is None:
+                    # if anything below fails, all steps are rerun on the next
+                    # change, not only the application image
+                    shared_images = None
+                    builder = load_builder(ctx, project_dir, conf)
+                    builder.trusted_files_cache = (builder.scag_dir
+                        / 'trusted-files-cache.json')
+                    builder.render_templates()
+                    watcher.reload_ignore()
+                    rootfs_image = builder.get_rootfs_image()
+                    shared_images = (rootfs_image,
+                        builder.get_base_image(rootfs_image),
+                        builder.get_runtime_image(rootfs_image))
+
+                image, mrenclave = builder.sign_docker_image(
+                    builder.build_app_image(*shared_images))
+                builder.render_client_config(mrenclave)
+            except (docker.errors.BuildError, docker.errors.APIError,
+                    subprocess.CalledProcessError, ValueError,
+                    jinja2.TemplateError, tomli.TOMLDecodeError) as err:
+                click.echo(f'Build failed: {err}', err=True)
+            except KeyError as err:
+                # from load_builder(), when the framework in configuration was
+                # changed to unknown one or removed
+                click.echo(f'Build failed: unknown framework or missing'
+                    f' configuration key {err}', err=True)
+            else:
+                docker_run_cmd = builder.get_docker_run_cmd(image.id)
+                print_docker_usage(image.id, docker_run_cmd)
+                if and_run:
+                    _stop_process(proc)
+                    # pylint: disable=consider-using-with
+                    proc = subprocess.Popen(docker_run_cmd)
+
+            click.echo('Watching for changes...', err=True)
+            try:
+                change = watcher.wait(debounce)
+            except KeyboardInterrupt:
+                _stop_process(proc)
+                return 0
+
+def _stop_process(proc):
+    if proc is not None and proc.poll() is None:
+        proc.terminate()
+        proc.wait()
+
+def load_signer(ctx, name, options):
+    """
+    Load signer by name and instantiate it with options given as
+    ``KEY=VALUE`` strings.
+    """
+    kwds = {}
+    for option in options:
+        key, sep, value = option.partition('=')
+        if not sep:
+            ctx.fail(f'invalid signer option {option!r}, expected KEY=VALUE')
+        kwds[key.replace('-', '_')] = value
+
+    signer = None
+    try:
+        signer = utils.gramine_load_signer(name)(**kwds)
+    except TypeError as err:
+        ctx.fail(f'invalid options for signer {name!r}: {err}')
+    except (OSError, ValueError) as err:
+        ctx.fail(f'cannot create signer {name!r}: {err}')
+    except ImportError as err:
+        ctx.fail(f'signer {name!r} is not available: {err}')
+    return signer
+
+@main.command('resign')
+@click.option('--signer', 'signer_name', default='local',
+    type=click.Choice(utils.gramine_list_signers()),
+    help='Signer to use (by default local key file).')
+@click.option('--signer-option', '-o', 'signer_options', metavar='KEY=VALUE',
+    multiple=True,
+    help='Option for the signer, can be given multiple times (e.g. key=PATH'
+        ' for local signer, or command=CMD and public_key=PATH for command'
+        ' signer).')
+@click.option('--retag', is_flag=True,
+    help='Move tags of the original images to re-signed images.')
+@click.argument('images', nargs=-1, required=True)
+@click.pass_context
+def resign(ctx, signer_name, signer_options, retag, images):
+    """
+    Sign the enclave in existing images again (e.g. with production key),
+    without rebuilding them. Measurement is retained, only SIGSTRUCT is
+    replaced in a new layer on top of each image. Prints IDs of new images.
+    """
+    signer = load_signer(ctx, signer_name, signer_options)
+
+    docker_client = docker.from_env()
+    for name in images:
+        try:
+            image = docker_client.images.get(name)
+            image2 = _builder.resign_docker_image(docker_client, image,
+                signer)
+        except (ValueError, docker.errors.NotFound) as err:
+            ctx.fail(f'{name}: {err}')
+        if retag:
+            for tag in image.tags:
+                image2.tag(tag)
+        print(f'{name} {image2.id}')
+
+@main.command('inspect')
+@click.option('--sigstruct', 'sigstruct_path', metavar='PATH',
+    default='/app/app.sig', show_default=True,
+    help='Path to SIGSTRUCT inside the image.')
+@click.option('--manifest', 'manifest_path', metavar='PATH',
+    default='/app/app.manifest.sgx', show_default=True,
+    help='Path to app.manifest.sgx inside the image.')
+@click.option('--cat', 'cat_paths', metavar='PATH', multiple=True,
+    help='Instead of the report, write contents of this file from the image'
+        ' to standard output. Can be given multiple times.')
+@click.option('--cache/--no-cache', default=True,
+    help='Cache index of the tarball (by default in ~/.cache/scag/index).')
+@click.argument('tarball', type=click.Path(exists=True, dir_okay=False))
+@click.pass_context
+def inspect(ctx, sigstruct_path, manifest_path, cat_paths, cache, tarball):
+    """
+    Inspect saved image (output of "docker save") or rootfs tarball without
+    extracting it. Prints MRENCLAVE, MRSIGNER and other SIGSTRUCT fields, and
+    hash of app.manifest.sgx as JSON.
+    """
+    cache_dir = _builder.get_default_cache_dir() / 'index' if cache else None
+    try:
+        with tarindex.TarIndex(tarball, cache_dir=cache_dir) as index:
+            if cat_paths:
+                for path in cat_paths:
+                    sys.stdout.buffer.write(index.read(path))
+                return 0
+            report = index.inspect(sigstruct_path, manifest_path)
+    except KeyError as err:
+        ctx.fail(f'file not found in the image: {err}')
+    except (ValueError, tarfile.TarError) as err:
+        ctx.fail(f'{tarball}: {err}')
+
+    print(json.dumps(report, indent=4))
+    return 0
+
+@main.command('profile')
+@click.option('--conf', default=_builder.SCAG_CONFIG_FILE,
+    type=str,
+    help='The filename of the scaffolding configuration file relative to'
+        ' --project_dir.')
+@click.option('--project_dir', type=click.Path(dir_okay=True, file_okay=False),
+    default=os.getcwd(),
+    help='The directory of the application to profile.')
+@click.option('--image', 'image_id', metavar='IMAGE',
+    help='Profile this image instead of building the project.')
+@click.option('--output', '-o', 'output_dir', default='scag-profile',
+    type=click.Path(dir_okay=True, file_okay=False), show_default=True,
+    help='Directory for Gramine log, perf data and summary.json.')
+@click.option('--top', type=click.IntRange(min=1), default=20,
+    show_default=True, help='Number of hotspots to show.')
+@click.option('--timeout', type=click.FloatRange(min=0),
+    help='Stop the application after this many seconds.')
+@click.pass_context
+def profile(ctx, conf, project_dir, image_id, output_dir, top, timeout):
+    """
+    Run the application with SGX stats and profiling enabled in [profiling]
+    section of scag.toml, then summarize the stats and top hotspots. The
+    application runs until it exits, is interrupted with Ctrl-C, or until
+    --timeout.
+    """
+    builder = load_builder(ctx, project_dir, conf)
+    try:
+        if not builder.get_profiling_options()['enable']:
+            ctx.fail('profiling is not enabled in [profiling] section of'
+                f' {conf}')
+    except ValueError as err:
+        ctx.fail(str(err))
+
+    if image_id is None:
+        image_id = builder.build()
+    image = builder.docker.images.get(image_id)
+
+    output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    run_cmd = _profiling.get_profile_run_cmd(builder, image, output_dir,
+        f'{os.getuid()}:{os.getgid()}')
+
+    # docker run forwards SIGINT to the container, where it stops the
+    # application, so that profile data is written
+    with subprocess.Popen(run_cmd) as proc:
+        try:
+            proc.wait(timeout=timeout)
+        except (subprocess.TimeoutExpired, KeyboardInterrupt):
+            proc.send_signal(signal.SIGINT)
+            proc.wait()
+
+    summary = _profiling.summarize(builder, image, output_dir, top)
+    print(_profiling.format_summary(summary))
+    return 0
+
+@main.command('bench-startup')
+@click.option('--conf', default=_builder.SCAG_CONFIG_FILE,
+    type=str,
+    help='The filename of the scaffolding configuration file relative to'
+        ' --project_dir.')
+@click.option('--project_dir', type=click.Path(dir_okay=True, file_okay=False),
+    default=os.getcwd(),
+    help='The directory of the application to benchmark.')
+@click.option('--runs', '-n', type=click.IntRange(min=1), default=10,
+    show_default=True, help='Number of starts of every image.')
+@click.option('--runtime', default=_bench.DEFAULT_RUNTIME, show_default=True,
+    help='Command run in the container: gramine-sgx (default command of the'
+        ' image), gramine-direct, or any other command.')
+@click.option('--port', type=click.IntRange(min=1, max=65535),
+    help='Host port to poll. Default is the first published port; without'
+        ' published ports, the application is measured until it exits.')
+@click.option('--timeout', type=click.FloatRange(min=0), default=300,
+    show_default=True,
+    help='How long to wait for the application in every run, in seconds.')
+@click.argument('images', nargs=-1)
+@click.pass_context
+def bench_startup(ctx, conf, project_dir, runs, runtime, port, timeout,
+        images):
+    """
+    Measure cold-start latency and peak memory of images. Every image is
+    started RUNS times with "docker run" command of the project, and the port
+    is polled until the application answers. Without IMAGES, the project is
+    built first. With more images, medians are compared to the first one.
+    """
+    builder = load_builder(ctx, project_dir, conf)
+    if not images:
+        images = (builder.build(),)
+
+    reports = []
+    for image in images:
+        click.echo(f'Starting {image} {runs} times...', err=True)
+        reports.append(_bench.bench_startup(builder, image, runs,
+            runtime=runtime, port=port, timeout=timeout))
+
+    result = {'images': reports}
+    if len(reports) > 1:
+        result['comparison'] = _bench.compare(reports)
+    print(json.dumps(result, indent=4))
+
+    if any(report['startup'] is None for report in reports):
+        ctx.exit(1)
+    return 0
+
+@main.command('run')
+@click.option('--conf', default=_builder.SCAG_CONFIG_FILE,
+    type=str,
+    help='The filename of the scaffolding configuration file relative to'
+        ' --project_dir.')
+@click.option('--project_dir', type=click.Path(dir_okay=True, file_okay=False),
+    default=os.getcwd(),
+    help='The directory of the application to run.')
+@click.option('--image', 'image_id', metavar='IMAGE',
+    help='Run this image instead of building the project.')
+@click.option('--replicas', '-r', type=click.IntRange(min=1), default=1,
+    show_default=True, help='Number of replicas.')
+@click.option('--name', metavar='NAME',
+    help='Prefix of container names. Default is derived from the name of the'
+        ' project directory.')
+@click.option('--host', default='127.0.0.1', show_default=True,
+    help='Address of this host in the endpoint list.')
+@click.option('--timeout', type=click.FloatRange(min=0), default=300,
+    show_default=True, help='How long to wait for replicas to get ready, in'
+        ' seconds.')
+@click.option('--json', 'as_json', is_flag=True,
+    help='Print replicas (names, ports, CPUs and readiness) as JSON instead of'
+        ' the endpoint list.')
+@click.pass_context
+def run(ctx, conf, project_dir, image_id, replicas, name, host, timeout,
+        as_json):
+    """
+    Run replicas of the application, each pinned to its own CPUs (and NUMA
+    node) and with its own published ports. Prints endpoints of the replicas,
+    one HOST:PORT per line, for load balancers.
+    """
+    builder = load_builder(ctx, project_dir, conf)
+    if image_id is None:
+        image_id = builder.build()
+    if name is None:
+        name = builder.get_image_repository()
+
+    try:
+        started = _replicas.start_replicas(builder.docker,
+            _replicas.get_replica_run_cmds(builder, image_id, replicas, name),
+            timeout)
+    except ValueError as err:
+        ctx.fail(str(err))
+    except subprocess.CalledProcessError as err:
+        ctx.fail(f'docker run failed: {err.stderr.strip()}')
+
+    for replica in started:
+        click.echo(f'{replica["name"]}: cpus {replica["cpus"]}'
+            + (f' (node {replica["node"]})' if replica['node'] is not None
+                else '')
+            + ('' if replica['ready'] else ', NOT READY'), err=True)
+
+    if as_json:
+        print(json.dumps([{key: value for key, value in replica.items()
+            if key != 'cmd'} for replica in started], indent=4))
+    else:
+        for replica in started:
+            if replica['ready'] and replica['ports']:
+                print(f'{host}:{replica["ports"][0]}')
+
+    if not all(replica['ready'] for replica in started):
+        ctx.exit(1)
+    return 0
+
+@main.command('gc')
+@click.option('--keep', type=click.IntRange(min=1), default=3,
+    show_default=True, help='Number of latest builds to keep for every project.')
+@click.option('--max-size', metavar='SIZE',
+    help='Disk budget for images (e.g. 20G). If exceeded, older builds are'
+        ' pruned too, except the latest build of every project.')
+@click.option('--grace-period', type=click.FloatRange(min=0), default=3600,
+    show_default=True,
+    help='Don\'t remove images younger than this many seconds, they may belong'
+        ' to builds in progress.')
+@click.option('--dry-run', is_flag=True,
+    help='Only print what would be removed.')
+@click.pass_context
+def gc(ctx, keep, max_size, grace_period, dry_run):
+    """
+    Remove images and rootfs tarballs of projects that are not needed by the
+    latest builds. Prints JSON report of removed and skipped images and files.
+    """
+    max_size_bytes = None
+    if max_size is not None:
+        try:
+            max_size_bytes = _builder.parse_enclave_size(max_size) << 20
+        except ValueError:
+            ctx.fail(f'invalid --max-size: {max_size!r}')
+
+    registry = _buildregistry.BuildRegistry(
+        _builder.get_default_cache_dir() / 'builds')
+    report = _prune.collect(docker.from_env(), registry, keep=keep,
+        max_size=max_size_bytes, grace_period=grace_period, dry_run=dry_run)
+    print(json.dumps(report, indent=4))
+    click.echo(f'{"Would free" if dry_run else "Freed"} {report["freed"]}'
+        f' bytes ({len(report["removed"])} images, {len(report["files"])}'
+        f' files, {len(report["skipped"])} images skipped)', err=True)
+    return 0
+
+@main.command('daemon')
+@click.option('--socket', 'socket_path', type=click.Path(dir_okay=False),
+    envvar='SCAG_DAEMON_SOCKET',
+    help='Path of the socket (by default $XDG_RUNTIME_DIR/scag/daemon.sock).')
+@click.option('--workers', type=click.IntRange(min=1),
+    default=_daemon.DEFAULT_WORKERS, show_default=True,
+    help='Maximum number of concurrent builds.')
+def daemon(socket_path, workers):
+    """
+    Run build daemon, which keeps docker connection, templates and caches warm
+    between builds. Builds are run in the daemon with "scag build --daemon".
+    """
+    if socket_path is None:
+        socket_path = _daemon.get_default_socket_path()
+    click.echo(f'Listening on {socket_path}', err=True)
+    _daemon.serve(socket_path, workers)
+
 @main.command('client')
 @click.option('--project_dir', '-C', metavar='PATH',
     type=click.Path(dir_okay=True, file_okay=False),
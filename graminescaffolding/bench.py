@@ -0,0 +1,269 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Cold-start benchmark (:command:`scag-bench-startup`).
+
+Every run starts a new container with the command from
+:meth:`Builder.get_docker_run_cmd` and polls the published port until the
+application answers; startup latency is the time from :command:`docker run`
+to the first answer. Applications without published ports are measured until
+they exit. Memory usage of the container is sampled from docker stats while
+the application starts, and the peak is reported.
+
+The runtime, i.e. the command run in the container, is pluggable: the default
+command of the image (:command:`gramine-sgx`), :command:`gramine-direct`, or
+any other command (e.g. a local stand-in without Gramine), so the harness can
+be run also without SGX hardware.
+"""
+
+import math
+import re
+import shlex
+import socket
+import ssl
+import statistics
+import subprocess
+import threading
+import time
+import uuid
+
+import docker
+
+# names of runtimes to their command, None means default command of the image
+RUNTIMES = {
+    'gramine-sgx': None,
+    'gramine-direct': ['gramine-direct', 'app'],
+}
+DEFAULT_RUNTIME = 'gramine-sgx'
+
+_POLL_INTERVAL = 0.05
+_HTTP_STATUS = re.compile(rb'HTTP/\d(?:\.\d)? (\d{3})')
+
+
+def get_bench_run_cmd(builder, image_id, name, runtime=DEFAULT_RUNTIME):
+    """
+    Command to run one instance of the image.
+
+    Args:
+        builder (Builder): builder of the image
+        image_id (str): the image
+        name (str): name of the container
+        runtime (str): name from :data:`RUNTIMES`, or other command (split
+            like by shell)
+
+    Returns:
+        list: the command
+    """
+    command = (RUNTIMES[runtime] if runtime in RUNTIMES
+        else shlex.split(runtime))
+    *run_args, image = builder.get_docker_run_cmd(image_id,
+        sgx=command is None or command[0] == 'gramine-sgx')
+    run_args += ['--rm', '--name', name]
+    if command is None:
+        return [*run_args, image]
+    # entrypoint of the images is bash, which can't run binaries as scripts
+    return [*run_args, '--entrypoint', command[0], image, *command[1:]]
+
+
+def get_published_ports(run_cmd):
+    """
+    Host ports published by :command:`docker run` command (``--publish
+    HOST:CONTAINER`` options).
+    """
+    ports = []
+    for option, value in zip(run_cmd, run_cmd[1:]):
+        if option in ('--publish', '-p'):
+            # [IP:]HOST:CONTAINER[/PROTOCOL], without HOST the port is random
+            parts = value.split('/')[0].split(':')
+            if len(parts) >= 2 and parts[-2]:
+                ports.append(int(parts[-2]))
+    return ports
+
+
+def probe(port, host='127.0.0.1', timeout=1.0):
+    """
+    Check whether the application answers on the port. HTTP over TLS (the
+    certificate is not verified, it's only checked that the application is
+    up) and plain HTTP are tried; 5xx statuses (e.g. from nginx, before the
+    application behind it is up) mean the application is not ready. Any
+    other answer means it's ready.
+
+    Returns:
+        bool: whether the application is ready
+    """
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    for use_tls in (True, False):
+        try:
+            with socket.create_connection((host, port), timeout=timeout) as sock:
+                conn = (context.wrap_socket(sock, server_hostname=host)
+                    if use_tls else sock)
+                conn.sendall(b'GET / HTTP/1.0\r\nHost: localhost\r\n\r\n')
+                answer = conn.recv(64)
+        except OSError:
+            continue
+        if not answer:
+            continue
+        match = _HTTP_STATUS.match(answer)
+        return match is None or int(match.group(1)) < 500
+    return False
+
+
+class MemorySampler(threading.Thread):
+    """
+    Sample memory usage of a container from docker stats, until the container
+    exits. Usage is computed like by :command:`docker stats`, without
+    inactive page cache.
+
+    Args:
+        client (docker.DockerClient): docker client
+        name (str): name of the container
+    """
+    def __init__(self, client, name):
+        super().__init__(daemon=True)
+        self.client = client
+        self.name = name
+        self.peak = None
+        # set when the container was removed (or failed to start)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                container = self.client.containers.get(self.name)
+                break
+            except docker.errors.NotFound:
+                time.sleep(_POLL_INTERVAL)
+            except docker.errors.APIError:
+                return
+        else:
+            return
+        try:
+            for stats in container.stats(stream=True, decode=True):
+                memory = stats.get('memory_stats', {})
+                if 'usage' not in memory:
+                    continue
+                usage = memory['usage'] - memory.get('stats', {}).get(
+                    'inactive_file', 0)
+                self.peak = max(self.peak or 0, usage)
+        except docker.errors.APIError:
+            pass
+
+
+def run_once(builder, image_id, runtime=DEFAULT_RUNTIME, port=None,
+        timeout=300):
+    """
+    Start the image once and measure its startup.
+
+    Args:
+        builder (Builder): builder of the image
+        image_id (str): the image
+        runtime (str): see :func:`get_bench_run_cmd`
+        port (int or None): host port to poll; :obj:`None` means the first
+            published port, if any
+        timeout (float): how long to wait for the application, in seconds
+
+    Returns:
+        dict: ``startup`` (seconds, or :obj:`None` if the application didn't
+        answer or failed) and ``peak_memory`` (bytes, or :obj:`None` if not
+        known)
+    """
+    name = f'scag-bench-{uuid.uuid4().hex[:12]}'
+    run_cmd = get_bench_run_cmd(builder, image_id, name, runtime)
+    if port is None:
+        port = next(iter(get_published_ports(run_cmd)), None)
+
+    sampler = MemorySampler(builder.docker, name)
+    startup = None
+    start = time.monotonic()
+    # pylint: disable=consider-using-with
+    proc = subprocess.Popen(run_cmd, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    sampler.start()
+    try:
+        while time.monotonic() - start < timeout:
+            returncode = proc.poll()
+            if port is not None and probe(port):
+                startup = time.monotonic() - start
+                break
+            if returncode is not None:
+                if port is None and returncode == 0:
+                    startup = time.monotonic() - start
+                break
+            time.sleep(_POLL_INTERVAL)
+    finally:
+        try:
+            builder.docker.containers.get(name).remove(force=True)
+        except docker.errors.NotFound:
+            pass
+        proc.wait()
+        sampler.stopped.set()
+        sampler.join(timeout=5)
+
+    return {'startup': startup, 'peak_memory': sampler.peak}
+
+
+def describe(values):
+    """
+    Distribution of values: ``min``, ``median``, ``p90``, ``max`` and
+    ``mean``, or :obj:`None` if there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'min': values[0],
+        'median': statistics.median(values),
+        'p90': values[math.ceil(0.9 * len(values)) - 1],
+        'max': values[-1],
+        'mean': statistics.mean(values),
+    }
+
+
+def bench_startup(builder, image_id, runs, *, runtime=DEFAULT_RUNTIME,
+        port=None, timeout=300):
+    """
+    Start the image *runs* times, one after another.
+
+    Returns:
+        dict: report with every run, failures and distributions of
+        ``startup`` and ``peak_memory``
+    """
+    # pylint: disable=too-many-arguments
+    results = [run_once(builder, image_id, runtime, port, timeout)
+        for _ in range(runs)]
+    startups = [result['startup'] for result in results
+        if result['startup'] is not None]
+    memory = [result['peak_memory'] for result in results
+        if result['peak_memory'] is not None]
+    return {
+        'image': image_id,
+        'runtime': runtime,
+        'runs': results,
+        'failed': len(results) - len(startups),
+        'startup': describe(startups),
+        'peak_memory': describe(memory),
+    }
+
+
+def compare(reports):
+    """
+    Compare medians of images to the first one.
+
+    Returns:
+        dict: image to ratios of ``startup`` and ``peak_memory`` medians
+        (:obj:`None` where there was no data)
+    """
+    def ratio(report, key):
+        base = reports[0][key]
+        if base is None or report[key] is None or not base['median']:
+            return None
+        return report[key]['median'] / base['median']
+
+    return {report['image']: {
+        'startup': ratio(report, 'startup'),
+        'peak_memory': ratio(report, 'peak_memory'),
+    } for report in reports[1:]}
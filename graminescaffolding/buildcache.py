@@ -0,0 +1,275 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Portable build cache (:command:`scag-build --cache-to/--cache-from`), which
+can be carried between ephemeral CI runners.
+
+The cache is a directory with :file:`index.json` and content-addressed blobs in
+:file:`blobs/sha256/`. Blobs are named by SHA-256 of their uncompressed content
+and stored compressed with gzip, so layers shared between images (and between
+successive exports into the same directory) are stored only once. Images are
+stored as their config and layers, and reassembled into :command:`docker
+save` format when restored. The index has separate entry for each project
+(keyed by the name of project directory, like the application image in the
+cache), so projects can export into the same directory. Blobs not referenced by
+any project are removed on export.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import pathlib
+import shutil
+import tarfile
+import tempfile
+
+CACHE_VERSION = 2
+INDEX_FILE = 'index.json'
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class BuildCache:
+    """
+    Cache directory.
+
+    Args:
+        path (pathlib.Path): the directory, created if needed when storing
+    """
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.blobs_dir = self.path / 'blobs' / 'sha256'
+
+    def blob_path(self, digest):
+        return self.blobs_dir / digest
+
+    def put_blob(self, file):
+        """
+        Store contents of a file object.
+
+        Returns:
+            (str, int): hex digest and size of uncompressed content
+        """
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.blobs_dir, prefix='.tmp',
+                delete=False) as tmpfile:
+            try:
+                # mtime=0, so that the same content gives the same blob
+                with gzip.GzipFile(fileobj=tmpfile, mode='wb', mtime=0,
+                        compresslevel=6) as gzfile:
+                    while chunk := file.read(_CHUNK_SIZE):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        gzfile.write(chunk)
+            except BaseException:
+                os.unlink(tmpfile.name)
+                raise
+
+        path = self.blob_path(digest.hexdigest())
+        if path.exists():
+            os.unlink(tmpfile.name)
+        else:
+            os.replace(tmpfile.name, path)
+        return digest.hexdigest(), size
+
+    def open_blob(self, digest):
+        return gzip.open(self.blob_path(digest), 'rb')
+
+    def put_saved_image(self, file):
+        """
+        Store image from :command:`docker save` tarball.
+
+        Returns:
+            dict: record of the image for the index
+        """
+        with tarfile.open(fileobj=file, mode='r:') as tar:
+            manifest, = json.load(tar.extractfile('manifest.json'))
+
+            def put_member(name):
+                with tar.extractfile(name) as member:
+                    digest, size = self.put_blob(member)
+                return {'digest': digest, 'size': size}
+
+            return {
+                'tags': manifest.get('RepoTags') or [],
+                'config': put_member(manifest['Config']),
+                'layers': [put_member(layer) for layer in manifest['Layers']],
+            }
+
+    def write_saved_image(self, record, file):
+        """
+        Reassemble image into :command:`docker save` tarball, which can be
+        loaded with :command:`docker load`.
+        """
+        manifest = [{
+            'Config': f'{record["config"]["digest"]}.json',
+            'RepoTags': record['tags'],
+            'Layers': [f'{layer["digest"]}/layer.tar'
+                for layer in record['layers']],
+        }]
+        members = [(manifest[0]['Config'], record['config'])]
+        members.extend(zip(manifest[0]['Layers'], record['layers']))
+
+        with tarfile.open(fileobj=file, mode='w:') as tar:
+            data = json.dumps(manifest).encode()
+            tarinfo = tarfile.TarInfo('manifest.json')
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, fileobj=io.BytesIO(data))
+
+            for name, blob in members:
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = blob['size']
+                with self.open_blob(blob['digest']) as blobfile:
+                    tar.addfile(tarinfo, fileobj=blobfile)
+
+    def put_file(self, path):
+        with open(path, 'rb') as file:
+            digest, size = self.put_blob(file)
+        return {'digest': digest, 'size': size}
+
+    def restore_file(self, record, path):
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+        with self.open_blob(record['digest']) as blobfile, \
+                open(tmp_path, 'wb') as file:
+            shutil.copyfileobj(blobfile, file, _CHUNK_SIZE)
+        os.replace(tmp_path, path)
+
+    def load_index(self):
+        """
+        Returns:
+            dict or None: the index, or :obj:`None` if there is no usable cache
+        """
+        try:
+            with open(self.path / INDEX_FILE, 'rb') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if index.get('version') != CACHE_VERSION:
+            return None
+        return index
+
+    def save_project(self, project, entry):
+        """
+        Store index entry of *project*, keeping entries of other projects, and
+        remove blobs that are no longer referenced.
+        """
+        index = self.load_index() or {}
+        projects = dict(index.get('projects', {}))
+        projects[project] = entry
+        self.save_index({**index, 'projects': projects})
+
+    def save_index(self, index):
+        """
+        Write the index and remove blobs that are not referenced by it.
+        """
+        index = {**index, 'version': CACHE_VERSION}
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path / f'.{INDEX_FILE}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(index, file, indent=4)
+        os.replace(tmp_path, self.path / INDEX_FILE)
+
+        used = set()
+        for entry in index.get('projects', {}).values():
+            for record in entry.get('images', []):
+                used.add(record['config']['digest'])
+                used.update(layer['digest'] for layer in record['layers'])
+            used.update(record['digest']
+                for record in entry.get('files', {}).values())
+        for path in self.blobs_dir.glob('*'):
+            if path.name not in used:
+                path.unlink()
+
+
+def export_cache(builder, path):
+    """
+    Store images, hashes of trusted files (if the builder keeps them, see
+    :attr:`Builder.trusted_files_cache`), apt package cache and records of
+    the last build of *builder* into cache directory.
+    """
+    cache = BuildCache(path)
+    images = []
+    for kind, image in builder.built_images.items():
+        tag = (builder.get_app_cache_tag() if kind == 'app'
+            else image.tags[0] if image.tags else None)
+        if tag is None:
+            continue
+        if tag not in image.tags:
+            image.tag(tag)
+            image.reload()
+        with tempfile.TemporaryFile() as savefile:
+            for chunk in image.save(named=tag):
+                savefile.write(chunk)
+            savefile.seek(0)
+            record = cache.put_saved_image(savefile)
+        record['kind'] = kind
+        record['id'] = image.id
+        images.append(record)
+
+    files = {}
+    if (builder.trusted_files_cache is not None
+            and builder.trusted_files_cache.is_file()):
+        files['trusted-files-cache.json'] = cache.put_file(
+            builder.trusted_files_cache)
+    apt = builder.get_apt_options()
+    if apt['cache']:
+        for deb in sorted(apt['cache_dir'].glob('*.deb')):
+            files[f'apt/{deb.name}'] = cache.put_file(deb)
+
+    cache.save_project(builder.get_image_repository(), {
+        'images': images,
+        'files': files,
+        'records': {
+            'framework': builder.framework,
+            'metrics': builder.build_metrics,
+        },
+    })
+
+
+def import_cache(builder, path):
+    """
+    Restore entry of *builder*'s project from cache directory created by
+    :func:`export_cache`. Images that
+    already exist locally are not loaded again. Hashes of trusted files are
+    restored only if *builder* keeps them.
+
+    Returns:
+        bool: :obj:`False` if there was no usable cache for the project
+    """
+    cache = BuildCache(path)
+    index = cache.load_index()
+    entry = (index['projects'].get(builder.get_image_repository())
+        if index is not None else None)
+    if entry is None:
+        return False
+
+    for record in entry['images']:
+        tag = record['tags'][0] if record['tags'] else None
+        image = builder.get_image_by_tag(tag) if tag is not None else None
+        if image is None or image.id != record['id']:
+            with tempfile.TemporaryFile() as savefile:
+                cache.write_saved_image(record, savefile)
+                savefile.seek(0)
+                builder.docker.images.load(savefile)
+        if record['kind'] == 'app' and tag is not None:
+            builder.cache_from.append(tag)
+
+    apt = builder.get_apt_options()
+    for name, record in entry['files'].items():
+        if name == 'trusted-files-cache.json':
+            if builder.trusted_files_cache is not None:
+                cache.restore_file(record, builder.trusted_files_cache)
+        elif name.startswith('apt/') and apt['cache']:
+            dest = apt['cache_dir'] / name.removeprefix('apt/')
+            if not dest.exists():
+                cache.restore_file(record, dest)
+    return True
+
+# vim: tw=80
@@ -3,14 +3,23 @@
 #                    Wojtek Porczyk <woju@invisiblethingslab.com>
 #                    Mariusz Zaborski <oshogbo@invisiblethingslab.com>
 #                    Rafał Wojdyła <omeg@invisiblethingslab.com>
+# pylint: disable=too-many-lines
 
+import concurrent.futures
+import copy
+import hashlib
+import io
 import json
 import os
 import pathlib
+import posixpath
+import re
 import shlex
+import shutil
 import subprocess
 import tarfile
 import tempfile
+import threading
 import types
 
 import importlib.resources
@@ -18,8 +27,14 @@ import importlib.resources
 import click
 import docker
 import jinja2
+import tomli
+import tomli_w
 
 from . import (
+    buildlog,
+    buildregistry,
+    sigstruct as _sigstruct,
+    tarindex,
     utils,
 )
 
@@ -56,6 +71,7 @@ WANT_FILES = types.MappingProxyType({
     ),
 
     'Dockerfile.dockerignore': (
+        'frameworks/{framework}/Dockerfile.dockerignore',
         'Dockerfile.dockerignore',
     ),
 
@@ -65,9 +81,78 @@ WANT_FILES = types.MappingProxyType({
     ),
 })
 
+# those files are rendered from the same templates as some of the above, but
+# with extra variables: path -> (path of the other file, variables); frameworks
+# can add their own with Builder.file_variants
+WANT_FILES_VARIANTS = types.MappingProxyType({
+    'Dockerfile-base': ('Dockerfile', {'stage': 'base'}),
+})
+
+# rootfs depends only on those files (and on Gramine version and codename)
+ROOTFS_FILES = (
+    'sources.list',
+    'mmdebstrap-hooks/setup.sh',
+    'mmdebstrap-hooks/customize.sh',
+    'Dockerfile-rootfs',
+)
+
+# shared images are tagged with content hash, and labelled with this label
+# (value is 'rootfs' or 'base'); application images (value 'app' for unsigned,
+# 'final' for signed ones) are labelled also with project directory and hash of
+# configuration, so that scag gc knows where they belong
+IMAGE_LABEL = 'org.gramineproject.scag.image'
+PROJECT_LABEL = 'org.gramineproject.scag.project'
+CONFIG_LABEL = 'org.gramineproject.scag.config'
+ROOTFS_REPOSITORY = 'scag-rootfs'
+BASE_REPOSITORY = 'scag-base'
+# unsigned application images restored from portable build cache
+APP_CACHE_REPOSITORY = 'scag-app-cache'
+
 # TODO allow custom, maybe from variables?
 CODENAME = 'bookworm'
 
+# removed from rootfs, base and application image by slimming stage, unless
+# overridden in [slim] table; frameworks can add their own with
+# Builder.slim_paths (and Builder.slim_build_paths for build tools, which are
+# removed only from application image)
+SLIM_PATHS = (
+    '/usr/share/doc/*',
+    '/usr/share/info/*',
+    '/usr/share/lintian/*',
+    '/usr/share/locale/*',
+    '/usr/share/man/*',
+    '/var/cache/apt/*.bin',
+    '/var/cache/debconf/*-old',
+    '/var/lib/apt/lists/*',
+    '/var/log/*',
+)
+# paths are interpolated into shell scripts unquoted (for globs to work), so
+# they are restricted to those characters
+_SLIM_PATH_ALLOWED = frozenset(
+    'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+    '/._-+*?[]@')
+# printed by slimming stage, followed by number of bytes
+SLIM_REPORT_PREFIX = 'scag-slim: removed bytes:'
+
+# static assets can be compressed at build time with those, for nginx to serve
+# them with gzip_static/brotli_static
+PRECOMPRESS_ENCODINGS = ('gzip', 'brotli')
+
+# values of profiling.profile and profiling.mode (sgx.profile.enable and
+# sgx.profile.mode in the manifest)
+PROFILE_TARGETS = ('none', 'main', 'all')
+PROFILE_MODES = ('aex', 'ocall_inner', 'ocall_outer')
+
+# options of [variants.<name>] tables
+VARIANT_OPTIONS = ('debug', 'isv_svn', 'isv_prod_id', 'sign_args', 'tag')
+_VARIANT_NAME = re.compile(r'[a-z0-9][a-z0-9_.-]*')
+
+DEBIAN_MIRROR = 'http://deb.debian.org/debian/'
+
+# keys of pax extended header, which are regenerated by normalize_tarball()
+_PAX_STANDARD_FIELDS = frozenset(('atime', 'ctime', 'mtime', 'path',
+    'linkpath', 'size', 'uid', 'gid', 'uname', 'gname'))
+
 
 _templates = jinja2.Environment(
     loader=jinja2.PackageLoader(__package__),
@@ -76,12 +161,174 @@ _templates = jinja2.Environment(
 )
 _templates.globals['scag'] = {
     'keys_path': utils.KEYS_PATH,
+    'debian_mirror': DEBIAN_MIRROR,
+    'slim_report_prefix': SLIM_REPORT_PREFIX,
 }
 
 def filter_shquote(s):
     return shlex.quote(os.fspath(s))
 _templates.filters['shquote'] = filter_shquote
 
+_DOCKERFILE_COPY = re.compile(r'^\s*(COPY|ADD)\s', re.IGNORECASE | re.MULTILINE)
+
+def dockerfile_copies_files(dockerfile):
+    """
+    Whether rendered Dockerfile fragment has ``COPY`` or ``ADD`` instruction,
+    so it needs build context (or another stage) to copy files from.
+    """
+    return _DOCKERFILE_COPY.search(dockerfile) is not None
+_templates.tests['copying_files'] = dockerfile_copies_files
+
+
+def format_enclave_size(size_mb):
+    """
+    Round enclave size up to power of 2, as required by SGX.
+
+    Args:
+        size_mb (int): minimal size in MiB
+
+    Returns:
+        str: enclave size suitable for ``sgx.enclave_size`` in the manifest
+    """
+    size_mb = 1 << (size_mb - 1).bit_length()
+    if size_mb >= 1024:
+        return f'{size_mb // 1024}G'
+    return f'{size_mb}M'
+
+
+def parse_enclave_size(size):
+    """
+    Parse enclave size, as written in ``sgx.enclave_size``.
+
+    Args:
+        size (str): size with optional ``K``, ``M`` or ``G`` suffix
+
+    Returns:
+        int: size in MiB
+    """
+    size = str(size).strip().upper()
+    for suffix, shift in (('G', 30), ('M', 20), ('K', 10), ('', 0)):
+        if suffix and size.endswith(suffix):
+            return (int(size[:-1]) << shift) >> 20
+    return int(size) >> 20
+
+
+def get_default_cache_dir():
+    """
+    Directory for caches shared between all projects (honours
+    ``XDG_CACHE_HOME``).
+    """
+    return pathlib.Path(os.environ.get('XDG_CACHE_HOME')
+        or pathlib.Path.home() / '.cache') / 'scag'
+
+
+def prune_cache(path, max_size_mb, pattern='*.deb'):
+    """
+    Remove files from cache directory, oldest first, until their total size is
+    below the limit.
+
+    Args:
+        path (pathlib.Path): cache directory
+        max_size_mb (int): size limit in MiB
+        pattern (str): glob pattern of cached files
+
+    Returns:
+        int: number of bytes freed
+    """
+    files = sorted(
+        ((file.stat(), file) for file in path.glob(pattern)),
+        key=lambda item: item[0].st_mtime)
+    total = sum(stat.st_size for stat, _ in files)
+    freed = 0
+    for stat, file in files:
+        if total - freed <= max_size_mb << 20:
+            break
+        file.unlink()
+        freed += stat.st_size
+    return freed
+
+
+def normalize_tarball(path, source_date_epoch):
+    """
+    Rewrite tarball in place, so that its contents don't depend on the order in
+    which files were created, on their timestamps or on the names of users on
+    the build host: members are sorted by name, modification times are clamped
+    to *source_date_epoch*, user and group names are dropped (numeric IDs are
+    kept), and access and change times are removed from extended headers.
+
+    Hard links are written after their targets, so if a hard link sorts before
+    the file it points to, the roles are swapped.
+
+    Args:
+        path (pathlib.Path): the tarball
+        source_date_epoch (int): maximum modification time
+    """
+    path = pathlib.Path(path)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with tarfile.open(path, 'r:') as src, \
+            tarfile.open(tmp_path, 'w:', format=tarfile.PAX_FORMAT) as dst:
+        members = sorted(src.getmembers(), key=lambda ti: ti.name)
+        by_name = {tarinfo.name: tarinfo for tarinfo in members}
+        written = set()
+        # target of a hard link -> name of the link written as regular file
+        swapped = {}
+
+        for tarinfo in members:
+            fileobj = None
+            tarinfo = copy.copy(tarinfo)
+            if tarinfo.name in swapped:
+                tarinfo.type = tarfile.LNKTYPE
+                tarinfo.linkname = swapped[tarinfo.name]
+                tarinfo.size = 0
+            elif tarinfo.islnk() and tarinfo.linkname in swapped:
+                tarinfo.linkname = swapped[tarinfo.linkname]
+            elif tarinfo.islnk() and tarinfo.linkname not in written:
+                target = by_name[tarinfo.linkname]
+                swapped[target.name] = tarinfo.name
+                tarinfo.type = target.type
+                tarinfo.linkname = ''
+                tarinfo.size = target.size
+                fileobj = src.extractfile(target)
+            elif tarinfo.isreg():
+                fileobj = src.extractfile(tarinfo)
+
+            tarinfo.mtime = min(int(tarinfo.mtime), source_date_epoch)
+            tarinfo.uname = tarinfo.gname = ''
+            # standard fields are generated again as needed, only keep the
+            # others (like xattrs)
+            tarinfo.pax_headers = {key: value
+                for key, value in tarinfo.pax_headers.items()
+                if key not in _PAX_STANDARD_FIELDS}
+            dst.addfile(tarinfo, fileobj)
+            written.add(tarinfo.name)
+
+    os.replace(tmp_path, path)
+
+
+def apply_whiteout(rootdir, name):
+    """
+    If layer member is a whiteout, remove what it hides in lower layers, which
+    were already extracted into *rootdir*.
+
+    Returns:
+        bool: whether the member was a whiteout (and should not be extracted)
+    """
+    path = pathlib.PurePosixPath(name)
+    if path.name == tarindex.WHITEOUT_OPAQUE:
+        parent = rootdir / path.parent
+        hidden = list(parent.iterdir()) if parent.is_dir() else []
+    elif path.name.startswith(tarindex.WHITEOUT_PREFIX):
+        hidden = [rootdir / path.parent
+            / path.name.removeprefix(tarindex.WHITEOUT_PREFIX)]
+    else:
+        return False
+    for hidden_path in hidden:
+        if hidden_path.is_dir() and not hidden_path.is_symlink():
+            shutil.rmtree(hidden_path)
+        else:
+            hidden_path.unlink(missing_ok=True)
+    return True
+
 
 def get_gramine_dependency():
     try:
@@ -102,8 +349,12 @@ def _extract_mrenclave_from_file(file):
 def extract_mrenclave_from_bytes(sigstruct):
     return sigstruct[960:960+32]
 
-def extract_mrenclave_from_tar(file, sigstruct_path='./app/app.sig'):
-    with tarfile.open(fileobj=file) as tar:
+def _extract_mrenclave_from_compressed_tar(file, sigstruct_path):
+    if isinstance(file, (str, os.PathLike)):
+        tar = tarfile.open(file)
+    else:
+        tar = tarfile.open(fileobj=file)
+    with tar:
         try:
             # this might be None if path is in archive but is not a regular file
             sig = tar.extractfile(sigstruct_path)
@@ -116,21 +367,113 @@ def extract_mrenclave_from_tar(file, sigstruct_path='./app/app.sig'):
         with sig:
             return _extract_mrenclave_from_file(sig)
 
+def extract_mrenclave_from_tar(file, sigstruct_path='./app/app.sig'):
+    if tarindex.is_compressed(file):
+        # no random access, so scan the whole archive (only plain tarballs)
+        return _extract_mrenclave_from_compressed_tar(file, sigstruct_path)
+    # file can be also a saved image, where SIGSTRUCT is in one of the layers
+    with tarindex.TarIndex(file) as index:
+        try:
+            sig = index.read(sigstruct_path)
+        except (KeyError, ValueError):
+            raise ValueError(
+                f'SIGSTRUCT at {sigstruct_path!r} in the archive not found or '
+                f'not a file') from None
+    return extract_mrenclave_from_bytes(sig)
+
 def extract_mrenclave_from_path(path):
     with open(path, 'rb') as file:
         return _extract_mrenclave_from_file(file)
 
-# TODO replace SIGSTRUCT, using sgx-sign plugins
+def extract_sigstruct_from_image(client, image, sigstruct_path='/app/app.sig'):
+    """
+    Extract SIGSTRUCT from docker image, without exporting the whole image.
+
+    Args:
+        client (docker.DockerClient): docker client
+        image: docker image
+        sigstruct_path (str): path to SIGSTRUCT inside the image
+
+    Returns:
+        bytes: SIGSTRUCT
+    """
+    container = client.containers.create(image.id)
+    try:
+        stream, _ = container.get_archive(sigstruct_path)
+        with tempfile.TemporaryFile() as file:
+            for chunk in stream:
+                file.write(chunk)
+            file.seek(0)
+            with tarfile.open(fileobj=file) as tar:
+                sig = tar.extractfile(pathlib.PurePath(sigstruct_path).name)
+                if sig is None:
+                    raise ValueError(
+                        f'SIGSTRUCT at {sigstruct_path!r} in the image is not '
+                        f'a file')
+                with sig:
+                    return sig.read()
+    finally:
+        container.remove()
+
+def resign_docker_image(client, image, signer, sigstruct_path='/app/app.sig'):
+    """
+    Sign the enclave in docker image again, with another signer. Measurement
+    (:file:`app.manifest.sgx` and MRENCLAVE) is retained, only SIGSTRUCT is
+    replaced in a new layer on top of the image.
+
+    Args:
+        client (docker.DockerClient): docker client
+        image: docker image
+        signer (graminescaffolding.signer.Signer): signer
+        sigstruct_path (str): path to SIGSTRUCT inside the image
+
+    Returns:
+        docker image: new image
+    """
+    sig = _sigstruct.resign(
+        extract_sigstruct_from_image(client, image, sigstruct_path), signer)
+
+    context = io.BytesIO()
+    with tarfile.open(fileobj=context, mode='w') as tar:
+        for name, data in (
+            ('Dockerfile',
+                f'FROM {image.id}\nCOPY app.sig {sigstruct_path}\n'.encode()),
+            ('app.sig', sig),
+        ):
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+    context.seek(0)
+
+    # not labelled like images from builds, so that scag gc leaves it alone
+    image2, _ = client.images.build(fileobj=context, custom_context=True,
+        rm=True, labels={IMAGE_LABEL: 'resigned'})
+    return image2
 
 class Builder:
+    # pylint: disable=too-many-public-methods,too-many-instance-attributes
     framework = None
     extra_files = types.MappingProxyType({})
+    file_variants = WANT_FILES_VARIANTS
     bootstrap_defaults = ()
     extra_run_args = ()
     BINARY_EXT = (
         '.jar',
     )
     extra_templates_path = None
+    default_max_threads = 32
+    default_enclave_size = '1G'
+    # framework-specific defaults for slimming stage
+    slim_paths = ()
+    slim_build_paths = ()
+    slim_packages = ()
+    # whether the framework can serve runtime metrics, see get_metrics_options()
+    supports_metrics = False
+    # whether the manifest already has sys.enable_sigterm_injection
+    sigterm_injection = False
+    # whether nginx can keep connections to the application alive, see
+    # get_nginx_options()
+    nginx_upstream_keepalive = True
 
     def __init__(self, project_dir, config):
         self.project_dir = pathlib.Path(project_dir)
@@ -145,6 +488,25 @@ class Builder:
             types.MappingProxyType({}))
         self.templates = self._init_jinja_env()
 
+        # metrics of docker builds, see build_docker_image()
+        self.build_metrics = []
+        # images from the last build, by kind ('rootfs', 'base', 'runtime',
+        # 'app')
+        self.built_images = {}
+        # images used as layer cache source for the application image
+        self.cache_from = []
+        # builds are recorded there for scag gc
+        self.build_registry = buildregistry.BuildRegistry(
+            get_default_cache_dir() / 'builds')
+
+        # path to JSON file with hashes of trusted files, see sign_chroot()
+        self.trusted_files_cache = None
+        self._trusted_files = None
+        self._trusted_files_lock = threading.Lock()
+
+        # rebuild shared images and don't use docker build cache
+        self.no_cache = False
+
         self._docker_client = None
 
     @property
@@ -154,6 +516,275 @@ class Builder:
             self._docker_client = docker.from_env()
         return self._docker_client
 
+    @docker.setter
+    def docker(self, client):
+        # e.g. shared between builders in the daemon
+        self._docker_client = client
+
+
+    def get_max_threads(self):
+        """
+        Enclave thread budget, i.e. ``sgx.max_threads`` that gets rendered into
+        the manifest.
+        """
+        return int(self.config.get('sgx', {}).get('max_threads',
+            self.default_max_threads))
+
+
+    def get_enclave_size(self):
+        """
+        Enclave size, i.e. ``sgx.enclave_size`` that gets rendered into the
+        manifest.
+        """
+        return self.config.get('sgx', {}).get('enclave_size',
+            self.default_enclave_size)
+
+
+    def get_nginx_options(self):
+        """
+        Options for nginx reverse proxy (``[<framework>.nginx]`` table in
+        :file:`scag.toml`), with defaults filled in.
+
+        Under Gramine every nginx worker is a separate enclave, so by default
+        there's only one. Upstream connections are kept alive up to the number
+        of enclave threads, because the backend can't serve more concurrent
+        requests than that anyway, unless the framework's upstream protocol
+        can't reuse connections (:attr:`nginx_upstream_keepalive`).
+
+        Raises:
+            ValueError: if unsupported precompression encoding was requested, or
+                upstream keepalive was requested for framework that can't use it
+        """
+        options = {
+            'worker_processes': 1,
+            'worker_connections': 512,
+            'keepalive_timeout': 65,
+            'keepalive_requests': 1000,
+            'ssl_session_cache': 'shared:SSL:10m',
+            'ssl_session_timeout': '1h',
+            'ssl_session_tickets': True,
+            'upstream_keepalive':
+                self.get_max_threads() if self.nginx_upstream_keepalive else 0,
+            'precompress': [],
+        }
+        options.update(self.variables.get('nginx', {}))
+
+        unsupported = set(options['precompress']) - set(PRECOMPRESS_ENCODINGS)
+        if unsupported:
+            raise ValueError(
+                f'unsupported precompress encodings: {sorted(unsupported)!r}, '
+                f'expected some of {PRECOMPRESS_ENCODINGS!r}')
+
+        if options['upstream_keepalive'] and not self.nginx_upstream_keepalive:
+            raise ValueError(
+                f'{self.framework}.nginx.upstream_keepalive is not supported, '
+                f'upstream connections can\'t be reused')
+
+        return options
+
+
+    def get_apt_options(self):
+        """
+        Options for apt package cache and mirror (``[apt]`` table in
+        :file:`scag.toml`), with defaults filled in.
+
+        Raises:
+            ValueError: if cache size is invalid
+        """
+        options = {
+            'cache': False,
+            'cache_dir': get_default_cache_dir() / 'apt',
+            'cache_size': '2G',
+            'mirror': DEBIAN_MIRROR,
+        }
+        options.update(self.config.get('apt', {}))
+        options['cache_dir'] = self.project_dir / pathlib.Path(
+            options['cache_dir']).expanduser()
+
+        try:
+            options['cache_size_mb'] = parse_enclave_size(
+                options['cache_size'])
+        except ValueError:
+            raise ValueError(
+                f'invalid apt.cache_size: {options["cache_size"]!r}') from None
+
+        return options
+
+
+    def get_slim_options(self):
+        """
+        Options for slimming stage (``[slim]`` table in :file:`scag.toml`),
+        with defaults filled in.
+
+        Raises:
+            ValueError: if some path is not absolute or contains unsupported
+                characters
+        """
+        options = {
+            'enable': False,
+            'paths': [*SLIM_PATHS, *self.slim_paths],
+            'build_paths': list(self.slim_build_paths),
+            'packages': list(self.slim_packages),
+        }
+        options.update(self.config.get('slim', {}))
+
+        for path in [*options['paths'], *options['build_paths']]:
+            if not path.startswith('/') or not set(path) <= _SLIM_PATH_ALLOWED:
+                raise ValueError(f'invalid slim.paths entry: {path!r}')
+
+        return options
+
+
+    def get_reproducible_options(self):
+        """
+        Options for reproducible builds (``[reproducible]`` table in
+        :file:`scag.toml`), with defaults filled in. ``source_date_epoch``
+        defaults to ``SOURCE_DATE_EPOCH`` environment variable, or 0.
+
+        Raises:
+            ValueError: if ``source_date_epoch`` is invalid
+        """
+        options = {
+            'enable': False,
+            'source_date_epoch': os.environ.get('SOURCE_DATE_EPOCH', 0),
+        }
+        options.update(self.config.get('reproducible', {}))
+
+        value = options['source_date_epoch']
+        try:
+            options['source_date_epoch'] = int(value)
+        except (TypeError, ValueError):
+            options['source_date_epoch'] = -1
+        if options['source_date_epoch'] < 0:
+            raise ValueError(
+                f'invalid reproducible.source_date_epoch: {value!r}')
+
+        return options
+
+
+    def get_metrics_options(self):
+        """
+        Options for runtime metrics endpoint (``[metrics]`` table in
+        :file:`scag.toml`), with defaults filled in. Metrics are served over
+        RA-TLS on a separate port, see templates of the frameworks.
+
+        Raises:
+            ValueError: if the port is invalid, or if metrics are enabled for
+                a framework that doesn't support them
+        """
+        options = {
+            'enable': False,
+            'port': 9090,
+        }
+        options.update(self.config.get('metrics', {}))
+
+        port = options['port']
+        if (not isinstance(port, int) or isinstance(port, bool)
+                or not 0 < port < 65536):
+            raise ValueError(f'invalid metrics.port: {port!r}')
+        if options['enable'] and not self.supports_metrics:
+            raise ValueError(
+                f'metrics are not supported by framework {self.framework!r}')
+
+        return options
+
+
+    def is_debug(self):
+        """
+        Whether the enclave is built in debug mode (``sgx.debug``).
+        """
+        return bool(self.config.get('sgx', {}).get('debug', False))
+
+
+    def get_profiling_options(self):
+        """
+        Options for Gramine statistics and SGX profiling (``[profiling]``
+        table in :file:`scag.toml`), with defaults filled in. Those are
+        rendered into the manifest as ``sgx.enable_stats`` and
+        ``sgx.profile.*``.
+
+        Raises:
+            ValueError: if some option is invalid, or if profiling is enabled
+                for non-debug enclave
+        """
+        options = {
+            'enable': False,
+            'stats': True,
+            'profile': 'all',
+            'mode': 'aex',
+            'with_stack': True,
+            'frequency': 50,
+        }
+        options.update(self.config.get('profiling', {}))
+
+        if options['profile'] not in PROFILE_TARGETS:
+            raise ValueError(
+                f'invalid profiling.profile: {options["profile"]!r}, '
+                f'expected one of {PROFILE_TARGETS!r}')
+        if options['mode'] not in PROFILE_MODES:
+            raise ValueError(f'invalid profiling.mode: {options["mode"]!r}, '
+                f'expected one of {PROFILE_MODES!r}')
+        if (not isinstance(options['frequency'], int)
+                or isinstance(options['frequency'], bool)
+                or options['frequency'] <= 0):
+            raise ValueError(
+                f'invalid profiling.frequency: {options["frequency"]!r}')
+        if options['enable'] and not self.is_debug():
+            raise ValueError('profiling requires debug enclave (sgx.debug)')
+
+        return options
+
+
+    def get_variants(self):
+        """
+        Signing variants (``[variants.<name>]`` tables in :file:`scag.toml`),
+        with defaults filled in. Every variant is signed from the same image as
+        the default one, with some options of the manifest and of
+        :command:`gramine-sgx-sign` overridden.
+
+        Returns:
+            dict: variant name to options; :obj:`None` value of ``debug``,
+            ``isv_svn`` and ``isv_prod_id`` means that the value from the
+            manifest is kept
+
+        Raises:
+            ValueError: if variant name or some option is invalid
+        """
+        sgx = self.config.get('sgx', {})
+        variants = {}
+        for name, config in self.config.get('variants', {}).items():
+            if not _VARIANT_NAME.fullmatch(name):
+                raise ValueError(f'invalid variant name: {name!r}')
+            unknown = set(config) - set(VARIANT_OPTIONS)
+            if unknown:
+                raise ValueError(
+                    f'unknown options of variant {name!r}: {sorted(unknown)!r}')
+
+            options = {
+                'debug': None,
+                'isv_svn': None,
+                'isv_prod_id': None,
+                'sign_args': sgx.get('sign_args', []),
+                'tag': f'{self.get_image_repository()}:{name}',
+            }
+            options.update(config)
+            if (options['debug'] is False
+                    and self.get_profiling_options()['enable']):
+                raise ValueError(
+                    f'variant {name!r} is not debug, but profiling is enabled')
+            variants[name] = options
+
+        return variants
+
+
+    def get_image_repository(self):
+        """
+        Repository used for tagging images of variants, derived from the name of
+        the project directory.
+        """
+        name = self.project_dir.resolve().name.lower()
+        return re.sub(r'[^a-z0-9_.-]', '-', name).lstrip('_.-') or 'scag-app'
+
 
     def _init_jinja_env(self):
         loaders = [jinja2.PrefixLoader({'': _templates.loader}, '!')]
@@ -228,17 +859,112 @@ class Builder:
         Runs complete build process
         """
         # TODO allow running only some steps
+        self.build_metrics = []
         self.render_templates()
-        self.create_chroot()
-        root_image = self.build_docker_image(
-            dockerfile='.scag/Dockerfile-rootfs')
-        image_unsigned = self.build_docker_image(
-            buildargs={'FROM': root_image.id})
+        image_unsigned = self.build_unsigned_image()
         image, mrenclave = self.sign_docker_image(image_unsigned)
         self.render_client_config(mrenclave)
         return image.id
 
 
+    def measure(self):
+        """
+        Runs build process up to signing, without writing signature files or
+        building final image.
+
+        Returns:
+            bytes: SIGSTRUCT (contents of :file:`app.sig`)
+        """
+        self.build_metrics = []
+        self.render_templates()
+        return self._measure_image(self.build_unsigned_image())
+
+
+    def _measure_image(self, image):
+        with tempfile.TemporaryDirectory() as tmprootdir:
+            tmprootdir = pathlib.Path(tmprootdir)
+            file_layers = self.extract_docker_image(image, tmprootdir)
+            _, sig = self.sign_chroot(tmprootdir, file_layers=file_layers)
+        return sig
+
+
+    def check_reproducible(self, builds=2):
+        """
+        Build the unsigned image several times from scratch (new chroot,
+        without docker build cache and without reusing shared images), and
+        compare SHA-256 of rootfs tarball and MRENCLAVE of the builds.
+
+        Returns:
+            dict: JSON-serialisable report with ``reproducible`` (bool) and
+            ``builds``, a list of dicts with ``rootfs_sha256`` and
+            ``mrenclave``
+        """
+        self.render_templates()
+        results = []
+        no_cache, self.no_cache = self.no_cache, True
+        try:
+            for _ in range(builds):
+                self.build_metrics = []
+                image_unsigned = self.build_unsigned_image()
+                digest = hashlib.sha256()
+                with open(self.rootfs_tar, 'rb') as file:
+                    while chunk := file.read(1024 * 1024):
+                        digest.update(chunk)
+                sig = self._measure_image(image_unsigned)
+                results.append({
+                    'rootfs_sha256': digest.hexdigest(),
+                    'mrenclave': extract_mrenclave_from_bytes(sig).hex(),
+                })
+        finally:
+            self.no_cache = no_cache
+
+        return {
+            'reproducible': all(result == results[0] for result in results),
+            'builds': results,
+        }
+
+
+    def build_unsigned_image(self):
+        """
+        Step: build application image (and shared images it's based on), which
+        is not yet signed
+        """
+        root_image = self.get_rootfs_image()
+        base_image = self.get_base_image(root_image)
+        runtime_image = self.get_runtime_image(root_image) # pylint: disable=assignment-from-none
+        return self.build_app_image(root_image, base_image, runtime_image)
+
+
+    def get_app_cache_tag(self):
+        """
+        Tag of unsigned application image in portable build cache, see
+        :mod:`graminescaffolding.buildcache`.
+        """
+        return f'{APP_CACHE_REPOSITORY}:{self.get_image_repository()}'
+
+
+    def build_app_image(self, rootfs_image, base_image, runtime_image=None):
+        """
+        Step: build application image (not yet signed) on top of already built
+        shared images
+        """
+        kwds = {}
+        if self.cache_from:
+            kwds['cache_from'] = self.cache_from
+        buildargs = {'FROM': base_image.id, 'ROOTFS': rootfs_image.id}
+        if runtime_image is not None:
+            buildargs['RUNTIME'] = runtime_image.id
+        image = self.build_docker_image(
+            buildargs=buildargs,
+            labels=self.get_app_labels('app'),
+            **kwds)
+        self.built_images.update(rootfs=rootfs_image, base=base_image,
+            app=image)
+        if runtime_image is not None:
+            self.built_images['runtime'] = runtime_image
+        return image
+
+
     def render_templates(self):
         """
         Step: create all files in the .scag directory that are rendered from
@@ -253,22 +979,183 @@ class Builder:
                 [t.format(framework=self.framework) for t in template_names],
                 self.scag_dir / path)
 
+        for path, (source, kwds) in self.file_variants.items():
+            self._render_template_to_path(
+                [t.format(framework=self.framework)
+                    for t in want_files[source]],
+                self.scag_dir / path,
+                **kwds)
+
+
+    def get_rootfs_key(self):
+        """
+        Content hash of rootfs, computed from rendered templates that are used
+        to create it.
+
+        Returns:
+            str: hex digest
+        """
+        digest = hashlib.sha256()
+        for item in (CODENAME, get_gramine_dependency()):
+            digest.update(item.encode())
+            digest.update(b'\0')
+        for path in ROOTFS_FILES:
+            digest.update((self.scag_dir / path).read_bytes())
+            digest.update(b'\0')
+        reproducible = self.get_reproducible_options()
+        if reproducible['enable']:
+            digest.update(
+                f'reproducible:{reproducible["source_date_epoch"]}'.encode())
+        return digest.hexdigest()
+
+
+    def get_config_key(self):
+        """
+        Hash of the configuration, to tell apart builds of the same project
+        with different configurations.
+        """
+        return hashlib.sha256(json.dumps(self.config, sort_keys=True,
+            default=str).encode()).hexdigest()
+
+
+    def get_app_labels(self, kind):
+        """
+        Labels of application image of kind ``'app'`` (unsigned) or
+        ``'final'``.
+        """
+        return {
+            IMAGE_LABEL: kind,
+            PROJECT_LABEL: os.fspath(self.project_dir.resolve()),
+            CONFIG_LABEL: self.get_config_key(),
+        }
+
+
+    def get_image_by_tag(self, tag):
+        try:
+            return self.docker.images.get(tag)
+        except docker.errors.ImageNotFound:
+            return None
+
+
+    def get_rootfs_image(self):
+        """
+        Step: get rootfs image, shared between projects. If there is no image
+        for current rootfs content hash, create chroot and build one.
+        """
+        tag = f'{ROOTFS_REPOSITORY}:{self.get_rootfs_key()}'
+        image = None if self.no_cache else self.get_image_by_tag(tag)
+        if image is not None:
+            return image
+
+        # rootfs.tar could have been created from different templates
+        self.create_chroot(force=True)
+        return self.build_docker_image(
+            dockerfile='.scag/Dockerfile-rootfs',
+            tag=tag,
+            labels={IMAGE_LABEL: 'rootfs'})
+
+
+    def get_base_image(self, rootfs_image):
+        """
+        Step: get base image with framework runtime, shared between projects
+        that use the same framework and runtime packages. The image is built
+        from :file:`Dockerfile-base` (without any context) and tagged with
+        hash of rootfs image and of the Dockerfile.
+        """
+        return self._get_shared_image(rootfs_image, 'Dockerfile-base',
+            self.framework)
+
+
+    def get_runtime_image(self, rootfs_image):
+        """
+        Step: get runtime image, for frameworks whose application image
+        contains only build output on top of rootfs with runtime packages
+        (``RUNTIME`` build argument), without build tools from the base image.
+        Shared like the base image, see :meth:`get_base_image`.
 
-    def render_client_config(self, mrenclave):
+        Returns:
+            docker image or None: :obj:`None` if the framework doesn't use one
+        """
+        # pylint: disable=unused-argument
+        return None
+
+
+    def _get_shared_image(self, rootfs_image, dockerfile_path, name):
+        dockerfile = (self.scag_dir / dockerfile_path).read_bytes()
+        digest = hashlib.sha256(rootfs_image.id.encode())
+        digest.update(b'\0')
+        digest.update(dockerfile)
+        tag = f'{BASE_REPOSITORY}:{name}-{digest.hexdigest()}'
+
+        image = None if self.no_cache else self.get_image_by_tag(tag)
+        if image is not None:
+            return image
+
+        return self.build_docker_image(
+            dockerfile=None,
+            fileobj=io.BytesIO(dockerfile),
+            buildargs={'FROM': rootfs_image.id},
+            tag=tag,
+            labels={IMAGE_LABEL: 'base'},
+        )
+
+
+    def get_variant_dir(self, name):
+        """
+        Directory (inside :file:`.scag`) with signature files and client config
+        of a signing variant.
+        """
+        return self.scag_dir / 'variants' / name
+
+
+    def render_client_config(self, mrenclave, variant=None):
+        scag_dir = (self.scag_dir if variant is None
+            else self.get_variant_dir(variant))
         self._render_template_to_path(
             'scag-client.toml',
-            self.scag_dir / 'scag-client.toml',
+            scag_dir / 'scag-client.toml',
             mrenclave=mrenclave)
 
 
-    def create_chroot(self):
+    def create_chroot(self, force=False):
         """
         Step: create chroot using mmdebstrap
+
+        Args:
+            force (bool): recreate chroot even if rootfs tarball exists
         """
 
-        # XXX: we probably want a force flag to rebuild rootfs
         if os.path.isfile(self.rootfs_tar):
-            return
+            if not force:
+                return
+            os.unlink(self.rootfs_tar)
+
+        apt = self.get_apt_options()
+        cache_args = []
+        if apt['cache']:
+            # keep downloaded packages until customize hooks, copy them in
+            # before and out after installation, then remove them from rootfs
+            apt['cache_dir'].mkdir(parents=True, exist_ok=True)
+            cache_args = [
+                '--skip=download/empty',
+                '--skip=essential/unlink',
+                '--setup-hook',
+                    'mkdir -p "$1"/var/cache/apt/archives/',
+                '--setup-hook',
+                    f'sync-in {apt["cache_dir"]} /var/cache/apt/archives/',
+                '--customize-hook',
+                    f'sync-out /var/cache/apt/archives {apt["cache_dir"]}',
+                '--customize-hook',
+                    'rm -f "$1"/var/cache/apt/archives/*.deb',
+            ]
+
+        reproducible = self.get_reproducible_options()
+        env = None
+        if reproducible['enable']:
+            # mmdebstrap clamps timestamps of files it creates, and passes the
+            # variable to dpkg and maintainer scripts
+            env = {**os.environ,
+                'SOURCE_DATE_EPOCH': str(reproducible['source_date_epoch'])}
 
         subprocess.run([
             'mmdebstrap',
@@ -279,53 +1166,253 @@ class Builder:
                 f'sh {self.scag_dir / "mmdebstrap-hooks/setup.sh"} "$@"',
             '--customize-hook',
                 f'sh {self.scag_dir / "mmdebstrap-hooks/customize.sh"} "$@"',
+            *cache_args,
 
             CODENAME,
             self.rootfs_tar,
             self.scag_dir / 'sources.list',
-        ], check=True)
+        ], check=True, env=env)
 
+        if reproducible['enable']:
+            normalize_tarball(self.rootfs_tar,
+                reproducible['source_date_epoch'])
 
-    def sign_chroot(self, rootdir, manifest_path='app/app.manifest'):
+        if apt['cache']:
+            prune_cache(apt['cache_dir'], apt['cache_size_mb'])
+
+
+    def sign_chroot(self, rootdir, manifest_path='app/app.manifest',
+            sign_args=None, file_layers=None):
         """
         Signs tarball of the system image. Manifest needs to be in
         /app/app.manifest
 
         Args:
             file: file object of the tarball
-            manifest_path (str): path to manifest inside the tarball
+            manifest_path (str): path to manifest inside the tarball (or
+                absolute path outside of it)
+            sign_args (list or None): extra arguments to
+                :command:`gramine-sgx-sign`; :obj:`None` means ``sgx.sign_args``
+            file_layers (dict or None): as returned by
+                :meth:`extract_docker_image`; needed for reusing cached hashes
+                of trusted files (see :attr:`trusted_files_cache`)
 
         Returns:
             (bytes, bytes): Tuple of file contents ``(app.manifest.sgx,
             app.sig)`` that need to be added into the final image. MRENCLAVE can
             be extracted from the latter.
         """
+        if sign_args is None:
+            sign_args = self.config.get('sgx', {}).get('sign_args', [])
+
         with tempfile.TemporaryDirectory() as tmpsigdir:
             tmpsigdir = pathlib.Path(tmpsigdir)
 
             tmpmsgx = tmpsigdir / 'app.manifest.sgx'
             tmpsig = tmpsigdir / 'app.sig'
 
+            manifest_path = rootdir / manifest_path
+            use_cache = (self.trusted_files_cache is not None
+                and file_layers is not None)
+            if use_cache:
+                expanded_path = tmpsigdir / 'app.manifest'
+                self.expand_trusted_files(rootdir, manifest_path,
+                    expanded_path, file_layers)
+                manifest_path = expanded_path
+
             subprocess.run([
                 'gramine-sgx-sign',
                 '--date', '0000-00-00',
-                *self.config.get('sgx', {}).get('sign_args', []),
+                *sign_args,
                 '--chroot', rootdir,
-                '--manifest', rootdir / manifest_path,
+                '--manifest', manifest_path,
                 '--output', tmpmsgx,
                 '--sigfile', tmpsig,
             ], check=True)
 
+            if use_cache:
+                self.update_trusted_files_cache(rootdir, tmpmsgx, file_layers)
+
             return (tmpmsgx.read_bytes(), tmpsig.read_bytes())
 
 
-    def sign_docker_image(self, image):
-        with (
-            tempfile.TemporaryFile() as savefile,
-            tempfile.TemporaryDirectory() as tmprootdir,
+    def _load_trusted_files_cache(self):
+        # kept in memory, if the builder is reused
+        if self._trusted_files is None:
+            try:
+                with open(self.trusted_files_cache, 'rb') as file:
+                    self._trusted_files = json.load(file)
+            except (OSError, ValueError):
+                self._trusted_files = {}
+        return self._trusted_files
+
+
+    @staticmethod
+    def _get_trusted_file_layer(rootdir, uri, file_layers):
+        # symlinks (also in parent directories, like /lib -> usr/lib) are
+        # resolved, the file is identified by the layer it comes from
+        local = rootdir / uri.removeprefix('file:').lstrip('/')
+        try:
+            if not local.is_file():
+                return None
+            name = local.resolve().relative_to(rootdir.resolve())
+        except (OSError, ValueError):
+            return None
+        return file_layers.get(f'/{name}')
+
+
+    def expand_trusted_files(self, rootdir, manifest_path, path, file_layers):
+        """
+        Write manifest, in which trusted files are expanded from directories
+        (recursively, in sorted order, like :command:`gramine-sgx-sign` does),
+        and hashes of files that didn't change since they were cached are
+        filled in, so :command:`gramine-sgx-sign` doesn't need to compute them
+        again. A file didn't change if it comes from the same layer (by
+        digest of layer content), so neither same size and timestamps (which
+        are clamped in reproducible builds) nor cache restored on another
+        host can lead to a stale hash.
+
+        Args:
+            rootdir (pathlib.Path): chroot
+            manifest_path (pathlib.Path): path to the original manifest
+            path (pathlib.Path): where to write new manifest
+            file_layers (dict): as returned by :meth:`extract_docker_image`
+        """
+        with self._trusted_files_lock:
+            cache = dict(self._load_trusted_files_cache())
+
+        with open(manifest_path, 'rb') as file:
+            manifest = tomli.load(file)
+
+        def expand(uri):
+            if not uri.startswith('file:'):
+                return [uri]
+            local = rootdir / uri.removeprefix('file:').lstrip('/')
+            if not uri.endswith('/') or not local.is_dir():
+                return [uri]
+            return [f'file:/{sub.relative_to(rootdir)}'
+                for sub in sorted(local.rglob('*')) if sub.is_file()]
+
+        trusted_files = []
+        for entry in manifest.get('sgx', {}).get('trusted_files', []):
+            if isinstance(entry, dict):
+                if 'sha256' in entry:
+                    trusted_files.append(entry)
+                    continue
+                entry = entry['uri']
+            for uri in expand(entry):
+                cached = cache.get(uri)
+                layer = self._get_trusted_file_layer(rootdir, uri, file_layers)
+                if cached is not None and layer is not None and (
+                        cached[0] == layer):
+                    trusted_files.append({'uri': uri, 'sha256': cached[1]})
+                else:
+                    trusted_files.append(uri)
+
+        if trusted_files:
+            manifest['sgx']['trusted_files'] = trusted_files
+        with open(path, 'wb') as file:
+            tomli_w.dump(manifest, file)
+
+
+    def update_trusted_files_cache(self, rootdir, manifest_sgx_path,
+            file_layers):
+        """
+        Remember hashes of trusted files from signed manifest, together with
+        layers the files come from (see :meth:`expand_trusted_files`).
+        """
+        with open(manifest_sgx_path, 'rb') as file:
+            manifest = tomli.load(file)
+
+        with self._trusted_files_lock:
+            cache = self._load_trusted_files_cache()
+            for entry in manifest.get('sgx', {}).get('trusted_files', []):
+                if not isinstance(entry, dict) or 'sha256' not in entry:
+                    continue
+                layer = self._get_trusted_file_layer(rootdir, entry['uri'],
+                    file_layers)
+                if layer is not None:
+                    cache[entry['uri']] = [layer, entry['sha256']]
+
+            self.trusted_files_cache.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.trusted_files_cache, 'w', encoding='utf-8') as file:
+                json.dump(cache, file)
+
+
+    @staticmethod
+    def write_variant_manifest(manifest_path, path, variant):
+        """
+        Write manifest of a signing variant, i.e. the manifest with ``sgx.*``
+        options overridden by the variant.
+
+        Args:
+            manifest_path (pathlib.Path): path to the original manifest
+            path (pathlib.Path): where to write new manifest
+            variant (dict): options of the variant, as returned by
+                :meth:`get_variants`
+        """
+        with open(manifest_path, 'rb') as file:
+            manifest = tomli.load(file)
+
+        sgx = manifest.setdefault('sgx', {})
+        for option, key in (
+            ('debug', 'debug'),
+            ('isv_svn', 'isvsvn'),
+            ('isv_prod_id', 'isvprodid'),
         ):
-            tmprootdir = pathlib.Path(tmprootdir)
+            if variant[option] is not None:
+                sgx[key] = variant[option]
+
+        with open(path, 'wb') as file:
+            tomli_w.dump(manifest, file)
+
 
+    def sign_chroot_variants(self, rootdir, variants,
+            manifest_path='app/app.manifest', file_layers=None):
+        """
+        Sign the same chroot for the default configuration and for each of the
+        variants. :command:`gramine-sgx-sign` processes are run in parallel,
+        they only read the chroot.
+
+        Args:
+            rootdir (pathlib.Path): chroot
+            variants (dict): as returned by :meth:`get_variants`
+            manifest_path (str): path to manifest inside the chroot
+            file_layers (dict or None): see :meth:`sign_chroot`
+
+        Returns:
+            dict: variant name (:obj:`None` for the default) to ``(bytes,
+            bytes)`` tuple as returned by :meth:`sign_chroot`
+        """
+        with tempfile.TemporaryDirectory() as tmpmanifestdir, \
+                concurrent.futures.ThreadPoolExecutor() as executor:
+            tmpmanifestdir = pathlib.Path(tmpmanifestdir)
+
+            futures = {None: executor.submit(self.sign_chroot, rootdir,
+                manifest_path, file_layers=file_layers)}
+            for name, variant in variants.items():
+                variant_manifest = tmpmanifestdir / f'{name}.manifest'
+                self.write_variant_manifest(rootdir / manifest_path,
+                    variant_manifest, variant)
+                futures[name] = executor.submit(self.sign_chroot, rootdir,
+                    variant_manifest, variant['sign_args'], file_layers)
+
+            return {name: future.result() for name, future in futures.items()}
+
+
+    def extract_docker_image(self, image, rootdir):
+        """
+        Extract filesystem of docker image into a directory.
+
+        Args:
+            image: docker image
+            rootdir (pathlib.Path): target directory
+
+        Returns:
+            dict: absolute path of every file extracted to digest of
+            (uncompressed) content of the topmost layer that contains it
+        """
+        with tempfile.TemporaryFile() as savefile:
             for chunk in image.save():
                 savefile.write(chunk)
             savefile.seek(0)
@@ -335,8 +1422,11 @@ class Builder:
 
                 # assert we have only 1 image
                 m_image, = manifest
+                diff_ids = json.load(tar.extractfile(
+                    m_image['Config']))['rootfs']['diff_ids']
 
-                for layer_path in m_image['Layers']:
+                file_layers = {}
+                for layer_path, diff_id in zip(m_image['Layers'], diff_ids):
                     with tarfile.open(
                         fileobj=tar.extractfile(layer_path)
                     ) as layer_tar:
@@ -345,16 +1435,82 @@ class Builder:
                         # should be measuring them.
                         # TODO after Python 12: use extractall(filter=)
                         members = layer_tar.getmembers()
-                        members = [ti for ti in members if not ti.isdev()]
-                        layer_tar.extractall(tmprootdir, members=members)
+                        members = [ti for ti in members if not ti.isdev()
+                            and not apply_whiteout(rootdir, ti.name)]
+                        layer_tar.extractall(rootdir, members=members)
+                        file_layers.update(
+                            (posixpath.normpath(f'/{ti.name}'), diff_id)
+                            for ti in members)
+
+        return file_layers
+
+
+    def sign_docker_image(self, image, variants=None):
+        """
+        Step: extract the image and sign it, then build final image with
+        signature files.
+
+        The image is extracted once, and signed also for every variant. Final
+        image of each variant is tagged, and its signature files and client
+        config are placed in :meth:`get_variant_dir`.
+
+        Args:
+            image: unsigned docker image
+            variants (dict or None): as returned by :meth:`get_variants`;
+                :obj:`None` means variants from config
+
+        Returns:
+            tuple: ``(image, mrenclave)`` of the default configuration
+        """
+        # pylint: disable=too-many-locals
+        if variants is None:
+            variants = self.get_variants()
 
-                msgx, sig = self.sign_chroot(tmprootdir)
+        with tempfile.TemporaryDirectory() as tmprootdir:
+            tmprootdir = pathlib.Path(tmprootdir)
+            file_layers = self.extract_docker_image(image, tmprootdir)
+            signed = self.sign_chroot_variants(tmprootdir, variants,
+                file_layers=file_layers)
 
+        msgx, sig = signed.pop(None)
         (self.scag_dir / 'app.manifest.sgx').write_bytes(msgx)
         (self.scag_dir / 'app.sig').write_bytes(sig)
         image2 = self.build_docker_image(
             dockerfile='.scag/Dockerfile-final',
-            buildargs={'FROM': image.id})
+            buildargs={'FROM': image.id},
+            labels=self.get_app_labels('final'))
+        variant_images = {}
+
+        for name, (variant_msgx, variant_sig) in signed.items():
+            variant_dir = self.get_variant_dir(name)
+            variant_dir.mkdir(parents=True, exist_ok=True)
+            (variant_dir / 'app.manifest.sgx').write_bytes(variant_msgx)
+            (variant_dir / 'app.sig').write_bytes(variant_sig)
+            variant_image = self.build_docker_image(
+                dockerfile='.scag/Dockerfile-final',
+                buildargs={
+                    'FROM': image.id,
+                    'SIGNATURE_DIR': os.fspath(
+                        variant_dir.relative_to(self.project_dir)),
+                },
+                tag=variants[name]['tag'],
+                labels=self.get_app_labels('final'))
+            variant_images[name] = variant_image.id
+            variant_mrenclave = extract_mrenclave_from_bytes(variant_sig).hex()
+            self.render_client_config(variant_mrenclave, variant=name)
+            click.echo(f'Variant {name}: image {variant_image.id} '
+                f'({variants[name]["tag"]}), MRENCLAVE {variant_mrenclave}',
+                err=True)
+
+        self.build_registry.record(self.project_dir, {
+            'config': self.get_config_key(),
+            'images': {
+                **{kind: built.id for kind, built in self.built_images.items()},
+                'app': image.id,
+                'final': image2.id,
+            },
+            'variants': variant_images,
+        })
 
         mrenclave = extract_mrenclave_from_bytes(sig).hex()
         return image2, mrenclave
@@ -363,23 +1519,65 @@ class Builder:
     def build_docker_image(self, dockerfile='.scag/Dockerfile', **kwds):
         """
         Step: create docker image from chroot.tar
-        """
-        kwds.setdefault('rm', True)
-
-        image, _ = self.docker.images.build(
-            path=os.fspath(self.project_dir),
-            dockerfile=dockerfile,
-            **kwds,
-        )
-        return image
 
+        The build output is streamed: progress of each Dockerfile instruction
+        is printed, and its duration and use of build cache is recorded in
+        :attr:`build_metrics`. Without ``fileobj``, project directory is the
+        build context.
 
-    def get_docker_run_cmd(self, docker_id):
+        Raises:
+            docker.errors.BuildError: if the build failed
+        """
+        kwds.setdefault('rm', True)
+        kwds.setdefault('nocache', self.no_cache)
+        reproducible = self.get_reproducible_options()
+        if reproducible['enable']:
+            kwds['buildargs'] = {
+                'SOURCE_DATE_EPOCH': str(reproducible['source_date_epoch']),
+                **kwds.get('buildargs', {}),
+            }
+        if 'fileobj' not in kwds:
+            kwds['path'] = os.fspath(self.project_dir)
+
+        recorder = buildlog.BuildRecorder(dockerfile or 'Dockerfile-base')
+        for chunk in self.docker.api.build(dockerfile=dockerfile, decode=True,
+                **kwds):
+            for line in recorder.feed(chunk):
+                if line.startswith(SLIM_REPORT_PREFIX):
+                    saved = int(line[len(SLIM_REPORT_PREFIX):])
+                    click.echo(
+                        f'Slimming stage removed {saved} bytes from image',
+                        err=True)
+
+        metrics = recorder.finish()
+        self.build_metrics.append(metrics)
+        if recorder.image_id is None:
+            raise docker.errors.BuildError('unknown image ID', recorder.log)
+        return self.docker.images.get(recorder.image_id)
+
+
+    def get_docker_run_cmd(self, docker_id, sgx=True):
+        """
+        :command:`docker run` command for the image. With *sgx* false, SGX
+        device and AESM socket are not passed to the container (e.g. for
+        :command:`gramine-direct`).
+        """
+        metrics = self.get_metrics_options()
+        metrics_args = []
+        if metrics['enable']:
+            metrics_args = ['--publish', f'{metrics["port"]}:{metrics["port"]}']
+        sgx_args = []
+        if sgx:
+            sgx_args = [
+                '--device', '/dev/sgx_enclave',
+                '--volume',
+                '/var/run/aesmd/aesm.socket:/var/run/aesmd/aesm.socket',
+            ]
         return [
             'docker', 'run',
-            '--device', '/dev/sgx_enclave',
-            '--volume', '/var/run/aesmd/aesm.socket:/var/run/aesmd/aesm.socket',
+            *sgx_args,
             *self.extra_run_args,
+            *metrics_args,
             docker_id,
         ]
 
@@ -404,6 +1602,7 @@ class PythonBuilder(Builder):
     bootstrap_defaults = (
         '--application=hello_world.py',
     )
+    sigterm_injection = True
 
     @classmethod
     def cmdline_setup_parser(cls, project_dir, passthrough_env):
@@ -437,23 +1636,77 @@ class FlaskBuilder(Builder):
     extra_run_args = (
         '--publish', '8080:8080',
     )
+    supports_metrics = True
+    # UNIX socket of uWSGI stats server, proxied by nginx on metrics port
+    uwsgi_stats_socket = '/tmp/uwsgi-stats.socket'
+    # uWSGI's own threads and Gramine's helper threads
+    uwsgi_extra_threads = 4
+    # nginx talks uwsgi protocol to uWSGI (uwsgi_pass), which closes the
+    # connection after every request
+    nginx_upstream_keepalive = False
+
+    def get_uwsgi_options(self):
+        """
+        Options for uWSGI application server, with defaults filled in.
+        """
+        options = {
+            'processes': 1,
+            'threads': 1,
+            'listen': 100,
+            'lazy_apps': False,
+        }
+        options.update((key, self.variables[key])
+            for key in options if key in self.variables)
+        return options
+
+    def get_max_threads(self):
+        """
+        Every uWSGI process is a separate enclave, so each enclave needs to fit
+        threads of a single worker. If ``sgx.max_threads`` is not configured,
+        it's raised as needed.
 
+        Raises:
+            ValueError: if configured ``sgx.max_threads`` is too small
+        """
+        needed = self.get_uwsgi_options()['threads'] + self.uwsgi_extra_threads
+        max_threads = self.config.get('sgx', {}).get('max_threads')
+        if max_threads is None:
+            return max(self.default_max_threads, needed)
+        if max_threads < needed:
+            raise ValueError(
+                f'sgx.max_threads = {max_threads} is too small for '
+                f'{self.framework}.threads, needs at least {needed}')
+        return max_threads
 
-class NodejsBuilder(Builder):
-    framework = 'nodejs_plain'
-    bootstrap_defaults = (
-        '--application=app.js',
-    )
-    extra_run_args = (
-        '--publish', '8080:8080',
-    )
+    def get_enclave_size(self):
+        """
+        If ``sgx.enclave_size`` is not configured, it's derived from number of
+        uWSGI threads.
+        """
+        enclave_size = self.config.get('sgx', {}).get('enclave_size')
+        if enclave_size is not None:
+            return enclave_size
+        return format_enclave_size(
+            512 + 32 * self.get_uwsgi_options()['threads'])
 
     @classmethod
     def cmdline_setup_parser(cls, project_dir, passthrough_env):
         @click.command()
-        @utils.gramine_option_prompt('--application', required=True, type=str,
-            prompt="Which script is the main one")
-        def click_parser(application):
+        @utils.gramine_option_prompt('--processes', type=click.IntRange(1),
+            default=1,
+            help='Number of uWSGI worker processes (each is a separate '
+                'enclave).')
+        @utils.gramine_option_prompt('--threads', type=click.IntRange(1),
+            default=1,
+            help='Number of threads in each uWSGI worker process.')
+        @utils.gramine_option_prompt('--listen', type=click.IntRange(1),
+            default=100,
+            help='Size of uWSGI socket listen queue.')
+        @utils.gramine_option_prompt('--lazy_apps', is_flag=True,
+            default=False,
+            help='Load application in each worker instead of preloading it '
+                'before fork.')
+        def click_parser(processes, threads, listen, lazy_apps):
             return cls(project_dir, {
                 'application': {
                     'framework': cls.framework,
@@ -462,32 +1715,100 @@ class NodejsBuilder(Builder):
                     'passthrough_env': passthrough_env,
                 },
                 cls.framework: {
-                    'application': application,
+                    'processes': processes,
+                    'threads': threads,
+                    'listen': listen,
+                    'lazy_apps': lazy_apps,
                 },
             })
         return click_parser
 
 
-class ExpressjsBuilder(Builder):
-    framework = 'expressjs'
+class NodejsBuilder(Builder):
+    framework = 'nodejs_plain'
     bootstrap_defaults = (
-        '--application=index.js',
+        '--application=app.js',
     )
     extra_files = {
-        'etc/nginx.conf': (
-            'frameworks/nginx/nginx.conf',
+        'etc/scag-workers.js': (
+            'frameworks/nodejs_plain/scag-workers.js',
+        ),
+        'etc/scag-metrics.js': (
+            'frameworks/nodejs_plain/scag-metrics.js',
         ),
     }
     extra_run_args = (
         '--publish', '8080:8080',
     )
+    supports_metrics = True
+    # UNIX socket on which the application listens, if it's behind nginx
+    http_socket = None
+    # UNIX socket of metrics server, if it's behind nginx (otherwise metrics are
+    # served by Node.js itself on metrics port)
+    metrics_socket = '/tmp/scag-metrics.socket'
+    # every worker thread has its own event loop and V8 heap
+    worker_extra_threads = 2
+    worker_enclave_size_mb = 256
+
+    def get_workers(self):
+        """
+        Number of worker threads that run the application.
+
+        Raises:
+            ValueError: if more workers were requested, but the application
+                doesn't listen on UNIX socket behind nginx
+        """
+        workers = int(self.variables.get('workers', 1))
+        if workers > 1 and self.http_socket is None:
+            # worker threads don't share listening sockets, so every worker
+            # would try to bind the same TCP port
+            raise ValueError(
+                f'{self.framework}.workers > 1 is supported only for frameworks'
+                ' behind nginx (expressjs, koajs)')
+        return workers
+
+    def get_http_sockets(self):
+        """
+        UNIX sockets on which the application listens, one for each worker.
+        """
+        if self.http_socket is None:
+            return []
+        workers = self.get_workers()
+        if workers == 1:
+            return [self.http_socket]
+        return [f'{self.http_socket}.{i}' for i in range(workers)]
+
+    def get_max_threads(self):
+        """
+        If ``sgx.max_threads`` is not configured, it's raised for additional
+        workers.
+        """
+        max_threads = self.config.get('sgx', {}).get('max_threads')
+        if max_threads is not None:
+            return max_threads
+        return (self.default_max_threads
+            + self.worker_extra_threads * (self.get_workers() - 1))
+
+    def get_enclave_size(self):
+        """
+        If ``sgx.enclave_size`` is not configured, it's raised for additional
+        workers.
+        """
+        enclave_size = self.config.get('sgx', {}).get('enclave_size')
+        if enclave_size is not None:
+            return enclave_size
+        return format_enclave_size(1024
+            + self.worker_enclave_size_mb * (self.get_workers() - 1))
 
     @classmethod
     def cmdline_setup_parser(cls, project_dir, passthrough_env):
         @click.command()
         @utils.gramine_option_prompt('--application', required=True, type=str,
             prompt="Which script is the main one")
-        def click_parser(application):
+        @utils.gramine_option_prompt('--workers', type=click.IntRange(1),
+            default=1,
+            help='Number of worker threads running the application.')
+        def click_parser(application, workers):
             return cls(project_dir, {
                 'application': {
                     'framework': cls.framework,
@@ -497,43 +1818,40 @@ class ExpressjsBuilder(Builder):
                 },
                 cls.framework: {
                     'application': application,
+                    'workers': workers,
                 },
             })
         return click_parser
 
 
-class KoajsBuilder(Builder):
-    framework = 'koajs'
+class ExpressjsBuilder(NodejsBuilder):
+    framework = 'expressjs'
     bootstrap_defaults = (
         '--application=index.js',
     )
     extra_files = {
+        **NodejsBuilder.extra_files,
         'etc/nginx.conf': (
-            'frameworks/nginx/nginx.conf',
+            'frameworks/nginx/nginx-nodejs.conf',
         ),
     }
-    extra_run_args = (
-        '--publish', '8080:8080',
-    )
+    http_socket = '/tmp/http.socket'
+    slim_packages = ('npm',)
 
-    @classmethod
-    def cmdline_setup_parser(cls, project_dir, passthrough_env):
-        @click.command()
-        @utils.gramine_option_prompt('--application', required=True, type=str,
-            prompt="Which script is the main one")
-        def click_parser(application):
-            return cls(project_dir, {
-                'application': {
-                    'framework': cls.framework,
-                },
-                'gramine': {
-                    'passthrough_env': passthrough_env,
-                },
-                cls.framework: {
-                    'application': application,
-                },
-            })
-        return click_parser
+
+class KoajsBuilder(NodejsBuilder):
+    framework = 'koajs'
+    bootstrap_defaults = (
+        '--application=index.js',
+    )
+    extra_files = {
+        **NodejsBuilder.extra_files,
+        'etc/nginx.conf': (
+            'frameworks/nginx/nginx-nodejs.conf',
+        ),
+    }
+    http_socket = '/tmp/http.socket'
+    slim_packages = ('npm',)
 
 
 class JavaJARBuilder(Builder):
@@ -541,16 +1859,71 @@ class JavaJARBuilder(Builder):
     bootstrap_defaults = (
         '--application=hello_world.jar',
     )
+    extra_files = {
+        'etc/scag-metrics/ScagMetrics.java': (
+            'frameworks/java_jar/ScagMetrics.java',
+        ),
+    }
     extra_run_args = (
         '--publish', '8080:8080',
     )
+    supports_metrics = True
+    default_enclave_size = '4G'
+    # path of AppCDS archive created by training run during image build
+    cds_archive = '/app/app.jsa'
+    # Java agent serving metrics, compiled during image build
+    metrics_agent = '/usr/local/lib/scag-metrics.jar'
+
+    def get_java_options(self):
+        """
+        Java-specific options, with defaults filled in.
+        """
+        options = {
+            'cds': False,
+            'cds_training_timeout': 60,
+        }
+        options.update((key, self.variables[key])
+            for key in options if key in self.variables)
+        return options
+
+    def get_jvm_args(self, cds=None):
+        """
+        JVM arguments. Maximum heap size is half of the enclave, the other half
+        is left for metaspace, code cache, thread stacks and Gramine itself.
+        Small enclaves get serial GC, bigger ones get parallel GC with number
+        of threads that fit in the enclave thread budget.
+
+        Args:
+            cds (bool or None): whether to use AppCDS archive; :obj:`None` means
+                as configured
+        """
+        if cds is None:
+            cds = self.get_java_options()['cds']
+        enclave_size_mb = parse_enclave_size(self.get_enclave_size())
+
+        args = [
+            '-XX:CompressedClassSpaceSize=32m',
+            f'-Xmx{enclave_size_mb // 2}m',
+        ]
+        if enclave_size_mb < 4096:
+            args.append('-XX:+UseSerialGC')
+        else:
+            args.extend((
+                '-XX:+UseParallelGC',
+                f'-XX:ParallelGCThreads={max(1, self.get_max_threads() // 4)}',
+            ))
+        if cds:
+            args.append(f'-XX:SharedArchiveFile={self.cds_archive}')
+        return args
 
     @classmethod
     def cmdline_setup_parser(cls, project_dir, passthrough_env):
         @click.command()
         @utils.gramine_option_prompt('--application', required=True, type=str,
             prompt="Which JAR is the main one")
-        def click_parser(application):
+        @utils.gramine_option_prompt('--cds', is_flag=True, default=False,
+            help='Create AppCDS archive by a training run during image build.')
+        def click_parser(application, cds):
             return cls(project_dir, {
                 'application': {
                     'framework': cls.framework,
@@ -560,35 +1933,19 @@ class JavaJARBuilder(Builder):
                 },
                 cls.framework: {
                     'application': application,
+                    'cds': cds,
                 },
             })
         return click_parser
 
 
-class JavaGradleBuilder(Builder):
+class JavaGradleBuilder(JavaJARBuilder):
     framework = 'java_gradle'
     bootstrap_defaults = (
         '--application=build/libs/hello_world.jar',
     )
-
-    @classmethod
-    def cmdline_setup_parser(cls, project_dir, passthrough_env):
-        @click.command()
-        @utils.gramine_option_prompt('--application', required=True, type=str,
-            prompt="Which JAR is the main one")
-        def click_parser(application):
-            return cls(project_dir, {
-                'application': {
-                    'framework': cls.framework,
-                },
-                'gramine': {
-                    'passthrough_env': passthrough_env,
-                },
-                cls.framework: {
-                    'application': application,
-                },
-            })
-        return click_parser
+    extra_run_args = ()
+    slim_packages = ('gradle', 'openjdk-17-jdk')
 
 
 class DotnetBuilder(Builder):
@@ -601,6 +1958,68 @@ class DotnetBuilder(Builder):
     extra_run_args = (
         '--publish', '8080:8080',
     )
+    default_enclave_size = '2G'
+    # directory with output of dotnet publish
+    publish_dir = '/app/publish'
+    # runtime image for published application, see get_runtime_image()
+    file_variants = types.MappingProxyType({
+        **WANT_FILES_VARIANTS,
+        'Dockerfile-runtime': ('Dockerfile', {'stage': 'runtime'}),
+    })
+    # the SDK is not needed to run the application, but runtime is installed as
+    # its dependency, so the package can't be removed
+    slim_build_paths = (
+        '/usr/share/dotnet/packs',
+        '/usr/share/dotnet/sdk',
+        '/usr/share/dotnet/sdk-manifests',
+        '/usr/share/dotnet/templates',
+    )
+
+    def is_debug(self):
+        """
+        Debug mode of the enclave follows ``dotnet.build_config``.
+        """
+        return self.variables.get('build_config') != 'Release'
+
+    def get_runtime_image(self, rootfs_image):
+        """
+        With ``dotnet.publish``, the published application is copied onto
+        rootfs with .NET runtime (or only native libraries, for self-contained
+        application), which is built from :file:`Dockerfile-runtime`.
+        """
+        if not self.get_publish_options()['publish']:
+            return None
+        return self._get_shared_image(rootfs_image, 'Dockerfile-runtime',
+            f'{self.framework}-runtime')
+
+    def get_publish_options(self):
+        """
+        Options for ``dotnet publish``, with defaults filled in.
+
+        Raises:
+            ValueError: if self-contained or trimmed output was requested
+                without publishing, or trimming without self-contained output
+        """
+        options = {
+            'publish': False,
+            'ready_to_run': True,
+            'self_contained': False,
+            'trimmed': False,
+        }
+        options.update((key, self.variables[key])
+            for key in options if key in self.variables)
+
+        for option in ('self_contained', 'trimmed'):
+            if options[option] and not options['publish']:
+                raise ValueError(
+                    f'{self.framework}.{option} requires '
+                    f'{self.framework}.publish')
+        if options['trimmed'] and not options['self_contained']:
+            raise ValueError(
+                f'{self.framework}.trimmed requires '
+                f'{self.framework}.self_contained')
+
+        return options
 
     @classmethod
     def cmdline_setup_parser(cls, project_dir, passthrough_env):
@@ -614,7 +2033,21 @@ class DotnetBuilder(Builder):
         @utils.gramine_option_prompt('--target', required=True, type=str,
             help='Application binary (found in bin/{Debug|Release}/net7.0)',
             prompt='Application binary (found in bin/{Debug|Release}/net7.0)')
-        def click_parser(build_config, project_file, target):
+        @utils.gramine_option_prompt('--publish', is_flag=True, default=False,
+            help='Use dotnet publish and ship only the runtime (not the SDK)')
+        @utils.gramine_option_prompt('--ready_to_run/--no_ready_to_run',
+            default=True,
+            help='Precompile published assemblies (ReadyToRun)')
+        @utils.gramine_option_prompt('--self_contained', is_flag=True,
+            default=False,
+            help='Publish self-contained application, without shared runtime'
+                ' (requires --publish)')
+        @utils.gramine_option_prompt('--trimmed', is_flag=True, default=False,
+            help='Trim unused assemblies (requires --publish and'
+                ' --self_contained)')
+        def click_parser(build_config, project_file, target, publish,
+                ready_to_run, self_contained, trimmed):
+            # pylint: disable=too-many-arguments,too-many-positional-arguments
             return cls(project_dir, {
                 'application': {
                     'framework': cls.framework,
@@ -626,6 +2059,10 @@ class DotnetBuilder(Builder):
                     'build_config': build_config,
                     'project_file': project_file,
                     'target': target,
+                    'publish': publish,
+                    'ready_to_run': ready_to_run,
+                    'self_contained': self_contained,
+                    'trimmed': trimmed,
                 },
             })
         return click_parser
@@ -0,0 +1,125 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Parsing of streamed output of docker build, with metrics of each Dockerfile
+instruction (duration and whether the build cache was used).
+"""
+
+import re
+import time
+
+import click
+import docker
+
+STEP_RE = re.compile(r'Step (?P<step>\d+)/(?P<total>\d+) : (?P<instruction>.*)')
+SUCCESS_RE = re.compile(r'Successfully built (?P<id>[0-9a-f]+)')
+
+USING_CACHE = '---> Using cache'
+RUNNING_IN = '---> Running in '
+
+
+class BuildRecorder:
+    """
+    Consumes chunks of build output (as decoded by low-level
+    :meth:`docker.api.build.BuildApiMixin.build`), prints progress and records
+    metrics.
+
+    Args:
+        dockerfile (str): name of the Dockerfile, for progress and metrics
+        echo (callable or None): called with each progress message; by default
+            messages are printed on stderr
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, dockerfile, echo=None):
+        self.dockerfile = dockerfile
+        self.echo = echo if echo is not None else (
+            lambda message: click.echo(message, err=True))
+        self.image_id = None
+        self.steps = []
+        self.log = []
+        self._buffer = ''
+        self._start = time.monotonic()
+        self._step_start = None
+
+    def feed(self, chunk):
+        """
+        Process one chunk of output.
+
+        Returns:
+            list of str: complete lines of output in this chunk
+
+        Raises:
+            docker.errors.BuildError: if the build failed
+        """
+        self.log.append(chunk)
+        if 'error' in chunk:
+            self._finish_step()
+            raise docker.errors.BuildError(chunk['error'], self.log)
+        if 'ID' in chunk.get('aux', {}):
+            self.image_id = chunk['aux']['ID']
+
+        self._buffer += chunk.get('stream', '')
+        *lines, self._buffer = self._buffer.split('\n')
+        lines = [line.strip() for line in lines if line.strip()]
+        for line in lines:
+            self._parse_line(line)
+        return lines
+
+    def _parse_line(self, line):
+        match = STEP_RE.fullmatch(line)
+        if match:
+            self._finish_step()
+            self._step_start = time.monotonic()
+            self.steps.append({
+                'step': int(match.group('step')),
+                'instruction': match.group('instruction'),
+                'cached': None,
+                'duration': None,
+            })
+            self.echo(f'[{self.dockerfile}] {line}')
+            return
+
+        if self.steps and self._step_start is not None:
+            if line == USING_CACHE:
+                self.steps[-1]['cached'] = True
+            elif line.startswith(RUNNING_IN):
+                self.steps[-1]['cached'] = False
+
+        match = SUCCESS_RE.fullmatch(line)
+        if match and self.image_id is None:
+            self.image_id = match.group('id')
+
+    def _finish_step(self):
+        if self._step_start is None:
+            return
+        step = self.steps[-1]
+        step['duration'] = round(time.monotonic() - self._step_start, 3)
+        self._step_start = None
+        if step['cached']:
+            self.echo(' ---> cached')
+        elif step['cached'] is False:
+            self.echo(f' ---> {step["duration"]:.1f}s')
+
+    def finish(self):
+        """
+        Finish recording, after the output ended.
+
+        Returns:
+            dict: JSON-serialisable metrics of the build
+        """
+        if self._buffer.strip():
+            self._parse_line(self._buffer.strip())
+            self._buffer = ''
+        self._finish_step()
+        return {
+            'dockerfile': self.dockerfile,
+            'image': self.image_id,
+            'duration': round(time.monotonic() - self._start, 3),
+            'steps': self.steps,
+            'cache_hits': sum(1 for step in self.steps if step['cached']),
+            'cache_misses': sum(1 for step in self.steps
+                if step['cached'] is False),
+        }
+
+# vim: tw=80
@@ -0,0 +1,107 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Registry of builds: which images belong to which project and configuration,
+used by :command:`scag-gc` (see :mod:`graminescaffolding.prune`).
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import pathlib
+import time
+
+# how many builds of every project are kept in the registry
+REGISTRY_LIMIT = 20
+
+
+class BuildRegistry:
+    """
+    Recent builds of every project, kept in a directory with one JSON file per
+    project.
+
+    Args:
+        path (pathlib.Path): the directory, created if needed when recording
+    """
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+
+    def get_project_path(self, project_dir):
+        name = os.fspath(pathlib.Path(project_dir).resolve())
+        return self.path / f'{hashlib.sha256(name.encode()).hexdigest()}.json'
+
+    @contextlib.contextmanager
+    def _locked(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / '.lock', 'w', encoding='utf-8') as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            yield
+
+    def _write(self, project_dir, builds):
+        path = self.get_project_path(project_dir)
+        tmp_path = path.with_name(f'.{path.name}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'project': os.fspath(pathlib.Path(project_dir).resolve()),
+                'builds': builds,
+            }, file, indent=4)
+            file.write('\n')
+        os.replace(tmp_path, path)
+
+    def record(self, project_dir, build):
+        """
+        Record a build of the project, with current time. Only
+        :data:`REGISTRY_LIMIT` latest builds are kept.
+
+        Args:
+            project_dir (pathlib.Path): project directory
+            build (dict): ``config`` (hash of configuration), ``images``
+                (kind to image ID) and ``variants`` (name to image ID)
+        """
+        with self._locked():
+            builds = self.load().get(
+                os.fspath(pathlib.Path(project_dir).resolve()), [])
+            builds.append({'time': time.time(), **build})
+            self._write(project_dir, builds[-REGISTRY_LIMIT:])
+
+    def load(self):
+        """
+        Returns:
+            dict: project directory to list of its builds, oldest first
+        """
+        projects = {}
+        for path in self.path.glob('*.json'):
+            try:
+                with open(path, encoding='utf-8') as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            projects[data['project']] = data['builds']
+        return projects
+
+    def update(self, projects, *, snapshot=None):
+        """
+        Replace builds of projects; projects without builds are forgotten.
+
+        Args:
+            projects (dict): as returned by :meth:`load`
+            snapshot (dict or None): what *projects* were computed from (as
+                returned by :meth:`load`); builds recorded since then are kept
+                in addition to *projects*
+        """
+        with self._locked():
+            current = self.load() if snapshot is not None else {}
+            for project_dir, builds in projects.items():
+                if snapshot is not None:
+                    latest = max((build['time']
+                        for build in snapshot.get(project_dir, [])), default=0)
+                    builds = builds + [build
+                        for build in current.get(project_dir, [])
+                        if build['time'] > latest]
+                if builds:
+                    self._write(project_dir, builds)
+                else:
+                    self.get_project_path(project_dir).unlink(missing_ok=True)
@@ -0,0 +1,297 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Local build daemon (:command:`scag daemon`), and client used by
+:command:`scag-build --daemon`.
+
+The daemon keeps state that is expensive to recreate on every invocation:
+docker client connection, loaded frameworks, builders (with their template
+environments, which cache compiled templates) and hashes of trusted files. It
+listens on UNIX socket and runs builds in threads, at most *workers* of them at
+once; other requests are queued. Builds of the same project are serialised,
+because they share :file:`.scag` directory.
+
+Protocol is newline-delimited JSON. Client sends one request::
+
+    {"command": "build", "project_dir": "/path", "conf": "scag.toml"}
+
+(``command`` can be also ``"measure"``), and daemon sends back any number of
+``{"status": ...}`` and ``{"log": ...}`` messages, followed by either
+``{"result": ...}`` or ``{"error": ...}``.
+"""
+
+import io
+import json
+import os
+import pathlib
+import socket
+import socketserver
+import stat
+import sys
+import threading
+
+import docker
+import tomli
+
+from . import (
+    sigstruct as _sigstruct,
+    utils,
+)
+
+DEFAULT_WORKERS = 2
+
+
+def get_default_socket_path():
+    """
+    Default path of the daemon socket: :file:`scag/daemon.sock` in
+    ``XDG_RUNTIME_DIR``, or in per-user directory in :file:`/tmp`.
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return pathlib.Path(runtime_dir) / 'scag' / 'daemon.sock'
+    return pathlib.Path(f'/tmp/scag-{os.getuid()}') / 'daemon.sock'
+
+
+def check_socket_dir(path):
+    """
+    Check that directory of the socket is private to the current user.
+    Otherwise (e.g. in shared :file:`/tmp`) other user could create it first
+    and listen on the socket instead of the daemon.
+
+    Raises:
+        PermissionError: if the directory is not a real directory, is owned by
+            other user or is accessible to group or others
+    """
+    path = pathlib.Path(path)
+    info = path.lstat()
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f'{path} is not a directory')
+    if info.st_uid != os.getuid():
+        raise PermissionError(f'{path} is owned by other user')
+    if info.st_mode & 0o077:
+        raise PermissionError(
+            f'{path} is accessible to other users (mode '
+            f'{stat.S_IMODE(info.st_mode):04o})')
+
+
+class _ThreadLocalStream(io.TextIOBase):
+    """
+    Text stream (installed as :data:`sys.stderr`), which sends writes from build
+    threads to their clients, and everything else to the original stream.
+    """
+    def __init__(self, fallback):
+        super().__init__()
+        self.fallback = fallback
+        self.local = threading.local()
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+    @property
+    def errors(self):
+        return 'replace'
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if not isinstance(s, str):
+            raise TypeError(f'write() argument must be str, not {type(s)}')
+        try:
+            sink = self.local.sink
+        except AttributeError:
+            return self.fallback.write(s)
+        sink(s)
+        return len(s)
+
+    def flush(self):
+        self.fallback.flush()
+
+
+class BuildDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Build daemon.
+
+    Args:
+        socket_path (pathlib.Path): path of the socket
+        workers (int): maximum number of concurrent builds
+    """
+    # pylint: disable=too-many-instance-attributes
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers=DEFAULT_WORKERS):
+        self.socket_path = pathlib.Path(socket_path)
+        self.socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        check_socket_dir(self.socket_path.parent)
+        if self.socket_path.is_socket():
+            self.socket_path.unlink()
+
+        super().__init__(os.fspath(self.socket_path), _RequestHandler)
+
+        # messages from builders are echoed to stderr
+        if not isinstance(sys.stderr, _ThreadLocalStream):
+            sys.stderr = _ThreadLocalStream(sys.stderr)
+        self.stderr = sys.stderr
+
+        self.workers = threading.BoundedSemaphore(workers)
+        self.docker_client = None
+        self._lock = threading.Lock()
+        self._project_locks = {}
+        self._frameworks = {}
+        self._builders = {}
+
+    def server_close(self):
+        super().server_close()
+        if sys.stderr is self.stderr:
+            sys.stderr = self.stderr.fallback
+        try:
+            self.socket_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def get_docker_client(self):
+        with self._lock:
+            if self.docker_client is None:
+                os.environ['DOCKER_BUILDKIT'] = '1'
+                self.docker_client = docker.from_env()
+            return self.docker_client
+
+    def get_project_lock(self, project_dir):
+        with self._lock:
+            return self._project_locks.setdefault(project_dir,
+                threading.Lock())
+
+    def get_builder(self, project_dir, conf):
+        """
+        Get builder for the project, reusing the previous one if the
+        configuration didn't change.
+        """
+        confpath = project_dir / conf
+        if not confpath.is_file():
+            raise ValueError(
+                f'Configuration file {confpath!r} not found or not a file')
+        data = confpath.read_bytes()
+
+        with self._lock:
+            cached = self._builders.get(confpath)
+        if cached is not None and cached[0] == data:
+            return cached[1]
+
+        config = tomli.loads(data.decode())
+        name = config['application']['framework']
+        with self._lock:
+            if name not in self._frameworks:
+                self._frameworks[name] = utils.gramine_load_framework(name)
+            buildertype = self._frameworks[name]
+
+        builder = buildertype(project_dir, config)
+        builder.trusted_files_cache = (builder.scag_dir
+            / 'trusted-files-cache.json')
+
+        with self._lock:
+            self._builders[confpath] = (data, builder)
+        return builder
+
+    def run_request(self, request):
+        """
+        Run one request (in the current thread).
+
+        Returns:
+            dict: JSON-serialisable result
+        """
+        command = request.get('command')
+        if command not in ('build', 'measure'):
+            raise ValueError(f'unknown command: {command!r}')
+
+        project_dir = pathlib.Path(request['project_dir']).resolve()
+        builder = self.get_builder(project_dir, request.get('conf',
+            'scag.toml'))
+        builder.docker = self.get_docker_client()
+
+        if command == 'build':
+            docker_id = builder.build()
+            return {
+                'image': docker_id,
+                'metrics': builder.build_metrics,
+            }
+        sig = builder.measure()
+        return {
+            'sigstruct': _sigstruct.parse_sigstruct(sig),
+            'metrics': builder.build_metrics,
+        }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def send(self, **message):
+        self.wfile.write(json.dumps(message).encode() + b'\n')
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            project_dir = pathlib.Path(request['project_dir']).resolve()
+        except (ValueError, LookupError, TypeError) as err:
+            self.send(error=f'invalid request: {err}')
+            return
+
+        self.send(status='queued')
+        with self.server.workers, \
+                self.server.get_project_lock(project_dir):
+            self.send(status='running')
+            self.server.stderr.local.sink = lambda s: self.send(log=s)
+            try:
+                result = self.server.run_request(request)
+            except Exception as err: # pylint: disable=broad-exception-caught
+                self.send(error=f'{type(err).__name__}: {err}')
+            else:
+                self.send(result=result)
+            finally:
+                del self.server.stderr.local.sink
+
+
+def serve(socket_path, workers=DEFAULT_WORKERS):
+    """
+    Run the daemon until interrupted.
+    """
+    with BuildDaemon(socket_path, workers) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def send_request(socket_path, message, log=None):
+    """
+    Send request to the daemon and wait for the result.
+
+    Args:
+        socket_path (pathlib.Path): path of the socket
+        message (dict): the request
+        log (callable or None): called with every log message and status
+
+    Returns:
+        dict: result
+
+    Raises:
+        OSError: if the daemon is not running, or the socket is not in private
+            directory (see :func:`check_socket_dir`)
+        RuntimeError: if the request failed
+    """
+    check_socket_dir(pathlib.Path(socket_path).parent)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(os.fspath(socket_path))
+        sock.sendall(json.dumps(message).encode() + b'\n')
+        with sock.makefile('rb') as file:
+            for line in file:
+                response = json.loads(line)
+                if 'result' in response:
+                    return response['result']
+                if 'error' in response:
+                    raise RuntimeError(response['error'])
+                if log is not None:
+                    log(response)
+    raise RuntimeError('daemon closed connection without result')
+
+# vim: tw=80
@@ -0,0 +1,198 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Profiling of Gramine applications (:command:`scag-profile`).
+
+The image is run like by :meth:`Builder.get_docker_run_cmd`, with output
+directory mounted at :data:`PROFILE_DIR`. Its default command is wrapped in
+a shell script, which copies Gramine log (stderr) into the output directory,
+forwards SIGINT and SIGTERM to Gramine, and after it exits copies
+:file:`sgx-perf*.data` files written by SGX profiling (``sgx.profile.*`` in
+the manifest). SGX statistics (``sgx.enable_stats``) are parsed from the log,
+and hotspots are read from perf data with :command:`perf report`, using
+filesystem of the image to resolve symbols.
+"""
+
+import json
+import pathlib
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+
+PROFILE_DIR = '/profile'
+LOG_FILE = 'gramine.log'
+SUMMARY_FILE = 'summary.json'
+
+# $1 is owner of the output files, the rest is command
+_PROFILE_SCRIPT = f'''
+owner=$1; shift
+"$@" 2> >(tee {PROFILE_DIR}/{LOG_FILE} >&2) &
+pid=$!
+trap 'kill -TERM "$pid" 2>/dev/null' INT TERM
+wait "$pid"; status=$?
+while kill -0 "$pid" 2>/dev/null; do wait "$pid"; status=$?; done
+cp sgx-perf*.data {PROFILE_DIR}/ 2>/dev/null
+chown -R "$owner" {PROFILE_DIR}
+exit "$status"
+'''
+
+_STATS_HEADER = re.compile(
+    r'----- (?:Total )?SGX stats for (process|thread) (\d+) -----')
+_STATS_LINE = re.compile(r'# of ([^:]+):\s*(\d+)')
+_PERF_LINE = re.compile(r'^\s*(\d+(?:\.\d+)?)%\s+(\S+)\s+\[\S+\]\s+(.+?)\s*$')
+
+
+def get_profile_run_cmd(builder, image, output_dir, owner):
+    """
+    Command to run the image with profiling output collected.
+
+    Args:
+        builder (Builder): builder of the image
+        image: docker image
+        output_dir (pathlib.Path): host directory for the output
+        owner (str): ``uid:gid`` to own the output files
+
+    Returns:
+        list: the command
+    """
+    cmd = image.attrs['Config']['Cmd'] or []
+    run_cmd = builder.get_docker_run_cmd(image.id)
+    return [
+        *run_cmd[:-1],
+        '--rm',
+        '--volume', f'{pathlib.Path(output_dir).resolve()}:{PROFILE_DIR}',
+        run_cmd[-1],
+        '-c', _PROFILE_SCRIPT, 'scag-profile', owner, *cmd,
+    ]
+
+
+def parse_stats(text):
+    """
+    Parse SGX statistics printed by Gramine when threads and processes exit.
+
+    Returns:
+        dict: process id (as :class:`str`) to a dict of counters (``eenters``,
+        ``eexits``, ``aexs``, ``sync_signals``, ``async_signals``); only
+        totals of processes are included
+    """
+    stats = {}
+    current = None
+    for line in text.splitlines():
+        match = _STATS_HEADER.search(line)
+        if match:
+            kind, pid = match.groups()
+            current = stats.setdefault(pid, {}) if kind == 'process' else None
+            continue
+        match = _STATS_LINE.search(line)
+        if match and current is not None:
+            name = match.group(1).lower().replace(' ', '_')
+            current[name] = int(match.group(2))
+    return stats
+
+
+def parse_perf_report(text, top):
+    """
+    Parse output of :command:`perf report --stdio --sort dso,sym`.
+
+    Returns:
+        list: up to *top* dicts with ``percent``, ``dso`` and ``symbol``
+    """
+    hotspots = []
+    for line in text.splitlines():
+        match = _PERF_LINE.match(line)
+        if match:
+            percent, dso, symbol = match.groups()
+            hotspots.append({
+                'percent': float(percent),
+                'dso': dso,
+                'symbol': symbol,
+            })
+    hotspots.sort(key=lambda hotspot: -hotspot['percent'])
+    return hotspots[:top]
+
+
+def perf_hotspots(path, top, symfs=None):
+    """
+    Top hotspots from a perf data file.
+
+    Args:
+        path (pathlib.Path): :file:`sgx-perf*.data` file
+        top (int): how many to return
+        symfs (pathlib.Path or None): filesystem of the image
+
+    Returns:
+        list or None: as returned by :func:`parse_perf_report`; :obj:`None`
+        if :command:`perf` is not installed
+    """
+    if shutil.which('perf') is None:
+        return None
+    cmd = ['perf', 'report', '--stdio', '--no-children', '-g', 'none',
+        '--sort', 'dso,sym', '--input', str(path)]
+    if symfs is not None:
+        cmd.append(f'--symfs={symfs}')
+    output = subprocess.run(cmd, stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL, check=True, text=True).stdout
+    return parse_perf_report(output, top)
+
+
+def summarize(builder, image, output_dir, top):
+    """
+    Collect stats and hotspots from output directory and write
+    :file:`summary.json` there.
+
+    Returns:
+        dict: the summary
+    """
+    output_dir = pathlib.Path(output_dir)
+    log_path = output_dir / LOG_FILE
+    summary = {
+        'image': image.id,
+        'stats': parse_stats(log_path.read_text(errors='replace')
+            if log_path.exists() else ''),
+        'profiles': {},
+    }
+
+    perf_files = sorted(output_dir.glob('sgx-perf*.data'))
+    if perf_files and shutil.which('perf') is not None:
+        with tempfile.TemporaryDirectory() as symfs:
+            builder.extract_docker_image(image, pathlib.Path(symfs))
+            for path in perf_files:
+                summary['profiles'][path.name] = perf_hotspots(path, top,
+                    symfs)
+    else:
+        for path in perf_files:
+            summary['profiles'][path.name] = None
+
+    with open(output_dir / SUMMARY_FILE, 'w', encoding='utf-8') as file:
+        json.dump(summary, file, indent=4)
+        file.write('\n')
+    return summary
+
+
+def format_summary(summary):
+    """
+    Format summary as returned by :func:`summarize` for humans.
+    """
+    lines = []
+    for pid, stats in summary['stats'].items():
+        lines.append(f'SGX stats for process {pid}:')
+        lines.extend(f'    {name}: {value}' for name, value in stats.items())
+    if not summary['stats']:
+        lines.append('No SGX stats collected (is profiling.stats enabled?)')
+
+    for name, hotspots in summary['profiles'].items():
+        if hotspots is None:
+            lines.append(f'{name}: perf not installed, run: perf report'
+                f' --input {shlex.quote(name)}')
+            continue
+        lines.append(f'Hotspots in {name}:')
+        lines.extend(
+            f'    {hotspot["percent"]:6.2f}%  {hotspot["symbol"]}'
+            f'  ({hotspot["dso"]})' for hotspot in hotspots)
+    if not summary['profiles']:
+        lines.append('No SGX profile collected (is profiling.profile set?)')
+
+    return '\n'.join(lines)
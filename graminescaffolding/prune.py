@@ -0,0 +1,179 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Garbage collection of images and caches left behind by builds
+(:command:`scag-gc`).
+
+Every build (:meth:`Builder.sign_docker_image`) is recorded in
+:class:`~graminescaffolding.buildregistry.BuildRegistry`: project directory,
+hash of configuration, and IDs of rootfs, base, unsigned and final images (and
+of the images of variants). Images of the latest builds of every project are
+reachable; other images labelled by scaffolding (see
+:data:`graminescaffolding.builder.IMAGE_LABEL`) are removed. Images are removed
+by docker, so layers shared with reachable images are kept, and images used by
+containers or with child images are skipped.
+"""
+
+import datetime
+import os
+import pathlib
+import time
+
+import docker
+
+from . import builder as _builder
+
+# images are removed children first
+_KIND_ORDER = ('final', 'app', 'base', 'rootfs')
+
+
+def get_build_images(build):
+    """
+    IDs of all images of a build.
+    """
+    return {*build['images'].values(), *build.get('variants', {}).values()}
+
+
+def _created(image):
+    # e.g. 2023-10-19T11:31:37.123456789Z, fromisoformat() can't do nanoseconds
+    return datetime.datetime.fromisoformat(
+        image.attrs['Created'][:19]).replace(
+            tzinfo=datetime.timezone.utc).timestamp()
+
+
+def select_builds(projects, keep, sizes=None, max_size=None):
+    """
+    Select builds to keep: *keep* latest builds of every project whose
+    directory still exists. If *max_size* is given, older builds are dropped
+    further (oldest first, but never the latest build of a project), until
+    size of images reachable from the kept builds fits in it.
+
+    Args:
+        projects (dict): as returned by :meth:`BuildRegistry.load`
+        keep (int): how many builds of every project to keep
+        sizes (dict or None): image ID to its size (without layers shared with
+            other images), needed for *max_size*
+        max_size (int or None): disk budget in bytes
+
+    Returns:
+        dict: project directory to list of kept builds
+    """
+    kept = {project_dir: builds[-keep:]
+        for project_dir, builds in projects.items()
+        if pathlib.Path(project_dir, _builder.SCAG_MAGIC_DIR).is_dir()}
+    if max_size is None:
+        return kept
+
+    def reachable_size():
+        reachable = set().union(*(get_build_images(build)
+            for builds in kept.values() for build in builds))
+        return sum(sizes.get(image_id, 0) for image_id in reachable)
+
+    evictable = sorted(((build['time'], project_dir)
+        for project_dir, builds in kept.items() for build in builds[:-1]),
+        key=lambda item: item[0])
+    for _, project_dir in evictable:
+        if reachable_size() <= max_size:
+            break
+        kept[project_dir] = kept[project_dir][1:]
+    return kept
+
+
+def collect(client, registry, *, keep=3, max_size=None, grace_period=3600,
+        dry_run=False):
+    """
+    Remove images not reachable from kept builds (see :func:`select_builds`)
+    and stale :file:`.scag/rootfs.tar` files of known projects (rootfs
+    tarball is needed only to build rootfs image, and is recreated if the image
+    is missing).
+
+    Args:
+        client (docker.DockerClient): docker client
+        registry (BuildRegistry): build registry
+        keep (int): how many builds of every project to keep
+        max_size (int or None): disk budget for images in bytes
+        grace_period (float): images younger than this (in seconds) are not
+            removed, because they may belong to builds still in progress
+        dry_run (bool): only report what would be removed
+
+    Returns:
+        dict: JSON-serialisable report with ``removed`` and ``skipped``
+        images, removed ``files``, and ``freed`` bytes
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    projects = registry.load()
+    images = {image.id: image for image in
+        client.images.list(filters={'label': _builder.IMAGE_LABEL})}
+    sizes = {entry['Id']: entry['Size'] - max(entry.get('SharedSize', 0), 0)
+        for entry in client.df()['Images']}
+
+    kept = select_builds(projects, keep, sizes, max_size)
+    reachable = set().union(*(get_build_images(build)
+        for builds in kept.values() for build in builds))
+
+    now = time.time()
+    candidates = [image for image in images.values()
+        if image.id not in reachable
+        and image.labels.get(_builder.IMAGE_LABEL) in _KIND_ORDER
+        and now - _created(image) > grace_period]
+    candidates.sort(key=lambda image: _KIND_ORDER.index(
+        image.labels[_builder.IMAGE_LABEL]))
+
+    # images which have to stay: those used by containers, and ancestors of
+    # those and of other images that are not removed (docker would refuse)
+    parents = {image.id: image.attrs.get('Parent')
+        for image in client.images.list(all=True)}
+    used = {container.attrs['Image']
+        for container in client.containers.list(all=True)}
+    candidate_ids = {image.id for image in candidates}
+    protected = set()
+    for image_id in used | {image.id for image in client.images.list()
+            if image.id not in candidate_ids}:
+        while (image_id := parents.get(image_id)):
+            protected.add(image_id)
+
+    report = {'removed': [], 'skipped': [], 'files': [], 'freed': 0}
+    for image in candidates:
+        entry = {
+            'id': image.id,
+            'tags': image.tags,
+            'kind': image.labels[_builder.IMAGE_LABEL],
+            'project': image.labels.get(_builder.PROJECT_LABEL),
+            'size': sizes.get(image.id, 0),
+        }
+        if image.id in used or image.id in protected:
+            report['skipped'].append({**entry, 'reason': 'used by container'
+                if image.id in used else 'parent of other image'})
+            continue
+        if not dry_run:
+            try:
+                client.images.remove(image.id, force=len(image.tags) > 1)
+            except docker.errors.ImageNotFound:
+                pass
+            except docker.errors.APIError as err:
+                report['skipped'].append({**entry, 'reason': str(err)})
+                continue
+        report['removed'].append(entry)
+        report['freed'] += entry['size']
+
+    for project_dir, builds in kept.items():
+        rootfs_tar = pathlib.Path(project_dir, _builder.SCAG_MAGIC_DIR,
+            'rootfs.tar')
+        try:
+            stat = rootfs_tar.stat()
+        except FileNotFoundError:
+            continue
+        # newer tarball may be being used by a build in progress
+        if builds and stat.st_mtime > builds[-1]['time']:
+            continue
+        if not dry_run:
+            rootfs_tar.unlink()
+        report['files'].append(os.fspath(rootfs_tar))
+        report['freed'] += stat.st_size
+
+    # builds recorded meanwhile (e.g. by a concurrent scag-build) are kept
+    if not dry_run:
+        registry.update({project_dir: kept.get(project_dir, [])
+            for project_dir in projects}, snapshot=projects)
+    return report
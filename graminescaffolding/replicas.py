@@ -0,0 +1,311 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Running several replicas of an image on one host (:command:`scag-run`).
+
+Every replica is run with the command from :meth:`Builder.get_docker_run_cmd`,
+with these changes:
+
+- published host ports are moved to the next free ports, so that replicas
+  don't collide (the first replica keeps the configured ports if they're
+  free);
+- the replica is pinned to its own set of CPUs, and if the host has more NUMA
+  nodes, replicas are spread over the nodes, and memory of each replica is
+  bound to its node;
+- memory of the container is limited to enclave size of the manifest (plus
+  :data:`MEMORY_OVERHEAD_MB` for the untrusted part of Gramine).
+"""
+
+import concurrent.futures
+import os
+import pathlib
+import socket
+import subprocess
+import time
+
+import docker
+
+from . import (
+    bench,
+    builder as _builder,
+)
+
+NUMA_SYSFS = '/sys/devices/system/node'
+
+# memory for untrusted runtime (Gramine loader, docker-init etc.)
+MEMORY_OVERHEAD_MB = 256
+
+_POLL_INTERVAL = 0.1
+
+
+def parse_cpulist(text):
+    """
+    Parse CPU list in kernel format (e.g. ``0-3,8,10-11``).
+
+    Returns:
+        list: CPU numbers
+    """
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def format_cpulist(cpus):
+    """
+    Format CPU numbers for ``docker run --cpuset-cpus``.
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(first) if first == last else f'{first}-{last}'
+        for first, last in ranges)
+
+
+def get_numa_nodes(sysfs=NUMA_SYSFS):
+    """
+    NUMA nodes of the host.
+
+    Returns:
+        dict: node number to list of its CPUs; empty if there's no NUMA
+        information
+    """
+    nodes = {}
+    for path in pathlib.Path(sysfs).glob('node[0-9]*'):
+        try:
+            nodes[int(path.name[4:])] = parse_cpulist(
+                (path / 'cpulist').read_text())
+        except (OSError, ValueError):
+            continue
+    return dict(sorted(nodes.items()))
+
+
+def get_cpu_layout(replicas, cpus=None, nodes=None):
+    """
+    Assign CPUs to replicas. Replicas are spread over NUMA nodes round-robin,
+    and CPUs of each node are split between replicas on that node in
+    contiguous chunks. If there are more replicas than CPUs on a node, the
+    replicas share CPUs.
+
+    Args:
+        replicas (int): number of replicas
+        cpus (list or None): CPUs to use; :obj:`None` means all CPUs available
+            to this process
+        nodes (dict or None): as returned by :func:`get_numa_nodes`;
+            :obj:`None` means nodes of this host
+
+    Returns:
+        list: for every replica, a dict with ``cpus`` (list) and ``node`` (int,
+        or :obj:`None` if there's no NUMA information)
+    """
+    if cpus is None:
+        cpus = os.sched_getaffinity(0)
+    if nodes is None:
+        nodes = get_numa_nodes()
+    cpus = set(cpus)
+
+    nodes = {node: sorted(cpus & set(node_cpus))
+        for node, node_cpus in nodes.items()}
+    nodes = {node: node_cpus for node, node_cpus in nodes.items() if node_cpus}
+    if not nodes:
+        nodes = {None: sorted(cpus)}
+
+    node_list = list(nodes)
+    on_node = {node: [index for index in range(replicas)
+        if node_list[index % len(node_list)] == node] for node in node_list}
+
+    layout = [None] * replicas
+    for node, indices in on_node.items():
+        node_cpus = nodes[node]
+        for i, index in enumerate(indices):
+            if len(indices) > len(node_cpus):
+                chunk = [node_cpus[i % len(node_cpus)]]
+            else:
+                chunk = node_cpus[i * len(node_cpus) // len(indices):
+                    (i + 1) * len(node_cpus) // len(indices)]
+            layout[index] = {'cpus': chunk, 'node': node}
+    return layout
+
+
+def get_port_mappings(run_cmd):
+    """
+    Ports published by :command:`docker run` command.
+
+    Returns:
+        list: ``(index, host_port, container_port)`` tuples, where index is the
+        position of the value of ``--publish`` option in the command
+    """
+    mappings = []
+    for index, (option, value) in enumerate(zip(run_cmd, run_cmd[1:]), 1):
+        if option in ('--publish', '-p'):
+            parts = value.split('/')[0].split(':')
+            if len(parts) >= 2 and parts[-2]:
+                mappings.append((index, int(parts[-2]), parts[-1]))
+    return mappings
+
+
+def is_port_free(port):
+    """
+    Whether a TCP port can be bound on the host.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(('', port))
+        except OSError:
+            return False
+    return True
+
+
+def allocate_ports(host_ports, replicas, is_free=is_port_free):
+    """
+    Allocate host ports for replicas. Every port is moved to the next port
+    that is free and not yet allocated to other replica.
+
+    Args:
+        host_ports (list): configured host ports
+        replicas (int): number of replicas
+
+    Returns:
+        list: for every replica, list of host ports in the same order
+
+    Raises:
+        ValueError: if ports ran out
+    """
+    allocated = set()
+    result = []
+    for _ in range(replicas):
+        ports = []
+        for port in host_ports:
+            while port in allocated or not is_free(port):
+                port += 1
+                if port > 65535:
+                    raise ValueError('no free ports left')
+            allocated.add(port)
+            ports.append(port)
+        result.append(ports)
+    return result
+
+
+def get_replica_run_cmds(builder, image_id, replicas, name, *, layout=None,
+        is_free=is_port_free):
+    """
+    Commands to run replicas of the image.
+
+    Args:
+        builder (Builder): builder of the image
+        image_id (str): the image
+        replicas (int): number of replicas
+        name (str): prefix of container names (``<name>-<index>``)
+        layout (list or None): as returned by :func:`get_cpu_layout`;
+            :obj:`None` means layout for this host
+
+    Returns:
+        list: for every replica, a dict with ``name``, ``cmd``, ``ports``
+        (published host ports), ``cpus`` and ``node``
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    if layout is None:
+        layout = get_cpu_layout(replicas)
+    run_cmd = builder.get_docker_run_cmd(image_id)
+    mappings = get_port_mappings(run_cmd)
+    ports = allocate_ports([host_port for _, host_port, _ in mappings],
+        replicas, is_free)
+    memory_mb = (_builder.parse_enclave_size(builder.get_enclave_size())
+        + MEMORY_OVERHEAD_MB)
+
+    result = []
+    for index in range(replicas):
+        cmd = list(run_cmd)
+        for (position, _, _), host_port in zip(mappings, ports[index]):
+            parts = cmd[position].split(':')
+            parts[-2] = str(host_port)
+            cmd[position] = ':'.join(parts)
+
+        replica_name = f'{name}-{index}'
+        args = [
+            '--detach',
+            '--name', replica_name,
+            '--cpuset-cpus', format_cpulist(layout[index]['cpus']),
+            '--memory', f'{memory_mb}m',
+        ]
+        if layout[index]['node'] is not None:
+            args += ['--cpuset-mems', str(layout[index]['node'])]
+
+        result.append({
+            'name': replica_name,
+            'cmd': [*cmd[:2], *args, *cmd[2:]],
+            'ports': ports[index],
+            'cpus': format_cpulist(layout[index]['cpus']),
+            'node': layout[index]['node'],
+        })
+    return result
+
+
+def wait_ready(client, replica, timeout):
+    """
+    Wait until the replica answers on its first published port (see
+    :func:`bench.probe`), or if it doesn't publish any, until it's running.
+
+    Returns:
+        bool: whether the replica is ready
+    """
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            status = client.containers.get(replica['name']).status
+        except docker.errors.NotFound:
+            return False
+        if status in ('exited', 'dead'):
+            return False
+        if replica['ports']:
+            if bench.probe(replica['ports'][0]):
+                return True
+        elif status == 'running':
+            return True
+        time.sleep(_POLL_INTERVAL)
+    return False
+
+
+def start_replicas(client, replicas, timeout=300):
+    """
+    Start replicas concurrently and wait until they're ready. If some replica
+    fails to start, all replicas are removed (also the failed ones, as
+    :command:`docker run` may have created the container before failing).
+
+    Args:
+        client (docker.DockerClient): docker client
+        replicas (list): as returned by :func:`get_replica_run_cmds`
+        timeout (float): how long to wait for readiness, in seconds
+
+    Returns:
+        list: replicas with ``ready`` (bool) filled in
+
+    Raises:
+        subprocess.CalledProcessError: if :command:`docker run` of some replica
+            failed
+    """
+    with concurrent.futures.ThreadPoolExecutor(len(replicas)) as executor:
+        futures = [executor.submit(subprocess.run, replica['cmd'], check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            for replica in replicas]
+        errors = [future.exception() for future in futures]
+        if any(errors):
+            for replica in replicas:
+                try:
+                    client.containers.get(replica['name']).remove(force=True)
+                except docker.errors.NotFound:
+                    pass
+            raise next(error for error in errors if error)
+
+        ready = executor.map(lambda replica: wait_ready(client, replica,
+            timeout), replicas)
+        return [{**replica, 'ready': is_ready}
+            for replica, is_ready in zip(replicas, ready)]
@@ -0,0 +1,157 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Signers of SIGSTRUCT, used when re-signing images.
+
+Signers are loaded by name from ``gramine.scaffolding.signer`` entry points
+group, so other packages can provide their own (e.g. for remote signing
+services). A signer is a class, which is instantiated with options given on the
+command line, and then may be used to sign many SIGSTRUCTs, so it can e.g. keep
+a session to a signing service open.
+"""
+
+# pylint: disable=too-few-public-methods
+
+import abc
+import base64
+import pathlib
+import re
+import shlex
+import subprocess
+
+# DER encoding of rsaEncryption OID (1.2.840.113549.1.1.1)
+_RSA_ENCRYPTION_OID = bytes.fromhex('2a864886f70d010101')
+
+_PEM_RE = re.compile(
+    rb'-----BEGIN (?P<label>[A-Z ]+)-----(?P<data>.*?)-----END (?P=label)-----',
+    re.DOTALL)
+
+
+def _der_read(data, tag):
+    """
+    Read one DER element with expected *tag* from the start of *data*.
+
+    Returns:
+        (bytes, bytes): content of the element and the rest of the data
+    """
+    if len(data) < 2 or data[0] != tag:
+        raise ValueError(f'invalid public key: expected DER tag {tag:#x}')
+    length, offset = data[1], 2
+    if length & 0x80:
+        offset += length & 0x7f
+        length = int.from_bytes(data[2:offset], 'big')
+    if offset + length > len(data):
+        raise ValueError('invalid public key: truncated DER element')
+    return data[offset:offset+length], data[offset+length:]
+
+def load_rsa_public_key(pem):
+    """
+    Parse RSA public key from PEM file contents, either SubjectPublicKeyInfo
+    (``BEGIN PUBLIC KEY``, as written by :command:`openssl pkey -pubout`) or
+    PKCS #1 (``BEGIN RSA PUBLIC KEY``).
+
+    Args:
+        pem (bytes): contents of the PEM file
+
+    Returns:
+        (int, int): Tuple of ``(exponent, modulus)``.
+
+    Raises:
+        ValueError: if there's no RSA public key in the data
+    """
+    match = _PEM_RE.search(pem)
+    if match is None:
+        raise ValueError('invalid public key: no PEM data')
+    try:
+        der = base64.b64decode(match.group('data'), validate=False)
+    except ValueError as err:
+        raise ValueError(f'invalid public key: {err}') from err
+
+    if match.group('label') == b'PUBLIC KEY':
+        spki, _ = _der_read(der, 0x30)
+        algorithm, rest = _der_read(spki, 0x30)
+        oid, _ = _der_read(algorithm, 0x06)
+        if oid != _RSA_ENCRYPTION_OID:
+            raise ValueError('invalid public key: not an RSA key')
+        bitstring, _ = _der_read(rest, 0x03)
+        # first byte of BIT STRING is the number of unused bits
+        der = bitstring[1:]
+    elif match.group('label') != b'RSA PUBLIC KEY':
+        raise ValueError(
+            f'invalid public key: unexpected PEM label {match.group("label")!r}')
+
+    key, _ = _der_read(der, 0x30)
+    modulus, rest = _der_read(key, 0x02)
+    exponent, _ = _der_read(rest, 0x02)
+    return int.from_bytes(exponent, 'big'), int.from_bytes(modulus, 'big')
+
+
+class Signer(abc.ABC):
+    """
+    Interface of SIGSTRUCT signers.
+    """
+    @abc.abstractmethod
+    def sign(self, data):
+        """
+        Sign the data with 3072-bit RSA key with public exponent 3, using
+        RSASSA-PKCS1-v1_5 with SHA-256.
+
+        Args:
+            data (bytes): data to sign
+
+        Returns:
+            (int, int, int): Tuple of ``(exponent, modulus, signature)``. This is
+            the same contract as of :func:`graminelibos.sign_with_local_key`.
+        """
+
+
+class LocalKeySigner(Signer):
+    """
+    Sign with private key from a local PEM file.
+
+    Args:
+        key (str or None): path to the key; :obj:`None` means default key of
+            :command:`gramine-sgx-sign`
+    """
+    def __init__(self, key=None):
+        # graminelibos is installed together with gramine, which is required to
+        # build anyway
+        import graminelibos # pylint: disable=import-outside-toplevel,import-error
+        self._graminelibos = graminelibos
+        self.key = pathlib.Path(key if key is not None
+            else graminelibos.SGX_RSA_KEY_PATH)
+
+    def sign(self, data):
+        return self._graminelibos.sign_with_local_key(data, self.key)
+
+
+class CommandSigner(Signer):
+    """
+    Sign with external command, which reads data to sign on standard input, and
+    writes raw signature (big endian, as RSA signatures are usually encoded) on
+    standard output. This can be a wrapper around remote signing service, or
+    e.g. ``openssl dgst -sha256 -sign key.pem``.
+
+    Args:
+        command (str): command, will be split with :func:`shlex.split`
+        public_key (str): path to PEM file with public key of the signer
+
+    Raises:
+        OSError: if the public key can't be read
+        ValueError: if the public key is invalid
+    """
+    def __init__(self, command, public_key):
+        self.command = shlex.split(command)
+        with open(public_key, 'rb') as file:
+            self.exponent, self.modulus = load_rsa_public_key(file.read())
+        if self.exponent != 3 or self.modulus.bit_length() != 3072:
+            raise ValueError('public key is not a 3072-bit RSA key with public'
+                ' exponent 3')
+
+    def sign(self, data):
+        proc = subprocess.run(self.command, input=data, capture_output=True,
+            check=True)
+        return self.exponent, self.modulus, int.from_bytes(proc.stdout, 'big')
+
+# vim: tw=80
@@ -0,0 +1,191 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Parsing of SIGSTRUCT (:file:`app.sig`), as described in Intel SDM vol. 3D,
+section "Enclave Signature Structure".
+"""
+
+import hashlib
+import struct
+
+SIGSTRUCT_SIZE = 1808
+
+# offset, size
+_FIELDS = {
+    'header': (0, 16),
+    'vendor': (16, 4),
+    'date': (20, 4),
+    'header2': (24, 16),
+    'swdefined': (40, 4),
+    'modulus': (128, 384),
+    'exponent': (512, 4),
+    'signature': (516, 384),
+    'misc_select': (900, 4),
+    'misc_mask': (904, 4),
+    'isv_family_id': (912, 16),
+    'attributes': (928, 16),
+    'attribute_mask': (944, 16),
+    'enclave_hash': (960, 32),
+    'isv_ext_prod_id': (1008, 16),
+    'isv_prod_id': (1024, 2),
+    'isv_svn': (1026, 2),
+    'q1': (1040, 384),
+    'q2': (1424, 384),
+}
+
+# signature covers those ranges
+_SIGNED_RANGES = ((0, 128), (900, 1028))
+
+# SGX requires 3072-bit RSA key with public exponent 3
+RSA_KEY_SIZE = 384
+RSA_EXPONENT = 3
+
+# DER-encoded DigestInfo prefix for SHA-256, see RFC 8017 section 9.2
+_SHA256_DIGEST_INFO = bytes.fromhex('3031300d060960864801650304020105000420')
+
+# bits in the lower half of ATTRIBUTES
+ATTRIBUTE_DEBUG = 1 << 1
+ATTRIBUTE_MODE64BIT = 1 << 2
+
+
+def get_field(sigstruct, name):
+    offset, size = _FIELDS[name]
+    return sigstruct[offset:offset+size]
+
+
+def get_int(sigstruct, name):
+    return int.from_bytes(get_field(sigstruct, name), 'little')
+
+
+def get_mrsigner(sigstruct):
+    """
+    MRSIGNER is SHA256 of the modulus of signing key, as stored in SIGSTRUCT
+    (i.e. little endian).
+    """
+    return hashlib.sha256(get_field(sigstruct, 'modulus')).digest()
+
+
+def parse_sigstruct(sigstruct):
+    """
+    Parse fields that are relevant for attestation policy.
+
+    Args:
+        sigstruct (bytes): contents of :file:`app.sig`
+
+    Returns:
+        dict: JSON-serialisable dictionary, binary values are hex-encoded
+
+    Raises:
+        ValueError: if sigstruct has invalid size
+    """
+    if len(sigstruct) != SIGSTRUCT_SIZE:
+        raise ValueError(
+            f'invalid SIGSTRUCT size: {len(sigstruct)}, '
+            f'expected {SIGSTRUCT_SIZE}')
+
+    flags, xfrm = struct.unpack('<QQ', get_field(sigstruct, 'attributes'))
+    flags_mask, xfrm_mask = struct.unpack('<QQ',
+        get_field(sigstruct, 'attribute_mask'))
+
+    # date is BCD-encoded 0xYYYYMMDD
+    date = f'{get_int(sigstruct, "date"):08x}'
+
+    return {
+        'mrenclave': get_field(sigstruct, 'enclave_hash').hex(),
+        'mrsigner': get_mrsigner(sigstruct).hex(),
+        'isv_prod_id': get_int(sigstruct, 'isv_prod_id'),
+        'isv_svn': get_int(sigstruct, 'isv_svn'),
+        'debug': bool(flags & ATTRIBUTE_DEBUG),
+        'attributes': {
+            'flags': f'{flags:016x}',
+            'xfrm': f'{xfrm:016x}',
+        },
+        'attribute_mask': {
+            'flags': f'{flags_mask:016x}',
+            'xfrm': f'{xfrm_mask:016x}',
+        },
+        'misc_select': f'{get_int(sigstruct, "misc_select"):08x}',
+        'misc_mask': f'{get_int(sigstruct, "misc_mask"):08x}',
+        'date': f'{date[:4]}-{date[4:6]}-{date[6:]}',
+        'vendor': get_int(sigstruct, 'vendor'),
+        'isv_family_id': get_field(sigstruct, 'isv_family_id').hex(),
+        'isv_ext_prod_id': get_field(sigstruct, 'isv_ext_prod_id').hex(),
+    }
+
+
+def get_signed_data(sigstruct):
+    """
+    Data covered by the signature in SIGSTRUCT.
+    """
+    return b''.join(sigstruct[start:end] for start, end in _SIGNED_RANGES)
+
+
+def _encode_pkcs1_v15(data):
+    digest_info = _SHA256_DIGEST_INFO + hashlib.sha256(data).digest()
+    padding = b'\xff' * (RSA_KEY_SIZE - len(digest_info) - 3)
+    return int.from_bytes(b'\x00\x01' + padding + b'\x00' + digest_info, 'big')
+
+
+def replace_signature(sigstruct, exponent, modulus, signature):
+    """
+    Replace the signature (and the key) in SIGSTRUCT. All other fields,
+    including MRENCLAVE, are retained.
+
+    Args:
+        sigstruct (bytes): SIGSTRUCT
+        exponent (int): public exponent of the key
+        modulus (int): modulus of the key
+        signature (int): RSASSA-PKCS1-v1_5 SHA-256 signature of
+            :func:`get_signed_data`
+
+    Returns:
+        bytes: new SIGSTRUCT
+
+    Raises:
+        ValueError: if the key is not suitable for SGX, or the signature does
+            not verify
+    """
+    if exponent != RSA_EXPONENT:
+        raise ValueError(
+            f'invalid public exponent: {exponent}, expected {RSA_EXPONENT}')
+    if modulus.bit_length() != RSA_KEY_SIZE * 8:
+        raise ValueError(
+            f'invalid key size: {modulus.bit_length()} bits, '
+            f'expected {RSA_KEY_SIZE * 8}')
+    if pow(signature, exponent, modulus) != _encode_pkcs1_v15(
+            get_signed_data(sigstruct)):
+        raise ValueError('signature does not verify')
+
+    # Q1 and Q2 are used by the CPU to verify the signature without division
+    q1 = signature ** 2 // modulus
+    q2 = (signature ** 3 - q1 * signature * modulus) // modulus
+
+    sigstruct = bytearray(sigstruct)
+    for name, value in (
+        ('modulus', modulus),
+        ('exponent', exponent),
+        ('signature', signature),
+        ('q1', q1),
+        ('q2', q2),
+    ):
+        offset, size = _FIELDS[name]
+        sigstruct[offset:offset+size] = value.to_bytes(size, 'little')
+    return bytes(sigstruct)
+
+
+def resign(sigstruct, signer):
+    """
+    Sign SIGSTRUCT again with another signer.
+
+    Args:
+        sigstruct (bytes): SIGSTRUCT
+        signer (graminescaffolding.signer.Signer): signer
+
+    Returns:
+        bytes: new SIGSTRUCT
+    """
+    exponent, modulus, signature = signer.sign(get_signed_data(sigstruct))
+    return replace_signature(sigstruct, exponent, modulus, signature)
+
+# vim: tw=80
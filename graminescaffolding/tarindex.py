@@ -0,0 +1,425 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Random access to files in saved images (output of :command:`docker save`) and
+in plain tarballs (e.g. rootfs or a single layer).
+
+Tarballs don't have a central directory, so finding a file needs a scan over
+all member headers (and, for saved images, over headers of every layer). The
+scan is done once, and offsets of all members are kept in an index, which can
+be cached on disk. Files are then read by direct seek (or from mmap, if the
+file can be mapped).
+"""
+
+import bz2
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import mmap
+import os
+import pathlib
+import shutil
+import tarfile
+import tempfile
+
+from . import sigstruct as _sigstruct
+
+# bump when format of cached index changes
+INDEX_VERSION = 1
+
+GZIP_MAGIC = b'\x1f\x8b'
+# gzip, bzip2 and xz, which tarfile can read transparently
+_DECOMPRESSORS = {
+    GZIP_MAGIC: gzip.open,
+    b'BZh': bz2.open,
+    b'\xfd7zXZ\x00': lzma.open,
+}
+COMPRESSED_MAGICS = tuple(_DECOMPRESSORS)
+
+# member types in index
+TYPE_FILE = 'f'
+TYPE_HARDLINK = 'l'
+TYPE_SYMLINK = 's'
+TYPE_DIR = 'd'
+TYPE_OTHER = 'o'
+
+WHITEOUT_PREFIX = '.wh.'
+WHITEOUT_OPAQUE = '.wh..wh..opq'
+
+# the same as Linux' MAXSYMLINKS
+MAX_SYMLINKS = 40
+
+
+def _normalize(name):
+    return '/'.join(p for p in name.split('/') if p not in ('', '.'))
+
+
+def _get_type(tarinfo):
+    if tarinfo.isreg():
+        return TYPE_FILE
+    if tarinfo.islnk():
+        return TYPE_HARDLINK
+    if tarinfo.issym():
+        return TYPE_SYMLINK
+    if tarinfo.isdir():
+        return TYPE_DIR
+    return TYPE_OTHER
+
+
+def _index_members(tar, compressed=False):
+    """
+    Returns:
+        dict: normalised name to ``[offset, size, type, linkname]``; offset is
+        :obj:`None` for compressed archives
+    """
+    members = {}
+    for tarinfo in tar:
+        members[_normalize(tarinfo.name)] = [
+            None if compressed else tarinfo.offset_data,
+            tarinfo.size,
+            _get_type(tarinfo),
+            tarinfo.linkname,
+        ]
+    return members
+
+
+def is_compressed(file):
+    """
+    Whether the tarball is compressed (see :data:`COMPRESSED_MAGICS`).
+
+    Args:
+        file (str or pathlib.Path or file object): the tarball; position of
+            file object is kept
+    """
+    length = max(len(magic) for magic in COMPRESSED_MAGICS)
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as fileobj:
+            head = fileobj.read(length)
+    else:
+        position = file.tell()
+        head = file.read(length)
+        file.seek(position)
+    return head.startswith(COMPRESSED_MAGICS)
+
+
+class TarIndex:
+    """
+    Index of members of a saved image or a plain tarball.
+
+    For saved images, files are looked up in layers from the top, honouring
+    whiteouts, like in the filesystem of a container. Plain tarball is treated
+    as an image with single layer.
+
+    Args:
+        file (str or pathlib.Path or file object): the tarball, optionally
+            compressed; file object needs to be opened in binary mode and
+            seekable
+        cache_dir (pathlib.Path or None): directory for cached indexes;
+            :obj:`None` means no caching, which is also the case for file
+            objects
+    """
+    def __init__(self, file, cache_dir=None):
+        if isinstance(file, (str, os.PathLike)):
+            self.path = pathlib.Path(file).resolve()
+            # pylint: disable=consider-using-with
+            self._file = open(self.path, 'rb')
+            self._own_file = True
+        else:
+            self.path = None
+            self._file = file
+            self._own_file = False
+
+        if is_compressed(self._file):
+            # compressed data can't be read from an arbitrary offset, so the
+            # index is built over decompressed copy, which is not cached
+            self._decompress()
+
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                access=mmap.ACCESS_READ)
+        except (AttributeError, io.UnsupportedOperation, OSError, ValueError):
+            # not a real file, or empty
+            self._map = None
+
+        self.cache_path = None
+        if cache_dir is not None and self.path is not None:
+            self.cache_path = pathlib.Path(cache_dir) / (
+                hashlib.sha256(os.fsencode(self.path)).hexdigest() + '.json')
+
+        self.layers = self._load_cached()
+        if self.layers is None:
+            self.layers = self._build()
+            self._save_cached()
+
+    def _decompress(self):
+        self._file.seek(0)
+        head = self._file.read(max(len(magic) for magic in COMPRESSED_MAGICS))
+        self._file.seek(0)
+        decompressor = next(decompressor
+            for magic, decompressor in _DECOMPRESSORS.items()
+            if head.startswith(magic))
+        # pylint: disable=consider-using-with
+        decompressed = tempfile.TemporaryFile()
+        with decompressor(self._file) as file:
+            shutil.copyfileobj(file, decompressed)
+        if self._own_file:
+            self._file.close()
+        self.path = None
+        self._file = decompressed
+        self._own_file = True
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._own_file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _stat_key(self):
+        stat = os.stat(self._file.fileno())
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def _load_cached(self):
+        if self.cache_path is None:
+            return None
+        try:
+            with open(self.cache_path, 'rb') as file:
+                cached = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if (cached.get('version') != INDEX_VERSION
+                or cached.get('stat') != self._stat_key()):
+            return None
+        return cached['layers']
+
+    def _save_cached(self):
+        if self.cache_path is None:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'version': INDEX_VERSION,
+                'path': os.fspath(self.path),
+                'stat': self._stat_key(),
+                'layers': self.layers,
+            }, file)
+        os.replace(tmp_path, self.cache_path)
+
+    def _read(self, offset, size):
+        if self._map is not None:
+            return self._map[offset:offset+size]
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def _is_compressed(self, offset):
+        return self._read(offset, len(GZIP_MAGIC)) == GZIP_MAGIC
+
+    def _open_layer(self, offset, size):
+        """
+        Open layer, which is a member of saved image, as a tarfile.
+        """
+        if self._is_compressed(offset):
+            return tarfile.open(
+                fileobj=gzip.GzipFile(fileobj=io.BytesIO(
+                    self._read(offset, size))),
+                mode='r|')
+        self._file.seek(offset)
+        return tarfile.open(fileobj=self._file, mode='r:')
+
+    def _build(self):
+        self._file.seek(0)
+        with tarfile.open(fileobj=self._file, mode='r:') as tar:
+            outer = {'offset': 0, 'size': None, 'members': _index_members(tar)}
+
+        image_layers = None
+        entry = outer['members'].get('manifest.json')
+        if entry is not None and entry[2] == TYPE_FILE:
+            try:
+                manifest = json.loads(self._read(entry[0], entry[1]))
+                image_layers = [_normalize(layer)
+                    for layer in manifest[0]['Layers']]
+            except (ValueError, LookupError, TypeError):
+                image_layers = None
+
+        if image_layers is None:
+            # plain tarball
+            return [outer]
+
+        layers = []
+        for name in image_layers:
+            _, entry = self._resolve_in_layer(outer, name)
+            if entry is None or entry[2] != TYPE_FILE:
+                raise ValueError(f'layer {name!r} not found in saved image')
+            offset, size = entry[0], entry[1]
+            with self._open_layer(offset, size) as tar:
+                layers.append({'offset': offset, 'size': size,
+                    'members': _index_members(tar,
+                        compressed=self._is_compressed(offset))})
+        return layers
+
+    @staticmethod
+    def _resolve_in_layer(layer, name):
+        """
+        Resolve links inside single layer.
+
+        Returns:
+            (str, list): name and entry, which is :obj:`None` if not found
+        """
+        entry = layer['members'].get(name)
+        for _ in range(MAX_SYMLINKS):
+            if entry is None or entry[2] not in (TYPE_HARDLINK, TYPE_SYMLINK):
+                return name, entry
+            if entry[2] == TYPE_HARDLINK:
+                name = _normalize(entry[3])
+            else:
+                name = _normalize(f'{name.rpartition("/")[0]}/{entry[3]}')
+            entry = layer['members'].get(name)
+        return name, None
+
+    def _find(self, name):
+        """
+        Find name (without resolving symlinks) in layers from the top.
+
+        Returns:
+            (int, list) or None: index of layer and the entry
+        """
+        components = name.split('/')
+        for i in reversed(range(len(self.layers))):
+            members = self.layers[i]['members']
+            entry = members.get(name)
+            if entry is not None:
+                return i, entry
+
+            for j, component in enumerate(components):
+                if '/'.join((*components[:j], WHITEOUT_PREFIX + component)
+                        ) in members:
+                    return None
+            for j in range(len(components)):
+                if '/'.join((*components[:j], WHITEOUT_OPAQUE)) in members:
+                    return None
+        return None
+
+    def lookup(self, path):
+        """
+        Find file in the image, resolving symlinks (also in parent
+        directories).
+
+        Args:
+            path (str): absolute path
+
+        Returns:
+            (int, str, list): index of layer, name in the layer and the entry
+
+        Raises:
+            KeyError: if there is no such file
+        """
+        parts = _normalize(path).split('/')
+        resolved = []
+        found = None
+        symlinks = 0
+        while parts:
+            part = parts.pop(0)
+            if part in ('', '.'):
+                continue
+            if part == '..':
+                if resolved:
+                    resolved.pop()
+                continue
+
+            resolved.append(part)
+            found = self._find('/'.join(resolved))
+            if found is None:
+                if parts:
+                    # directories don't need to have their own members
+                    continue
+                raise KeyError(path)
+
+            entry = found[1]
+            if entry[2] == TYPE_SYMLINK:
+                symlinks += 1
+                if symlinks > MAX_SYMLINKS:
+                    raise KeyError(path)
+                target = entry[3]
+                if target.startswith('/'):
+                    resolved = []
+                else:
+                    resolved.pop()
+                parts[:0] = target.split('/')
+
+        if found is None:
+            raise KeyError(path)
+        return (found[0], '/'.join(resolved), found[1])
+
+    def read(self, path):
+        """
+        Read file from the image.
+
+        Args:
+            path (str): absolute path
+
+        Returns:
+            bytes: contents of the file
+
+        Raises:
+            KeyError: if there is no such file
+            ValueError: if the path is not a regular file
+        """
+        i, name, entry = self.lookup(path)
+        layer = self.layers[i]
+        if entry[2] == TYPE_HARDLINK:
+            name, entry = self._resolve_in_layer(layer, _normalize(entry[3]))
+        if entry is None or entry[2] != TYPE_FILE:
+            raise ValueError(f'{path!r} is not a regular file')
+
+        offset, size = entry[0], entry[1]
+        if offset is not None:
+            return self._read(offset, size)
+
+        # compressed layer, no random access
+        with self._open_layer(layer['offset'], layer['size']) as tar:
+            for tarinfo in tar:
+                if _normalize(tarinfo.name) == name:
+                    return tar.extractfile(tarinfo).read()
+        raise KeyError(path)
+
+    def inspect(self, sigstruct_path='/app/app.sig',
+            manifest_path='/app/app.manifest.sgx'):
+        """
+        Report enclave identity from the image.
+
+        Returns:
+            dict: JSON-serialisable dictionary with parsed SIGSTRUCT (see
+            :func:`graminescaffolding.sigstruct.parse_sigstruct`) and size and
+            SHA-256 of :file:`app.manifest.sgx` (or :obj:`None` if it's not in
+            the image)
+
+        Raises:
+            KeyError: if there is no SIGSTRUCT in the image
+        """
+        report = {
+            'layers': len(self.layers),
+            'sigstruct': _sigstruct.parse_sigstruct(self.read(sigstruct_path)),
+            'manifest_sgx': None,
+        }
+        try:
+            manifest = self.read(manifest_path)
+        except (KeyError, ValueError):
+            pass
+        else:
+            report['manifest_sgx'] = {
+                'size': len(manifest),
+                'sha256': hashlib.sha256(manifest).hexdigest(),
+            }
+        return report
+
+# vim: tw=80
@@ -0,0 +1,296 @@
+// Generated by Gramine Scaffolding: Java agent (-javaagent:...=<port>), which
+// serves runtime metrics of the JVM in Prometheus text format on /metrics, over
+// HTTPS with RA-TLS certificate created by gramine-ratls before the JVM starts.
+// The serving thread is a daemon, so it doesn't keep the JVM alive.
+
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.InputStream;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.lang.instrument.Instrumentation;
+import java.lang.management.GarbageCollectorMXBean;
+import java.lang.management.ManagementFactory;
+import java.lang.management.MemoryPoolMXBean;
+import java.lang.management.MemoryUsage;
+import java.lang.management.ThreadMXBean;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.security.KeyFactory;
+import java.security.KeyStore;
+import java.security.PrivateKey;
+import java.security.cert.Certificate;
+import java.security.cert.CertificateFactory;
+import java.security.spec.InvalidKeySpecException;
+import java.security.spec.PKCS8EncodedKeySpec;
+import java.util.Arrays;
+import java.util.Base64;
+import javax.net.ssl.KeyManagerFactory;
+import javax.net.ssl.SSLContext;
+
+public final class ScagMetrics {
+    private static final Path CERT = Path.of("/tmp/crt.pem");
+    private static final Path KEY = Path.of("/tmp/key.pem");
+    private static final char[] PASSWORD = "scag".toCharArray();
+
+    // AlgorithmIdentifier of rsaEncryption
+    private static final byte[] RSA_ALGORITHM = {
+        0x30, 0x0d, 0x06, 0x09, 0x2a, (byte) 0x86, 0x48, (byte) 0x86,
+        (byte) 0xf7, 0x0d, 0x01, 0x01, 0x01, 0x05, 0x00,
+    };
+    // OID of id-ecPublicKey
+    private static final byte[] EC_PUBLIC_KEY = {
+        0x06, 0x07, 0x2a, (byte) 0x86, 0x48, (byte) 0xce, 0x3d, 0x02, 0x01,
+    };
+
+    private ScagMetrics() {
+    }
+
+    public static void premain(String args, Instrumentation instrumentation)
+            throws Exception {
+        ServerSocket server = sslContext().getServerSocketFactory()
+            .createServerSocket(Integer.parseInt(args));
+        Thread thread = new Thread(() -> serve(server), "scag-metrics");
+        thread.setDaemon(true);
+        thread.start();
+    }
+
+    private static void serve(ServerSocket server) {
+        while (!server.isClosed()) {
+            try (Socket socket = server.accept()) {
+                socket.setSoTimeout(5000);
+                handle(socket);
+            } catch (Exception e) {
+                // broken connection or failed handshake, serve the next one
+            }
+        }
+    }
+
+    private static void handle(Socket socket) throws Exception {
+        BufferedReader reader = new BufferedReader(new InputStreamReader(
+            socket.getInputStream(), StandardCharsets.ISO_8859_1));
+        String request = reader.readLine();
+        if (request == null) {
+            return;
+        }
+        for (String line = reader.readLine(); line != null && !line.isEmpty();
+                line = reader.readLine()) {
+            // headers are ignored
+        }
+
+        String[] parts = request.split(" ");
+        boolean found = parts.length >= 2 && parts[0].equals("GET")
+            && parts[1].equals("/metrics");
+        byte[] body = found ? render().getBytes(StandardCharsets.UTF_8)
+            : new byte[0];
+        String header = (found ? "HTTP/1.1 200 OK" : "HTTP/1.1 404 Not Found")
+            + "\r\nContent-Type: text/plain; version=0.0.4"
+            + "\r\nContent-Length: " + body.length
+            + "\r\nConnection: close\r\n\r\n";
+
+        OutputStream out = socket.getOutputStream();
+        out.write(header.getBytes(StandardCharsets.ISO_8859_1));
+        out.write(body);
+        out.flush();
+    }
+
+    private static String render() {
+        StringBuilder out = new StringBuilder();
+
+        MemoryUsage heap = ManagementFactory.getMemoryMXBean()
+            .getHeapMemoryUsage();
+        MemoryUsage nonHeap = ManagementFactory.getMemoryMXBean()
+            .getNonHeapMemoryUsage();
+        help(out, "jvm_memory_bytes_used", "gauge", "Used memory by area.");
+        sample(out, "jvm_memory_bytes_used", "{area=\"heap\"}", heap.getUsed());
+        sample(out, "jvm_memory_bytes_used", "{area=\"nonheap\"}",
+            nonHeap.getUsed());
+        help(out, "jvm_memory_bytes_committed", "gauge",
+            "Committed memory by area.");
+        sample(out, "jvm_memory_bytes_committed", "{area=\"heap\"}",
+            heap.getCommitted());
+        sample(out, "jvm_memory_bytes_committed", "{area=\"nonheap\"}",
+            nonHeap.getCommitted());
+        help(out, "jvm_memory_bytes_max", "gauge", "Maximum heap size.");
+        sample(out, "jvm_memory_bytes_max", "{area=\"heap\"}", heap.getMax());
+
+        help(out, "jvm_memory_pool_bytes_used", "gauge",
+            "Used memory by pool.");
+        for (MemoryPoolMXBean pool : ManagementFactory.getMemoryPoolMXBeans()) {
+            sample(out, "jvm_memory_pool_bytes_used",
+                "{pool=\"" + escape(pool.getName()) + "\"}",
+                pool.getUsage().getUsed());
+        }
+
+        help(out, "jvm_gc_collection_seconds", "summary",
+            "Time spent in garbage collections.");
+        for (GarbageCollectorMXBean gc
+                : ManagementFactory.getGarbageCollectorMXBeans()) {
+            String labels = "{gc=\"" + escape(gc.getName()) + "\"}";
+            sample(out, "jvm_gc_collection_seconds_count", labels,
+                gc.getCollectionCount());
+            sample(out, "jvm_gc_collection_seconds_sum", labels,
+                gc.getCollectionTime() / 1e3);
+        }
+
+        ThreadMXBean threads = ManagementFactory.getThreadMXBean();
+        help(out, "jvm_threads_current", "gauge", "Current thread count.");
+        sample(out, "jvm_threads_current", "", threads.getThreadCount());
+        help(out, "jvm_threads_daemon", "gauge", "Daemon thread count.");
+        sample(out, "jvm_threads_daemon", "", threads.getDaemonThreadCount());
+        help(out, "jvm_threads_peak", "gauge", "Peak thread count.");
+        sample(out, "jvm_threads_peak", "", threads.getPeakThreadCount());
+
+        help(out, "jvm_classes_currently_loaded", "gauge",
+            "Number of currently loaded classes.");
+        sample(out, "jvm_classes_currently_loaded", "",
+            ManagementFactory.getClassLoadingMXBean().getLoadedClassCount());
+
+        if (ManagementFactory.getOperatingSystemMXBean()
+                instanceof com.sun.management.OperatingSystemMXBean os
+                && os.getProcessCpuTime() >= 0) {
+            help(out, "process_cpu_seconds_total", "counter",
+                "User and system CPU time.");
+            sample(out, "process_cpu_seconds_total", "",
+                os.getProcessCpuTime() / 1e9);
+        }
+        help(out, "process_uptime_seconds", "gauge",
+            "Time since the JVM started.");
+        sample(out, "process_uptime_seconds", "",
+            ManagementFactory.getRuntimeMXBean().getUptime() / 1e3);
+
+        return out.toString();
+    }
+
+    private static void help(StringBuilder out, String name, String type,
+            String help) {
+        out.append("# HELP ").append(name).append(' ').append(help).append('\n');
+        out.append("# TYPE ").append(name).append(' ').append(type).append('\n');
+    }
+
+    private static void sample(StringBuilder out, String name, String labels,
+            double value) {
+        out.append(name).append(labels).append(' ').append(value).append('\n');
+    }
+
+    private static void sample(StringBuilder out, String name, String labels,
+            long value) {
+        out.append(name).append(labels).append(' ').append(value).append('\n');
+    }
+
+    private static String escape(String value) {
+        return value.replace("\\", "\\\\").replace("\"", "\\\"")
+            .replace("\n", "\\n");
+    }
+
+    private static SSLContext sslContext() throws Exception {
+        Certificate[] chain;
+        try (InputStream in = Files.newInputStream(CERT)) {
+            chain = CertificateFactory.getInstance("X.509")
+                .generateCertificates(in).toArray(new Certificate[0]);
+        }
+        KeyStore store = KeyStore.getInstance("PKCS12");
+        store.load(null, null);
+        store.setKeyEntry("ratls", loadKey(Files.readString(KEY)), PASSWORD,
+            chain);
+
+        KeyManagerFactory keyManagers = KeyManagerFactory.getInstance(
+            KeyManagerFactory.getDefaultAlgorithm());
+        keyManagers.init(store, PASSWORD);
+        SSLContext context = SSLContext.getInstance("TLS");
+        context.init(keyManagers.getKeyManagers(), null, null);
+        return context;
+    }
+
+    // JDK reads only PKCS#8 keys, while gramine-ratls writes them in
+    // traditional format (PKCS#1 for RSA, SEC1 for EC), so they are wrapped
+    private static PrivateKey loadKey(String pem) throws Exception {
+        int begin = pem.indexOf("-----BEGIN ") + "-----BEGIN ".length();
+        String type = pem.substring(begin, pem.indexOf("-----", begin));
+        byte[] der = Base64.getDecoder().decode(
+            pem.replaceAll("-----[A-Z ]+-----", "").replaceAll("\\s", ""));
+
+        switch (type) {
+        case "PRIVATE KEY":
+            try {
+                return KeyFactory.getInstance("EC")
+                    .generatePrivate(new PKCS8EncodedKeySpec(der));
+            } catch (InvalidKeySpecException e) {
+                return KeyFactory.getInstance("RSA")
+                    .generatePrivate(new PKCS8EncodedKeySpec(der));
+            }
+        case "RSA PRIVATE KEY":
+            return KeyFactory.getInstance("RSA").generatePrivate(
+                new PKCS8EncodedKeySpec(pkcs8(RSA_ALGORITHM, der)));
+        case "EC PRIVATE KEY":
+            return KeyFactory.getInstance("EC").generatePrivate(
+                new PKCS8EncodedKeySpec(pkcs8(
+                    der(0x30, concat(EC_PUBLIC_KEY, ecCurve(der))), der)));
+        default:
+            throw new IllegalArgumentException("unsupported key: " + type);
+        }
+    }
+
+    private static byte[] pkcs8(byte[] algorithm, byte[] key) {
+        return der(0x30, concat(new byte[] {0x02, 0x01, 0x00}, algorithm,
+            der(0x04, key)));
+    }
+
+    // curve OID from [0] parameters of SEC1 ECPrivateKey
+    private static byte[] ecCurve(byte[] der) {
+        int[] key = header(der, 0);
+        for (int offset = key[0]; offset < key[0] + key[1]; ) {
+            int[] element = header(der, offset);
+            if ((der[offset] & 0xff) == 0xa0) {
+                return Arrays.copyOfRange(der, element[0],
+                    element[0] + element[1]);
+            }
+            offset = element[0] + element[1];
+        }
+        throw new IllegalArgumentException("EC key without curve parameters");
+    }
+
+    // offset and length of contents of DER element at offset
+    private static int[] header(byte[] der, int offset) {
+        int start = offset + 2;
+        int length = der[offset + 1] & 0xff;
+        if (length >= 0x80) {
+            int bytes = length & 0x7f;
+            length = 0;
+            for (int i = 0; i < bytes; i++) {
+                length = (length << 8) | (der[start + i] & 0xff);
+            }
+            start += bytes;
+        }
+        return new int[] {start, length};
+    }
+
+    private static byte[] der(int tag, byte[] contents) {
+        ByteArrayOutputStream out = new ByteArrayOutputStream();
+        out.write(tag);
+        if (contents.length < 0x80) {
+            out.write(contents.length);
+        } else {
+            int bytes = (39 - Integer.numberOfLeadingZeros(contents.length)) / 8;
+            out.write(0x80 | bytes);
+            for (int i = bytes - 1; i >= 0; i--) {
+                out.write(contents.length >>> (8 * i));
+            }
+        }
+        out.writeBytes(contents);
+        return out.toByteArray();
+    }
+
+    private static byte[] concat(byte[]... parts) {
+        ByteArrayOutputStream out = new ByteArrayOutputStream();
+        for (byte[] part : parts) {
+            out.writeBytes(part);
+        }
+        return out.toByteArray();
+    }
+}
+
+{#- vim: set ft=jinja : #}
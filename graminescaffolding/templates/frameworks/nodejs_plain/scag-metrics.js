@@ -0,0 +1,95 @@
+// Generated by Gramine Scaffolding: preloaded with --require, serves runtime
+// metrics of Node.js in Prometheus text format on /metrics. The server doesn't
+// keep the process alive.
+'use strict';
+
+const { isMainThread } = require('worker_threads');
+
+if (isMainThread) {
+    const { monitorEventLoopDelay, performance } = require('perf_hooks');
+
+    const delay = monitorEventLoopDelay({ resolution: 10 });
+    delay.enable();
+    let utilization = performance.eventLoopUtilization();
+    // scag-workers.js registers its workers here
+    globalThis.scagWorkers = globalThis.scagWorkers || [];
+
+    function render() {
+        const lines = [];
+        const metric = (name, type, help, samples) => {
+            lines.push(`# HELP ${name} ${help}`, `# TYPE ${name} ${type}`);
+            for (const [labels, value] of samples) {
+                lines.push(`${name}${labels} ${value}`);
+            }
+        };
+
+        const memory = process.memoryUsage();
+        const cpu = process.cpuUsage();
+        metric('process_cpu_seconds_total', 'counter',
+            'User and system CPU time.', [['', (cpu.user + cpu.system) / 1e6]]);
+        metric('process_resident_memory_bytes', 'gauge',
+            'Resident set size.', [['', memory.rss]]);
+        metric('process_uptime_seconds', 'gauge',
+            'Time since the process started.', [['', process.uptime()]]);
+        metric('nodejs_heap_size_total_bytes', 'gauge',
+            'Size of V8 heap of the main thread.', [['', memory.heapTotal]]);
+        metric('nodejs_heap_size_used_bytes', 'gauge',
+            'Used V8 heap of the main thread.', [['', memory.heapUsed]]);
+        metric('nodejs_external_memory_bytes', 'gauge',
+            'Memory of C++ objects bound to JavaScript objects.',
+            [['', memory.external]]);
+        metric('nodejs_active_resources', 'gauge',
+            'Active handles and requests keeping the event loop alive.',
+            [['', process.getActiveResourcesInfo().length]]);
+
+        metric('nodejs_eventloop_lag_seconds', 'summary',
+            'Event loop delay of the main thread since the last scrape.', [
+                ['{quantile="0.5"}', delay.percentile(50) / 1e9],
+                ['{quantile="0.9"}', delay.percentile(90) / 1e9],
+                ['{quantile="0.99"}', delay.percentile(99) / 1e9],
+                ['_count', delay.count],
+            ]);
+        delay.reset();
+
+        const current = performance.eventLoopUtilization(utilization);
+        utilization = performance.eventLoopUtilization();
+        metric('nodejs_eventloop_utilization', 'gauge',
+            'Event loop utilization of the main thread since the last scrape.',
+            [['', current.utilization]]);
+        metric('nodejs_worker_eventloop_utilization', 'gauge',
+            'Event loop utilization of worker threads since they started.',
+            globalThis.scagWorkers.map((worker, id) => [`{worker="${id}"}`,
+                worker.performance.eventLoopUtilization().utilization]));
+
+        return lines.join('\n') + '\n';
+    }
+
+    function handle(request, response) {
+        if (request.url !== '/metrics') {
+            response.writeHead(404).end();
+            return;
+        }
+        response.writeHead(200, {
+            'Content-Type': 'text/plain; version=0.0.4',
+        }).end(render());
+    }
+
+{%- if scag.builder.http_socket %}
+
+    // behind nginx, which terminates RA-TLS
+    const server = require('http').createServer(handle);
+    server.listen({{ scag.builder.metrics_socket | tojson }});
+{%- else %}
+
+    // certificate and key are created by gramine-ratls before Node.js starts
+    const fs = require('fs');
+    const server = require('https').createServer({
+        cert: fs.readFileSync('/tmp/crt.pem'),
+        key: fs.readFileSync('/tmp/key.pem'),
+    }, handle);
+    server.listen({{ scag.builder.get_metrics_options().port }});
+{%- endif %}
+    server.unref();
+}
+
+{#- vim: set ft=jinja : #}
@@ -0,0 +1,51 @@
+// Generated by Gramine Scaffolding: runs the application in several worker
+// threads. Those are threads and not processes (like in cluster module),
+// because under Gramine every process is a separate enclave and listening
+// sockets can't be shared between enclaves.
+'use strict';
+
+const path = require('path');
+const { Worker, isMainThread, workerData } = require('worker_threads');
+
+if (isMainThread) {
+    const application = path.resolve(process.argv[2]);
+{%- if scag.builder.get_metrics_options().enable %}
+    // for event loop utilization in scag-metrics.js
+    globalThis.scagWorkers = globalThis.scagWorkers || [];
+{%- endif %}
+
+    for (let id = 0; id < {{ scag.builder.get_workers() }}; id++) {
+        const worker = new Worker(__filename, {
+            argv: process.argv.slice(3),
+            env: { ...process.env, SCAG_WORKER_ID: String(id) },
+            workerData: { application, id },
+        });
+{%- if scag.builder.get_metrics_options().enable %}
+        globalThis.scagWorkers.push(worker);
+{%- endif %}
+        worker.on('exit', (code) => {
+            console.error(`worker ${id} exited with code ${code}`);
+            process.exit(code || 1);
+        });
+    }
+} else {
+{%- if scag.builder.http_socket %}
+    // the application listens on {{ scag.builder.http_socket }}, but every
+    // worker needs its own socket, which nginx then balances across
+    const net = require('net');
+    const socket = {{ scag.builder.http_socket | tojson }};
+    const sockets = {{ scag.builder.get_http_sockets() | tojson }};
+    const listen = net.Server.prototype.listen;
+    net.Server.prototype.listen = function (...args) {
+        if (args[0] === socket) {
+            args[0] = sockets[workerData.id];
+        } else if (args[0] && args[0].path === socket) {
+            args[0] = { ...args[0], path: sockets[workerData.id] };
+        }
+        return listen.apply(this, args);
+    };
+{% endif %}
+    require(workerData.application);
+}
+
+{#- vim: set ft=jinja : #}
@@ -4,5 +4,20 @@ set -e
 
 {% block customize -%}
 {%- endblock %}
+{%- set apt = scag.builder.get_apt_options() %}
+{%- if apt.mirror.startswith('file:') %}
+
+# local mirror is not available when building docker images
+sed -i 's|^deb {{ apt.mirror }} |deb {{ scag.debian_mirror }} |' "$1"/etc/apt/sources.list
+{%- endif %}
+{%- set slim = scag.builder.get_slim_options() %}
+{%- if slim.enable %}
+
+before=$(du -sxb "$1" | cut -f1)
+{%- for path in slim.paths %}
+rm -rf -- "$1"{{ path }}
+{%- endfor %}
+echo "{{ scag.slim_report_prefix }} $((before - $(du -sxb "$1" | cut -f1))) (rootfs)"
+{%- endif %}
 
 {#- vim: set ft=jinja : #}
@@ -11,6 +11,7 @@ import click
 KEYS_PATH = pathlib.Path(__file__).parent / 'keys'
 
 FRAMEWORK_ENTRY_POINTS_GROUP = 'gramine.scaffolding.framework'
+SIGNER_ENTRY_POINTS_GROUP = 'gramine.scaffolding.signer'
 
 # TODO: after python (>= 3.10) simplify this
 # NOTE: we can't `try: importlib.metadata`, because the API has changed between 3.9 and 3.10
@@ -47,6 +48,33 @@ def gramine_load_framework(name):
             return entry.load()
     raise KeyError(name)
 
+def gramine_list_signers():
+    """
+    List available SIGSTRUCT signers.
+
+    Returns:
+        list: list of available signers
+    """
+    # TODO after python (>=3.10): remove disable
+    # pylint: disable=unexpected-keyword-arg
+    return sorted([
+        entry.name for entry in entry_points(group=SIGNER_ENTRY_POINTS_GROUP)
+    ])
+
+def gramine_load_signer(name):
+    """
+    Load signer by name.
+
+    Returns:
+        class: signer class
+    """
+    # TODO after python (>=3.10): remove disable
+    # pylint: disable=unexpected-keyword-arg
+    for entry in entry_points(group=SIGNER_ENTRY_POINTS_GROUP):
+        if entry.name == name:
+            return entry.load()
+    raise KeyError(name)
+
 class GramineExtendedSetupHelpFormatter(click.HelpFormatter):
     def write_dl(self, rows, col_max=30, col_spacing=2):
         super().write_dl(rows, col_max, col_spacing)
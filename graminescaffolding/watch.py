@@ -0,0 +1,304 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+"""
+Watching project directory for changes, used by :command:`scag-build --watch`.
+
+Changes are detected with inotify(7), which is called through :mod:`ctypes`, so
+there's no extra dependency. Files excluded from Docker build context (by
+:file:`.scag/Dockerfile.dockerignore`) are ignored, except for the config file
+and custom templates, which require rendering the templates again.
+"""
+
+import ctypes
+import ctypes.util
+import enum
+import errno
+import os
+import pathlib
+import re
+import select
+import struct
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_ONLYDIR)
+
+_EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """
+    Minimal wrapper around inotify(7) file descriptor.
+    """
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f'inotify_init1: {os.strerror(err)}')
+        self.watches = {}
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """
+        Watch a directory.
+
+        Returns:
+            bool: :obj:`False` if the directory disappeared in the meantime
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(err, f'inotify_add_watch: {os.strerror(err)}', path)
+        self.watches[wd] = pathlib.Path(path)
+        return True
+
+    def read_events(self, timeout=None):
+        """
+        Wait for events.
+
+        Args:
+            timeout (float or None): seconds, :obj:`None` means wait
+                indefinitely
+
+        Returns:
+            list: list of ``(path, mask)`` tuples; path is :obj:`None` on queue
+            overflow; empty list on timeout
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset+length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            events.append((directory / os.fsdecode(name), mask))
+        return events
+
+
+def _translate_pattern(pattern):
+    regex = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**', i):
+            regex.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            regex.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            regex.append('[^/]')
+            i += 1
+        else:
+            regex.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile(''.join(regex))
+
+
+class DockerIgnore:
+    """
+    Matcher of paths excluded from Docker build context, with syntax of
+    :file:`.dockerignore` files: patterns match paths relative to the context,
+    ``*`` and ``?`` don't match ``/``, ``**`` matches any number of
+    directories, and patterns starting with ``!`` are exceptions. Later
+    patterns take precedence. Pattern matching a directory excludes also its
+    contents.
+
+    Args:
+        lines (iterable of str): contents of the file
+    """
+    def __init__(self, lines):
+        self.patterns = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            pattern = line.removeprefix('!').strip().strip('/')
+            pattern = '/'.join(p for p in pattern.split('/') if p != '.')
+            if pattern:
+                self.patterns.append((_translate_pattern(pattern), negate))
+
+    @classmethod
+    def from_file(cls, path):
+        try:
+            with open(path, encoding='utf-8') as file:
+                return cls(file)
+        except FileNotFoundError:
+            return cls(())
+
+    @property
+    def has_exceptions(self):
+        return any(negate for _, negate in self.patterns)
+
+    def is_ignored(self, path):
+        """
+        Args:
+            path (str or pathlib.PurePath): path relative to the context
+        """
+        parts = pathlib.PurePosixPath(path).parts
+        prefixes = ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+        ignored = False
+        for regex, negate in self.patterns:
+            if any(regex.fullmatch(prefix) for prefix in prefixes):
+                ignored = not negate
+        return ignored
+
+
+class Change(enum.Flag):
+    """
+    Kinds of changes in the project.
+    """
+    #: files in build context changed, the application image needs rebuilding
+    APP = enum.auto()
+    #: configuration or templates changed, all steps need to be rerun
+    CONFIG = enum.auto()
+
+
+class ProjectWatcher:
+    """
+    Watch project directory for changes relevant for the build.
+
+    Args:
+        project_dir (pathlib.Path): project directory (Docker build context)
+        ignore_file (pathlib.Path): :file:`.dockerignore` file
+        config_paths (iterable of pathlib.Path): files and directories, changes
+            of which are reported as :attr:`Change.CONFIG`
+        exclude (iterable of pathlib.Path): directories not watched at all
+            (e.g. :file:`.scag`, where build artifacts are written)
+    """
+    def __init__(self, project_dir, ignore_file, config_paths=(), exclude=()):
+        self.project_dir = pathlib.Path(project_dir).resolve()
+        self.ignore_file = pathlib.Path(ignore_file)
+        self.config_paths = [pathlib.Path(path).resolve()
+            for path in config_paths]
+        self.exclude = [pathlib.Path(path).resolve() for path in exclude]
+        self.ignore = DockerIgnore.from_file(self.ignore_file)
+        self.inotify = Inotify()
+        self._add_tree(self.project_dir)
+        for path in self.config_paths:
+            if path.is_dir() and not self._is_under(path, [self.project_dir]):
+                self._add_tree(path)
+
+    def close(self):
+        self.inotify.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _is_under(path, parents):
+        return any(path == parent or parent in path.parents
+            for parent in parents)
+
+    def _is_config(self, path):
+        return self._is_under(path, self.config_paths)
+
+    def _add_tree(self, top):
+        for directory, dirnames, _ in os.walk(top):
+            directory = pathlib.Path(directory)
+            if not self.inotify.add_watch(directory):
+                dirnames[:] = []
+                continue
+            dirnames[:] = [name for name in dirnames
+                if not self._skip_dir(directory / name)]
+
+    def _skip_dir(self, path):
+        if self._is_under(path, self.exclude):
+            return True
+        if self._is_config(path):
+            return False
+        # without exceptions nothing under ignored directory can be included
+        return (not self.ignore.has_exceptions
+            and self._is_ignored(path))
+
+    def _is_ignored(self, path):
+        try:
+            relpath = path.relative_to(self.project_dir)
+        except ValueError:
+            return True
+        return self.ignore.is_ignored(relpath)
+
+    def _classify(self, path, mask):
+        if path is None:
+            # queue overflow, anything could have changed
+            return Change.APP | Change.CONFIG
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            if not self._skip_dir(path):
+                self._add_tree(path)
+        if self._is_under(path, self.exclude):
+            return Change(0)
+        if self._is_config(path):
+            return Change.CONFIG
+        if self._is_ignored(path):
+            return Change(0)
+        return Change.APP
+
+    def wait(self, debounce=0.5):
+        """
+        Wait for relevant changes, then wait until there are no more changes
+        for *debounce* seconds.
+
+        Returns:
+            Change: what changed
+        """
+        changes = Change(0)
+        while True:
+            events = self.inotify.read_events(debounce if changes else None)
+            if not events and changes:
+                break
+            for path, mask in events:
+                changes |= self._classify(path, mask)
+        return changes
+
+    def reload_ignore(self):
+        """
+        Read the ignore file again, e.g. after templates were rendered.
+        """
+        self.ignore = DockerIgnore.from_file(self.ignore_file)
+
+# vim: tw=80
@@ -4,6 +4,7 @@
 
 import click.testing
 import pytest
+from graminescaffolding import builder
 from graminescaffolding.__main__ import main
 
 @pytest.fixture
@@ -12,3 +13,18 @@ def cli():
     def cli(*args):
         return runner.invoke(main, args)
     yield cli
+
+@pytest.fixture
+def make_builder(tmp_path):
+    """
+    Builder of given type for a project in *project_dir* (by default
+    ``tmp_path``), with minimal config extended by keyword arguments.
+    """
+    def make_builder(buildertype=builder.PythonBuilder, project_dir=None,
+            **config):
+        return buildertype(tmp_path if project_dir is None else project_dir, {
+            'application': {'framework': buildertype.framework},
+            'gramine': {},
+            **config,
+        })
+    yield make_builder
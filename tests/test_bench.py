@@ -0,0 +1,48 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import http.server
+import threading
+
+import pytest
+
+from graminescaffolding import bench, builder
+
+@pytest.fixture
+def flask(make_builder):
+    return make_builder(builder.FlaskBuilder)
+
+def test_bench_run_cmd(flask):
+    run_cmd = bench.get_bench_run_cmd(flask, 'image', 'name')
+    assert run_cmd[-4:] == ['--rm', '--name', 'name', 'image']
+    assert '/dev/sgx_enclave' in run_cmd
+
+    run_cmd = bench.get_bench_run_cmd(flask, 'image', 'name',
+        'python3 -m http.server 8080')
+    assert run_cmd[-6:] == ['--entrypoint', 'python3', 'image',
+        '-m', 'http.server', '8080']
+    assert '/dev/sgx_enclave' not in run_cmd
+    assert bench.get_published_ports(run_cmd) == [8080]
+
+@pytest.mark.parametrize('status, ready', [(200, True), (404, True),
+    (502, False)])
+def test_probe(status, ready):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_error(status)
+        def log_message(self, *args):
+            pass
+
+    with http.server.HTTPServer(('127.0.0.1', 0), Handler) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            assert bench.probe(server.server_port) is ready
+        finally:
+            server.shutdown()
+            thread.join()
+
+def test_describe():
+    assert bench.describe([3, 1, 2, 10]) == {
+        'min': 1, 'median': 2.5, 'p90': 10, 'max': 10, 'mean': 4}
+    assert bench.describe([]) is None
@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import io
+import json
+import tarfile
+
+import tomli
+
+from graminescaffolding import buildcache
+
+def make_tar(files):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for name, data in files.items():
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+    return buf.getvalue()
+
+def make_saved_image(layers, tag):
+    return make_tar({
+        'manifest.json': json.dumps([{
+            'Config': 'config.json',
+            'RepoTags': [tag],
+            'Layers': [f'{i}/layer.tar' for i in range(len(layers))],
+        }]).encode(),
+        'config.json': b'{"rootfs": {}}',
+        **{f'{i}/layer.tar': layer for i, layer in enumerate(layers)},
+    })
+
+def test_roundtrip(tmp_path):
+    base_layer = make_tar({'usr/bin/python3': b'x' * 4096})
+    cache = buildcache.BuildCache(tmp_path / 'cache')
+    records = [
+        cache.put_saved_image(io.BytesIO(make_saved_image(layers, tag)))
+        for layers, tag in [
+            ([base_layer], 'scag-base:1'),
+            ([base_layer, make_tar({'app/app.py': b'print()'})], 'app:1'),
+        ]
+    ]
+    (tmp_path / 'hashes.json').write_text('{}')
+    cache.save_project('app', {
+        'images': records,
+        'files': {'hashes.json': cache.put_file(tmp_path / 'hashes.json')},
+    })
+
+    # shared layer and config are stored once
+    assert len(list(cache.blobs_dir.iterdir())) == 4
+
+    # restore on "another runner", from a copy of the directory
+    restored = buildcache.BuildCache(tmp_path / 'cache')
+    index = restored.load_index()['projects']['app']
+    saved = io.BytesIO()
+    restored.write_saved_image(index['images'][1], saved)
+    saved.seek(0)
+    with tarfile.open(fileobj=saved) as tar:
+        manifest, = json.load(tar.extractfile('manifest.json'))
+        assert manifest['RepoTags'] == ['app:1']
+        layers = [tar.extractfile(layer).read()
+            for layer in manifest['Layers']]
+    assert layers[0] == base_layer
+
+    restored.restore_file(index['files']['hashes.json'],
+        tmp_path / 'restored/hashes.json')
+    assert (tmp_path / 'restored/hashes.json').read_text() == '{}'
+
+def test_save_index_prunes_unused_blobs(tmp_path):
+    cache = buildcache.BuildCache(tmp_path)
+    cache.put_blob(io.BytesIO(b'stale'))
+    cache.save_index({'projects': {}})
+    assert not list(cache.blobs_dir.iterdir())
+    assert buildcache.BuildCache(tmp_path).load_index()['version'] == (
+        buildcache.CACHE_VERSION)
+
+def test_save_project_keeps_other_projects(tmp_path):
+    cache = buildcache.BuildCache(tmp_path)
+    for name in ('first', 'second'):
+        (tmp_path / f'{name}.json').write_text(name)
+        cache.save_project(name, {'images': [], 'files': {
+            'hashes.json': cache.put_file(tmp_path / f'{name}.json')}})
+    assert len(list(cache.blobs_dir.iterdir())) == 2
+
+    # re-export of one project prunes only its own stale blobs
+    (tmp_path / 'first.json').write_text('first, again')
+    cache.save_project('first', {'images': [], 'files': {
+        'hashes.json': cache.put_file(tmp_path / 'first.json')}})
+    projects = cache.load_index()['projects']
+    assert sorted(projects) == ['first', 'second']
+    assert sorted(path.name for path in cache.blobs_dir.iterdir()) == sorted(
+        entry['files']['hashes.json']['digest']
+        for entry in projects.values())
+
+def test_restored_trusted_files_are_reused(tmp_path, make_builder):
+    rootdir = tmp_path / 'root'
+    (rootdir / 'app').mkdir(parents=True)
+    (rootdir / 'app/app.py').write_text('print()')
+    manifest = tmp_path / 'app.manifest'
+    manifest.write_text('[sgx]\ntrusted_files = ["file:/app/"]\n')
+
+    # hashes from a build on another runner
+    (tmp_path / 'hashes.json').write_text(json.dumps({
+        'file:/app/app.py': ['sha256:1', 'ab' * 32],
+    }))
+    cache = buildcache.BuildCache(tmp_path / 'cache')
+    cache.save_project('project', {
+        'images': [],
+        'files': {'trusted-files-cache.json':
+            cache.put_file(tmp_path / 'hashes.json')},
+    })
+
+    project = make_builder(project_dir=tmp_path / 'project')
+    project.trusted_files_cache = (project.scag_dir
+        / 'trusted-files-cache.json')
+    assert buildcache.import_cache(project, tmp_path / 'cache')
+    assert not buildcache.import_cache(
+        make_builder(project_dir=tmp_path / 'other'), tmp_path / 'cache')
+
+    project.expand_trusted_files(rootdir, manifest, tmp_path / 'expanded',
+        {'/app/app.py': 'sha256:1'})
+    with open(tmp_path / 'expanded', 'rb') as file:
+        assert tomli.load(file)['sgx']['trusted_files'] == [
+            {'uri': 'file:/app/app.py', 'sha256': 'ab' * 32}]
@@ -0,0 +1,42 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import docker
+import pytest
+
+from graminescaffolding import buildlog
+
+def test_build_recorder():
+    messages = []
+    recorder = buildlog.BuildRecorder('.scag/Dockerfile', echo=messages.append)
+    for chunk in [
+        {'stream': 'Step 1/3 : FROM ${FROM}'},
+        {'stream': '\n'},
+        {'stream': ' ---> 0123456789ab\n'},
+        {'stream': 'Step 2/3 : COPY . .\n ---> Using cache\n'},
+        {'stream': ' ---> 123456789abc\nStep 3/3 : RUN make\n'},
+        {'stream': ' ---> Running in 23456789abcd\n'},
+        {'stream': 'scag-slim: removed bytes: 42\n'},
+        {'aux': {'ID': 'sha256:3456'}},
+        {'stream': 'Successfully built 3456789abcde\n'},
+    ]:
+        recorder.feed(chunk)
+    metrics = recorder.finish()
+
+    assert metrics['image'] == 'sha256:3456'
+    assert [(step['instruction'], step['cached'])
+        for step in metrics['steps']] == [
+        ('FROM ${FROM}', None),
+        ('COPY . .', True),
+        ('RUN make', False),
+    ]
+    assert metrics['cache_hits'] == 1
+    assert metrics['cache_misses'] == 1
+    assert all(step['duration'] is not None for step in metrics['steps'])
+    assert messages[0] == '[.scag/Dockerfile] Step 1/3 : FROM ${FROM}'
+
+def test_build_recorder_error():
+    recorder = buildlog.BuildRecorder('.scag/Dockerfile', echo=lambda m: None)
+    recorder.feed({'stream': 'Step 1/1 : RUN false\n'})
+    with pytest.raises(docker.errors.BuildError):
+        recorder.feed({'error': 'The command returned a non-zero code: 1'})
@@ -0,0 +1,46 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import threading
+
+import pytest
+
+from graminescaffolding import daemon
+
+@pytest.fixture
+def server(tmp_path):
+    server = daemon.BuildDaemon(tmp_path / 'run/daemon.sock', workers=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+def test_daemon_error(server, tmp_path):
+    messages = []
+    with pytest.raises(RuntimeError, match='unknown command'):
+        daemon.send_request(server.socket_path, {
+            'command': 'frobnicate',
+            'project_dir': str(tmp_path),
+        }, log=messages.append)
+    assert messages == [{'status': 'queued'}, {'status': 'running'}]
+
+def test_daemon_reuses_builder(server, tmp_path):
+    (tmp_path / 'scag.toml').write_text(
+        '[application]\nframework = "python_plain"\n[gramine]\n')
+    builder = server.get_builder(tmp_path, 'scag.toml')
+    assert server.get_builder(tmp_path, 'scag.toml') is builder
+
+    (tmp_path / 'scag.toml').write_text(
+        '[application]\nframework = "python_plain"\n[gramine]\n[sgx]\n')
+    assert server.get_builder(tmp_path, 'scag.toml') is not builder
+
+def test_daemon_refuses_shared_dir(tmp_path):
+    socket_dir = tmp_path / 'run'
+    socket_dir.mkdir(mode=0o777)
+    socket_dir.chmod(0o777)
+    with pytest.raises(PermissionError):
+        daemon.BuildDaemon(socket_dir / 'daemon.sock', workers=1)
+    with pytest.raises(PermissionError):
+        daemon.send_request(socket_dir / 'daemon.sock', {})
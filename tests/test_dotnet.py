@@ -0,0 +1,35 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import pytest
+
+from graminescaffolding import builder
+
+DOTNET = {
+    'build_config': 'Release',
+    'project_file': 'hello_world.csproj',
+    'target': 'hello_world',
+}
+
+@pytest.mark.parametrize('options', [
+    {'self_contained': True},
+    {'trimmed': True, 'self_contained': True},
+    {'publish': True, 'trimmed': True},
+])
+def test_publish_options_invalid(make_builder, options):
+    with pytest.raises(ValueError):
+        make_builder(builder.DotnetBuilder,
+            dotnet={**DOTNET, **options}).get_publish_options()
+
+def test_publish_runtime_image(tmp_path, make_builder):
+    make_builder(builder.DotnetBuilder,
+        dotnet={**DOTNET, 'publish': True}).render_templates()
+
+    runtime = (tmp_path / '.scag/Dockerfile-runtime').read_text()
+    assert 'dotnet-runtime-7.0' in runtime
+    assert 'dotnet-sdk-7.0' not in runtime
+
+    dockerfile = (tmp_path / '.scag/Dockerfile').read_text()
+    final_stage = dockerfile.split('FROM ${RUNTIME}')[1]
+    assert 'apt-get' not in final_stage
+    assert 'COPY --from=0 /app/publish /app/publish' in final_stage
@@ -0,0 +1,59 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import pytest
+
+from graminescaffolding import builder
+
+def test_metrics_flask(tmp_path, make_builder):
+    flask = make_builder(builder.FlaskBuilder,
+        metrics={'enable': True, 'port': 9443})
+    flask.render_templates()
+
+    nginx_conf = (tmp_path / '.scag/etc/nginx.conf').read_text()
+    assert 'listen 9443 ssl;' in nginx_conf
+    assert 'stub_status;' in nginx_conf
+    assert 'proxy_pass http://unix:/tmp/uwsgi-stats.socket:/;' in nginx_conf
+    assert '--stats /tmp/uwsgi-stats.socket' in (
+        tmp_path / '.scag/app.manifest.template').read_text()
+    assert flask.get_docker_run_cmd('image')[-3:] == [
+        '--publish', '9443:9443', 'image']
+
+def test_metrics_nodejs_plain(tmp_path, make_builder):
+    make_builder(builder.NodejsBuilder, metrics={'enable': True},
+        nodejs_plain={'application': 'app.js'}).render_templates()
+
+    manifest = (tmp_path / '.scag/app.manifest.template').read_text()
+    assert 'libos.entrypoint = "/usr/bin/gramine-ratls"' in manifest
+    assert '"file:/usr/local/etc/scag-metrics.js",' in manifest
+    assert 'server.listen(9090);' in (
+        tmp_path / '.scag/etc/scag-metrics.js').read_text()
+
+def test_metrics_java_jar(tmp_path, make_builder):
+    make_builder(builder.JavaJARBuilder, metrics={'enable': True},
+        java_jar={'application': 'app.jar'}).render_templates()
+
+    dockerfile = (tmp_path / '.scag/Dockerfile').read_text()
+    app_stage = dockerfile.split('FROM ${FROM}')[-1]
+    assert 'openjdk-17-jdk-headless' not in app_stage
+    assert 'COPY --from=0 /usr/local/lib/scag-metrics.jar' in app_stage
+    assert '-Dratls_libs=' in app_stage
+    assert '"file:/usr/lib/x86_64-linux-gnu/",' not in (
+        tmp_path / '.scag/app.manifest.template').read_text()
+
+def test_metrics_disabled(tmp_path, make_builder):
+    make_builder(builder.ExpressjsBuilder, metrics={},
+        expressjs={'application': 'index.js'}).render_templates()
+
+    assert 'stub_status' not in (tmp_path / '.scag/etc/nginx.conf').read_text()
+    assert 'scag-metrics' not in (
+        tmp_path / '.scag/app.manifest.template').read_text()
+
+@pytest.mark.parametrize('buildertype, metrics', [
+    (builder.FlaskBuilder, {'port': 0}),
+    (builder.FlaskBuilder, {'port': '9090'}),
+    (builder.PythonBuilder, {'enable': True}),
+])
+def test_metrics_invalid(make_builder, buildertype, metrics):
+    with pytest.raises(ValueError):
+        make_builder(buildertype, metrics=metrics).get_metrics_options()
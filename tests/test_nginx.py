@@ -0,0 +1,24 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import pytest
+
+from graminescaffolding import builder
+
+def test_upstream_keepalive(tmp_path, make_builder):
+    make_builder(builder.ExpressjsBuilder,
+        expressjs={'application': 'app.js'},
+        sgx={'max_threads': 8}).render_templates()
+    assert 'keepalive 8;' in (tmp_path / '.scag/etc/nginx.conf').read_text()
+
+def test_upstream_keepalive_flask(tmp_path, make_builder):
+    make_builder(builder.FlaskBuilder).render_templates()
+    nginx_conf = (tmp_path / '.scag/etc/nginx.conf').read_text()
+    assert 'uwsgi_pass backend;' in nginx_conf
+    assert '        keepalive ' not in nginx_conf
+
+def test_upstream_keepalive_flask_invalid(make_builder):
+    flask = make_builder(builder.FlaskBuilder,
+        flask={'nginx': {'upstream_keepalive': 16}})
+    with pytest.raises(ValueError):
+        flask.get_nginx_options()
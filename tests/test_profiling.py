@@ -0,0 +1,57 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import pytest
+
+from graminescaffolding import profiling
+
+PYTHON_PLAIN = {'application': 'hello_world.py'}
+
+def test_profiling_manifest(tmp_path, make_builder):
+    make_builder(python_plain=PYTHON_PLAIN,
+        profiling={'enable': True, 'mode': 'ocall_outer'},
+        sgx={'debug': True}).render_templates()
+
+    manifest = (tmp_path / '.scag/app.manifest.template').read_text()
+    assert 'sgx.enable_stats = true\n' in manifest
+    assert 'sgx.profile.mode = "ocall_outer"\n' in manifest
+    assert 'sgx.profile.frequency' not in manifest
+    # already in python_plain manifest
+    assert manifest.count('sys.enable_sigterm_injection') == 1
+
+@pytest.mark.parametrize('profiling_config, config', [
+    ({'enable': True}, {}),
+    ({'enable': True}, {'sgx': {'debug': True},
+        'variants': {'prod': {'debug': False}}}),
+    ({'mode': 'perf'}, {}),
+    ({'frequency': 0}, {}),
+])
+def test_profiling_invalid(make_builder, profiling_config, config):
+    with pytest.raises(ValueError):
+        scag_builder = make_builder(python_plain=PYTHON_PLAIN,
+            profiling=profiling_config, **config)
+        scag_builder.get_profiling_options()
+        scag_builder.get_variants()
+
+def test_parse_stats():
+    assert profiling.parse_stats('''\
+----- SGX stats for thread 87 -----
+  # of EENTERs:        224
+----- Total SGX stats for process 87 -----
+  # of EENTERs:        1224
+  # of EEXITs:         1192
+  # of AEXs:           201
+  # of sync signals:   32
+  # of async signals:  0
+''') == {'87': {'eenters': 1224, 'eexits': 1192, 'aexs': 201,
+        'sync_signals': 32, 'async_signals': 0}}
+
+def test_parse_perf_report():
+    assert profiling.parse_perf_report('''\
+# Overhead  Shared Object  Symbol
+# ........  .............  ......
+#
+     5.10%  libc.so.6      [.] memcpy
+    62.50%  python3.11     [.] _PyEval_EvalFrameDefault
+''', 1) == [{'percent': 62.5, 'dso': 'python3.11',
+        'symbol': '_PyEval_EvalFrameDefault'}]
@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+from graminescaffolding import buildregistry, prune
+
+def make_build(time, *images):
+    return {
+        'time': time,
+        'config': 'config',
+        'images': dict(zip(('rootfs', 'base', 'app', 'final'), images)),
+        'variants': {},
+    }
+
+def test_build_registry(tmp_path):
+    registry = buildregistry.BuildRegistry(tmp_path / 'builds')
+    for i in range(buildregistry.REGISTRY_LIMIT + 2):
+        registry.record(tmp_path / 'project', {
+            'config': 'config',
+            'images': {'final': f'sha256:{i}'},
+        })
+
+    builds = registry.load()[str(tmp_path / 'project')]
+    assert len(builds) == buildregistry.REGISTRY_LIMIT
+    assert builds[-1]['images'] == {'final': f'sha256:{i}'}
+
+    # build recorded after the snapshot is not dropped
+    snapshot = registry.load()
+    registry.record(tmp_path / 'project', {
+        'config': 'config',
+        'images': {'final': 'sha256:new'},
+    })
+    registry.update({str(tmp_path / 'project'): []}, snapshot=snapshot)
+    builds = registry.load()[str(tmp_path / 'project')]
+    assert [build['images'] for build in builds] == [{'final': 'sha256:new'}]
+
+    registry.update({str(tmp_path / 'project'): []})
+    assert not registry.load()
+
+def test_select_builds(tmp_path):
+    (tmp_path / 'a/.scag').mkdir(parents=True)
+    (tmp_path / 'b/.scag').mkdir(parents=True)
+    projects = {
+        str(tmp_path / 'a'): [
+            make_build(1, 'rootfs', 'base', 'app1', 'final1'),
+            make_build(3, 'rootfs', 'base', 'app2', 'final2'),
+            make_build(5, 'rootfs', 'base', 'app3', 'final3'),
+        ],
+        str(tmp_path / 'b'): [
+            make_build(2, 'rootfs', 'base', 'app4', 'final4'),
+            make_build(4, 'rootfs', 'base', 'app5', 'final5'),
+        ],
+        # removed project
+        str(tmp_path / 'c'): [make_build(6, 'rootfs', 'base', 'app6', 'final6')],
+    }
+
+    kept = prune.select_builds(projects, keep=2)
+    assert {project: [build['time'] for build in builds]
+        for project, builds in kept.items()} == {
+            str(tmp_path / 'a'): [3, 5], str(tmp_path / 'b'): [2, 4]}
+
+    # over budget: oldest builds are dropped first, but not the latest ones
+    sizes = {'rootfs': 100, 'base': 50, 'app1': 10, 'app2': 10, 'app3': 10,
+        'app4': 10, 'app5': 10}
+    kept = prune.select_builds(projects, keep=2, sizes=sizes, max_size=185)
+    assert {project: [build['time'] for build in builds]
+        for project, builds in kept.items()} == {
+            str(tmp_path / 'a'): [3, 5], str(tmp_path / 'b'): [4]}
+    kept = prune.select_builds(projects, keep=2, sizes=sizes, max_size=0)
+    assert {project: [build['time'] for build in builds]
+        for project, builds in kept.items()} == {
+            str(tmp_path / 'a'): [5], str(tmp_path / 'b'): [4]}
@@ -0,0 +1,74 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import subprocess
+
+import docker
+import pytest
+
+from graminescaffolding import builder, replicas
+
+def test_cpu_layout():
+    assert replicas.get_cpu_layout(3, cpus=range(8),
+            nodes={0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}) == [
+        {'cpus': [0, 1], 'node': 0},
+        {'cpus': [4, 5, 6, 7], 'node': 1},
+        {'cpus': [2, 3], 'node': 0},
+    ]
+    # more replicas than CPUs
+    assert replicas.get_cpu_layout(3, cpus=[0, 1], nodes={}) == [
+        {'cpus': [0], 'node': None},
+        {'cpus': [1], 'node': None},
+        {'cpus': [0], 'node': None},
+    ]
+
+def test_cpulist():
+    assert replicas.parse_cpulist('0-2,8,10-11\n') == [0, 1, 2, 8, 10, 11]
+    assert replicas.format_cpulist([11, 0, 1, 2, 8, 10]) == '0-2,8,10-11'
+
+def test_replica_run_cmds(make_builder):
+    flask = make_builder(builder.FlaskBuilder, sgx={'enclave_size': '1G'},
+        metrics={'enable': True})
+    layout = replicas.get_cpu_layout(2, cpus=range(4), nodes={})
+    first, second = replicas.get_replica_run_cmds(flask, 'image', 2, 'app',
+        layout=layout, is_free=lambda port: port != 8080)
+
+    assert first['ports'] == [8081, 9090]
+    assert second['ports'] == [8082, 9091]
+    assert second['cmd'][:10] == ['docker', 'run', '--detach',
+        '--name', 'app-1', '--cpuset-cpus', '2-3', '--memory', '1280m',
+        '--device']
+    assert second['cmd'][-5:] == ['--publish', '8082:8080',
+        '--publish', '9091:9090', 'image']
+
+def test_start_replicas_failed(monkeypatch):
+    removed = []
+
+    class Container:
+        def __init__(self, name):
+            self.name = name
+
+        def remove(self, force):
+            assert force
+            removed.append(self.name)
+
+    class Containers:
+        @staticmethod
+        def get(name):
+            if name == 'app-2':
+                raise docker.errors.NotFound(name)
+            return Container(name)
+
+    class Client:
+        containers = Containers()
+
+    def run(cmd, **_kwargs):
+        # container of the failed replica exists, docker run failed to start it
+        if cmd[-1] == 'app-1':
+            raise subprocess.CalledProcessError(125, cmd)
+
+    monkeypatch.setattr(subprocess, 'run', run)
+    with pytest.raises(subprocess.CalledProcessError):
+        replicas.start_replicas(Client(), [{'name': f'app-{index}',
+            'cmd': ['docker', 'run', f'app-{index}']} for index in range(3)])
+    assert sorted(removed) == ['app-0', 'app-1']
@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import io
+import tarfile
+
+import pytest
+
+from graminescaffolding import builder
+
+def make_rootfs(path, order, mtime, uname):
+    members = {
+        './usr/bin/perl': b'#!perl',
+        './usr/bin/perl5': None, # hard link to perl, sorts after it
+        './usr/bin/a-link': None, # hard link to zzz, sorts before it
+        './usr/bin/zzz': b'zzz',
+        './etc/hostname': b'localhost\n',
+    }
+    links = {'./usr/bin/perl5': './usr/bin/perl',
+        './usr/bin/a-link': './usr/bin/zzz'}
+
+    with tarfile.open(path, 'w', format=tarfile.PAX_FORMAT) as tar:
+        for name in order:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.mtime = mtime
+            tarinfo.uname = tarinfo.gname = uname
+            if name in links:
+                tarinfo.type = tarfile.LNKTYPE
+                tarinfo.linkname = links[name]
+                tar.addfile(tarinfo)
+            else:
+                tarinfo.size = len(members[name])
+                tar.addfile(tarinfo, io.BytesIO(members[name]))
+
+def test_normalize_tarball(tmp_path):
+    make_rootfs(tmp_path / 'a.tar',
+        ['./usr/bin/perl', './usr/bin/perl5', './usr/bin/zzz',
+            './usr/bin/a-link', './etc/hostname'],
+        mtime=1700000500, uname='root')
+    make_rootfs(tmp_path / 'b.tar',
+        ['./etc/hostname', './usr/bin/zzz', './usr/bin/a-link',
+            './usr/bin/perl', './usr/bin/perl5'],
+        mtime=1800000000, uname='builder')
+
+    for name in ('a.tar', 'b.tar'):
+        builder.normalize_tarball(tmp_path / name, 1700000000)
+    assert (tmp_path / 'a.tar').read_bytes() == (tmp_path / 'b.tar').read_bytes()
+
+    with tarfile.open(tmp_path / 'a.tar') as tar:
+        members = tar.getmembers()
+        assert [ti.name for ti in members] == sorted(ti.name for ti in members)
+        assert {ti.mtime for ti in members} == {1700000000}
+        assert {ti.uname for ti in members} == {''}
+
+        # hard link is always written after its target
+        a_link = tar.getmember('./usr/bin/a-link')
+        assert a_link.isreg()
+        assert tar.extractfile(a_link).read() == b'zzz'
+        zzz = tar.getmember('./usr/bin/zzz')
+        assert zzz.islnk() and zzz.linkname == './usr/bin/a-link'
+        assert tar.getmember('./usr/bin/perl5').linkname == './usr/bin/perl'
+
+@pytest.mark.parametrize('config, expected', [
+    ({}, 1600000000),
+    ({'source_date_epoch': 1700000000}, 1700000000),
+])
+def test_reproducible_options(make_builder, monkeypatch, config, expected):
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '1600000000')
+    options = make_builder(
+        reproducible={'enable': True, **config}).get_reproducible_options()
+    assert options == {'enable': True, 'source_date_epoch': expected}
+
+def test_reproducible_options_invalid(make_builder):
+    with pytest.raises(ValueError):
+        make_builder(reproducible={'source_date_epoch': 'yesterday'}
+            ).get_reproducible_options()
@@ -0,0 +1,19 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import tomli
+
+def test_flask_uwsgi_options(cli, tmp_path):
+    project_dir = tmp_path / 'app'
+    result = cli('setup', '--framework', 'flask',
+        '--project_dir', str(project_dir), '--bootstrap')
+    assert result.exit_code == 0, result.output
+
+    with open(project_dir / 'scag.toml', 'rb') as file:
+        config = tomli.load(file)
+    assert config['flask'] == {
+        'processes': 1,
+        'threads': 1,
+        'listen': 100,
+        'lazy_apps': False,
+    }
@@ -0,0 +1,139 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import hashlib
+import math
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from graminescaffolding import (
+    sigstruct,
+    signer as sigstruct_signer,
+)
+
+def make_sigstruct():
+    sig = bytearray(sigstruct.SIGSTRUCT_SIZE)
+    sig[128:512] = bytes(range(256)) + bytes(range(128))
+    sig[928:936] = (sigstruct.ATTRIBUTE_DEBUG
+        | sigstruct.ATTRIBUTE_MODE64BIT).to_bytes(8, 'little')
+    sig[960:992] = bytes.fromhex('ab' * 32)
+    sig[1024:1026] = (1).to_bytes(2, 'little')
+    sig[1026:1028] = (7).to_bytes(2, 'little')
+    return bytes(sig)
+
+def test_parse_sigstruct():
+    sig = make_sigstruct()
+    fields = sigstruct.parse_sigstruct(sig)
+    assert fields['mrenclave'] == 'ab' * 32
+    assert fields['mrsigner'] == hashlib.sha256(sig[128:512]).hexdigest()
+    assert fields['isv_prod_id'] == 1
+    assert fields['isv_svn'] == 7
+    assert fields['debug'] is True
+    assert fields['date'] == '0000-00-00'
+
+def test_parse_sigstruct_invalid_size():
+    with pytest.raises(ValueError):
+        sigstruct.parse_sigstruct(b'\0' * 100)
+
+_SMALL_PRIMES = math.prod(
+    n for n in range(3, 2000, 2) if all(n % d for d in range(3, n, 2)))
+
+def _generate_prime(bits, rng):
+    while True:
+        candidate = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+        # public exponent 3 needs to be coprime with p-1
+        if candidate % 3 != 2 or math.gcd(candidate, _SMALL_PRIMES) != 1:
+            continue
+        if all(pow(base, candidate - 1, candidate) == 1
+                for base in (2, 3, 5, 7, 11, 13, 17, 19, 23)):
+            return candidate
+
+class FakeSigner(sigstruct_signer.Signer):
+    def __init__(self, seed=0):
+        rng = random.Random(seed)
+        while True:
+            p = _generate_prime(1536, rng)
+            q = _generate_prime(1536, rng)
+            self.modulus = p * q
+            if self.modulus.bit_length() == 3072:
+                break
+        self.private_exponent = pow(3, -1, (p - 1) * (q - 1))
+
+    def sign(self, data):
+        # pylint: disable=protected-access
+        message = sigstruct._encode_pkcs1_v15(data)
+        return 3, self.modulus, pow(message, self.private_exponent,
+            self.modulus)
+
+def test_resign():
+    sig = make_sigstruct()
+    signer = FakeSigner()
+    new_sig = sigstruct.resign(sig, signer)
+
+    assert len(new_sig) == sigstruct.SIGSTRUCT_SIZE
+    assert (sigstruct.parse_sigstruct(new_sig)['mrenclave']
+        == sigstruct.parse_sigstruct(sig)['mrenclave'])
+    assert (sigstruct.get_int(new_sig, 'modulus') == signer.modulus)
+
+    # CPU checks signature using Q1 and Q2, see SDM
+    modulus = sigstruct.get_int(new_sig, 'modulus')
+    signature = sigstruct.get_int(new_sig, 'signature')
+    q1 = sigstruct.get_int(new_sig, 'q1')
+    q2 = sigstruct.get_int(new_sig, 'q2')
+    assert q1 * modulus <= signature ** 2 < (q1 + 1) * modulus
+    assert signature ** 3 - q1 * signature * modulus - q2 * modulus < modulus
+
+def test_resign_bad_signature():
+    class BadSigner(sigstruct_signer.Signer):
+        def sign(self, data):
+            return 3, (1 << 3071) + 1, 12345
+    with pytest.raises(ValueError):
+        sigstruct.resign(make_sigstruct(), BadSigner())
+
+@pytest.fixture
+def rsa_key(tmp_path):
+    if shutil.which('openssl') is None:
+        pytest.skip('openssl not available')
+    key = tmp_path / 'key.pem'
+    subprocess.run(['openssl', 'genpkey', '-algorithm', 'RSA',
+        '-pkeyopt', 'rsa_keygen_bits:3072', '-pkeyopt', 'rsa_keygen_pubexp:3',
+        '-out', key], check=True, capture_output=True)
+    return key
+
+def test_command_signer(tmp_path, rsa_key):
+    public_key = tmp_path / 'public.pem'
+    subprocess.run(['openssl', 'pkey', '-in', rsa_key, '-pubout',
+        '-out', public_key], check=True)
+    signer = sigstruct_signer.CommandSigner(
+        f'openssl dgst -sha256 -sign {rsa_key}', public_key)
+    assert signer.exponent == 3
+
+    new_sig = sigstruct.resign(make_sigstruct(), signer)
+    assert sigstruct.get_int(new_sig, 'modulus') == signer.modulus
+
+def test_load_rsa_public_key_pkcs1(tmp_path, rsa_key):
+    public_key = tmp_path / 'public.pem'
+    subprocess.run(['openssl', 'rsa', '-in', rsa_key, '-RSAPublicKey_out',
+        '-out', public_key], check=True, capture_output=True)
+    exponent, modulus = sigstruct_signer.load_rsa_public_key(
+        public_key.read_bytes())
+    assert exponent == 3
+    assert modulus.bit_length() == 3072
+
+@pytest.mark.parametrize('pem', [
+    b'',
+    b'-----BEGIN CERTIFICATE-----\nMAA=\n-----END CERTIFICATE-----\n',
+    b'-----BEGIN PUBLIC KEY-----\nMAA=\n-----END PUBLIC KEY-----\n',
+])
+def test_load_rsa_public_key_invalid(pem):
+    with pytest.raises(ValueError):
+        sigstruct_signer.load_rsa_public_key(pem)
+
+def test_resign_invalid_public_key(cli, tmp_path):
+    result = cli('resign', '--signer', 'command', '-o', 'command=true',
+        '-o', f'public_key={tmp_path / "missing.pem"}', 'image')
+    assert result.exit_code == 2
+    assert 'cannot create signer' in result.output
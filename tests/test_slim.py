@@ -0,0 +1,45 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import pytest
+
+from graminescaffolding import builder
+
+def test_slim_dockerfiles(tmp_path, make_builder):
+    make_builder(builder.DotnetBuilder, slim={'enable': True}, dotnet={
+        'build_config': 'Release',
+        'project_file': 'hello_world.csproj',
+        'target': 'hello_world',
+    }).render_templates()
+
+    base = (tmp_path / '.scag/Dockerfile-base').read_text()
+    assert '/usr/share/doc/*' in base
+    # SDK is needed to build the application
+    assert '/usr/share/dotnet/sdk' not in base
+
+    dockerfile = (tmp_path / '.scag/Dockerfile').read_text()
+    assert '/usr/share/dotnet/sdk ' in dockerfile
+    # application image stays layered on the base image
+    assert 'FROM scratch' not in dockerfile
+    assert dockerfile.count('FROM ') == 1
+
+def test_slim_invalid(make_builder):
+    with pytest.raises(ValueError):
+        make_builder(slim={'build_paths': ['/opt/$(reboot)']}
+            ).get_slim_options()
+
+def test_apply_whiteout(tmp_path):
+    (tmp_path / 'usr/share/doc/a').mkdir(parents=True)
+    (tmp_path / 'usr/share/man').mkdir()
+    (tmp_path / 'usr/share/man/.hidden').write_text('')
+    (tmp_path / 'etc').mkdir()
+    (tmp_path / 'etc/hostname').write_text('localhost\n')
+
+    assert builder.apply_whiteout(tmp_path, './usr/share/.wh.doc')
+    assert builder.apply_whiteout(tmp_path, 'usr/share/man/.wh..wh..opq')
+    assert builder.apply_whiteout(tmp_path, 'var/.wh.log')
+    assert not builder.apply_whiteout(tmp_path, 'etc/hostname')
+
+    assert not (tmp_path / 'usr/share/doc').exists()
+    assert not list((tmp_path / 'usr/share/man').iterdir())
+    assert (tmp_path / 'etc/hostname').exists()
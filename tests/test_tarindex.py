@@ -0,0 +1,82 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import gzip
+import io
+import json
+import tarfile
+
+import pytest
+
+from graminescaffolding import builder, tarindex
+
+def make_tar(files, symlinks=(), compress=False):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz' if compress else 'w') as tar:
+        for name, data in files.items():
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+        for name, target in symlinks:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.type = tarfile.SYMTYPE
+            tarinfo.linkname = target
+            tar.addfile(tarinfo)
+    return buf.getvalue()
+
+def make_saved_image(path, layers):
+    path.write_bytes(make_tar({
+        'manifest.json': json.dumps([{
+            'Config': 'config.json',
+            'Layers': [f'{i}/layer.tar' for i in range(len(layers))],
+        }]).encode(),
+        **{f'{i}/layer.tar': layer for i, layer in enumerate(layers)},
+    }))
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_saved_image(tmp_path, compress):
+    image = tmp_path / 'image.tar'
+    make_saved_image(image, [
+        make_tar({
+            './app/app.sig': b'old',
+            './app/removed': b'x',
+            './usr/lib/libfoo.so': b'foo',
+        }, symlinks=[('./lib', 'usr/lib')]),
+        make_tar({
+            './app/app.sig': b'new',
+            './app/.wh.removed': b'',
+        }, compress=compress),
+    ])
+
+    with tarindex.TarIndex(image, cache_dir=tmp_path / 'cache') as index:
+        assert index.read('/app/app.sig') == b'new'
+        assert index.read('/lib/libfoo.so') == b'foo'
+        with pytest.raises(KeyError):
+            index.read('/app/removed')
+
+    # second time index is loaded from cache
+    cached, = (tmp_path / 'cache').iterdir()
+    with tarindex.TarIndex(image, cache_dir=tmp_path / 'cache') as index:
+        assert index.layers == json.loads(cached.read_text())['layers']
+        assert index.read('/app/app.sig') == b'new'
+
+def test_plain_tarball(tmp_path):
+    with tarindex.TarIndex(io.BytesIO(make_tar({'app/app.sig': b'sig'}))
+            ) as index:
+        assert len(index.layers) == 1
+        assert index.read('app/app.sig') == b'sig'
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_extract_mrenclave_from_tar(compress):
+    mrenclave = bytes(range(32))
+    tarball = io.BytesIO(make_tar({
+        './app/app.sig': bytes(960) + mrenclave + bytes(832),
+    }, compress=compress))
+    assert builder.extract_mrenclave_from_tar(tarball) == mrenclave
+
+def test_compressed_tarball(tmp_path):
+    tarball = tmp_path / 'rootfs.tar.gz'
+    tarball.write_bytes(make_tar({'app/app.sig': b'sig'}, compress=True))
+    with tarindex.TarIndex(tarball, cache_dir=tmp_path / 'cache') as index:
+        assert index.read('/app/app.sig') == b'sig'
+    assert not (tmp_path / 'cache').exists()
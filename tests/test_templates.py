@@ -0,0 +1,30 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import pytest
+
+from graminescaffolding import builder
+
+PYTHON_PLAIN = {'application': 'hello_world.py'}
+
+@pytest.mark.parametrize('install, in_app', [
+    ('RUN echo installed', False),
+    ('COPY vendor.deb /tmp/\nRUN dpkg -i /tmp/vendor.deb', True),
+    ('ADD https://example.com/vendor.tar.gz /opt/', True),
+])
+def test_install_copying_files(tmp_path, make_builder, install, in_app):
+    (tmp_path / 'templates/frameworks/python_plain').mkdir(parents=True)
+    (tmp_path / 'templates/frameworks/python_plain/Dockerfile').write_text(
+        "{% extends '!frameworks/python_plain/Dockerfile' %}\n"
+        '{% block install %}\n'
+        '{{ super() }}\n'
+        f'{install}\n'
+        '{% endblock %}\n')
+    make_builder(application={'framework': 'python_plain',
+        'templates': 'templates'},
+        python_plain=PYTHON_PLAIN).render_templates()
+
+    base = (tmp_path / '.scag/Dockerfile-base').read_text()
+    app = (tmp_path / '.scag/Dockerfile').read_text()
+    assert (install in app) == in_app
+    assert (install in base) != in_app
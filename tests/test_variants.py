@@ -0,0 +1,49 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import pytest
+import tomli
+
+from graminescaffolding import builder
+
+SGX = {'sign_args': ['--key', 'default.pem']}
+
+def test_variants_defaults(tmp_path, make_builder):
+    variants = make_builder(project_dir=tmp_path / 'My App', sgx=SGX, variants={
+        'debug': {'debug': True},
+        'prod-svn2': {'isv_svn': 2, 'sign_args': ['--key', 'prod.pem']},
+    }).get_variants()
+
+    assert variants['debug'] == {
+        'debug': True,
+        'isv_svn': None,
+        'isv_prod_id': None,
+        'sign_args': ['--key', 'default.pem'],
+        'tag': 'my-app:debug',
+    }
+    assert variants['prod-svn2']['sign_args'] == ['--key', 'prod.pem']
+
+@pytest.mark.parametrize('variants', [
+    {'Debug': {}},
+    {'debug': {'isvsvn': 2}},
+])
+def test_variants_invalid(make_builder, variants):
+    with pytest.raises(ValueError):
+        make_builder(sgx=SGX, variants=variants).get_variants()
+
+def test_write_variant_manifest(tmp_path):
+    manifest = tmp_path / 'app.manifest'
+    manifest.write_text('loader.entrypoint = "file:/gramine/libsysdb.so"\n'
+        '[sgx]\ndebug = false\nisvsvn = 1\n')
+
+    builder.Builder.write_variant_manifest(manifest,
+        tmp_path / 'variant.manifest', {
+            'debug': True,
+            'isv_svn': None,
+            'isv_prod_id': 3,
+        })
+
+    with open(tmp_path / 'variant.manifest', 'rb') as file:
+        variant = tomli.load(file)
+    assert variant['loader']['entrypoint'] == 'file:/gramine/libsysdb.so'
+    assert variant['sgx'] == {'debug': True, 'isvsvn': 1, 'isvprodid': 3}
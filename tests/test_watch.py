@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: LGPL-3.0-or-later
+# Copyright (C) 2023 Intel Corporation
+
+import os
+
+import pytest
+import tomli
+
+from graminescaffolding import watch
+
+def test_dockerignore():
+    ignore = watch.DockerIgnore([
+        'scag.toml',
+        '.scag/*',
+        '!.scag/etc/',
+        '**/*.pyc',
+        '# comment',
+    ])
+    assert ignore.has_exceptions
+    assert ignore.is_ignored('scag.toml')
+    assert ignore.is_ignored('.scag/rootfs.tar')
+    assert not ignore.is_ignored('.scag/etc/nginx.conf')
+    assert ignore.is_ignored('pkg/__pycache__/mod.pyc')
+    assert not ignore.is_ignored('app.py')
+
+@pytest.fixture
+def project_dir(tmp_path):
+    (tmp_path / '.scag').mkdir()
+    (tmp_path / '.scag/Dockerfile.dockerignore').write_text('build/\n')
+    (tmp_path / 'build').mkdir()
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'scag.toml').write_text('')
+    return tmp_path
+
+def test_project_watcher(project_dir):
+    with watch.ProjectWatcher(project_dir,
+            project_dir / '.scag/Dockerfile.dockerignore',
+            config_paths=[project_dir / 'scag.toml'],
+            exclude=[project_dir / '.scag']) as watcher:
+        (project_dir / 'build/out').write_text('')
+        (project_dir / '.scag/app.sig').write_text('')
+        (project_dir / 'src/app.py').write_text('')
+        assert watcher.wait(debounce=0.1) == watch.Change.APP
+
+        (project_dir / 'scag.toml').write_text('[sgx]\n')
+        (project_dir / 'src/new').mkdir()
+        (project_dir / 'src/new/app.py').write_text('')
+        assert watcher.wait(debounce=0.1) == (
+            watch.Change.APP | watch.Change.CONFIG)
+
+def test_expand_trusted_files(tmp_path, make_builder):
+    rootdir = tmp_path / 'root'
+    (rootdir / 'app/sub').mkdir(parents=True)
+    (rootdir / 'app/a.py').write_text('a')
+    (rootdir / 'app/sub/b.py').write_text('b')
+    (rootdir / 'app/app.manifest').write_text(
+        'sgx.trusted_files = ["file:/app/", "file:/usr/bin/python3"]\n')
+    manifest_sgx = tmp_path / 'app.manifest.sgx'
+    manifest_sgx.write_text('[[sgx.trusted_files]]\n'
+        'uri = "file:/app/a.py"\nsha256 = "aa"\n')
+
+    file_layers = {'/app/a.py': 'sha256:1', '/app/sub/b.py': 'sha256:1',
+        '/app/app.manifest': 'sha256:2'}
+    builder = make_builder()
+    builder.trusted_files_cache = tmp_path / 'cache.json'
+    builder.update_trusted_files_cache(rootdir, manifest_sgx, file_layers)
+    builder.expand_trusted_files(rootdir, rootdir / 'app/app.manifest',
+        tmp_path / 'expanded.manifest', file_layers)
+
+    with open(tmp_path / 'expanded.manifest', 'rb') as file:
+        assert tomli.load(file)['sgx']['trusted_files'] == [
+            {'uri': 'file:/app/a.py', 'sha256': 'aa'},
+            'file:/app/app.manifest',
+            'file:/app/sub/b.py',
+            'file:/usr/bin/python3',
+        ]
+
+def test_expand_trusted_files_changed_layer(tmp_path, make_builder):
+    # reproducible build clamps mtime, so changed file of the same size
+    # has the same stat, but it's in a layer with another digest
+    rootdir = tmp_path / 'root'
+    (rootdir / 'app').mkdir(parents=True)
+    (rootdir / 'app/a.py').write_text('a')
+    os.utime(rootdir / 'app/a.py', ns=(0, 0))
+    (rootdir / 'app/app.manifest').write_text(
+        'sgx.trusted_files = ["file:/app/a.py"]\n')
+    manifest_sgx = tmp_path / 'app.manifest.sgx'
+    manifest_sgx.write_text('[[sgx.trusted_files]]\n'
+        'uri = "file:/app/a.py"\nsha256 = "aa"\n')
+
+    builder = make_builder()
+    builder.trusted_files_cache = tmp_path / 'cache.json'
+    builder.update_trusted_files_cache(rootdir, manifest_sgx,
+        {'/app/a.py': 'sha256:1'})
+
+    (rootdir / 'app/a.py').write_text('b')
+    os.utime(rootdir / 'app/a.py', ns=(0, 0))
+    builder.expand_trusted_files(rootdir, rootdir / 'app/app.manifest',
+        tmp_path / 'expanded.manifest', {'/app/a.py': 'sha256:2'})
+
+    with open(tmp_path / 'expanded.manifest', 'rb') as file:
+        assert tomli.load(file)['sgx']['trusted_files'] == ['file:/app/a.py']
+
+@pytest.mark.parametrize('option', [
+    ['--daemon'],
+    ['--daemon-socket', 'scag.sock'],
+    ['--measure-only'],
+    ['--check-reproducible'],
+    ['--cache-from', 'cache'],
+    ['--cache-to', 'cache'],
+    ['--metrics', os.devnull],
+    ['--print-only-image'],
+])
+def test_watch_invalid_options(cli, project_dir, option):
+    result = cli('build', '--project_dir', str(project_dir), '--watch',
+        *option)
+    assert result.exit_code == 2
+    assert '--watch can\'t be used with' in result.output